@@ -294,6 +294,21 @@ ADMIN_URL = r'^admin/'
 # ------------------------------------------------------------------------------
 DEFAULT_FILE_STORAGE = 'db_file_storage.storage.DatabaseFileStorage'
 
+# Storage backend for message attachments (any Django storage, e.g., from django-storages for
+# S3-compatible object stores) and the keyword arguments for creating it
+THREADS_ATTACHMENT_STORAGE = env.str(
+    'FLOWCELLTOOL_ATTACHMENT_STORAGE', 'django.core.files.storage.FileSystemStorage')
+THREADS_ATTACHMENT_STORAGE_OPTIONS = env.json('FLOWCELLTOOL_ATTACHMENT_STORAGE_OPTIONS', {
+    'location': str(ROOT_DIR('attachments')),
+})
+
+# Let the web server send attachments from the local file system, one of 'X-Sendfile' (Apache)
+# or 'X-Accel-Redirect' (nginx, serving THREADS_ATTACHMENT_SENDFILE_PREFIX as internal location
+# aliased to the storage location)
+THREADS_ATTACHMENT_SENDFILE_HEADER = env.str('FLOWCELLTOOL_ATTACHMENT_SENDFILE_HEADER', '')
+THREADS_ATTACHMENT_SENDFILE_PREFIX = env.str(
+    'FLOWCELLTOOL_ATTACHMENT_SENDFILE_PREFIX', '/protected-attachments/')
+
 # LDAP configuration
 # ------------------------------------------------------------------------------
 
@@ -398,3 +413,36 @@ REST_FRAMEWORK = {
 # ------------------------------------------------------------------------------
 
 FLOWCELLS_SEND_EMAILS = env.bool('FLOWCELLTOOL_SEND_EMAILS', False)
+
+# Window (in seconds) for merging flow cell update notifications per recipient into one email,
+# 0 disables merging
+FLOWCELLS_EMAIL_DIGEST_WINDOW = env.int('FLOWCELLTOOL_EMAIL_DIGEST_WINDOW', 15 * 60)
+
+# Number of most frequent adapters to display per lane on the flow cell page, all if empty
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_ADAPTERS_TOP_N = env.int('FLOWCELLTOOL_ADAPTERS_TOP_N', 10) or None
+
+# Number of mismatches per index read allowed in demultiplexing (bcl2fastq's
+# --barcode-mismatches), used for detecting barcode collisions on the lanes
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_BARCODE_MISMATCHES = env.int('FLOWCELLTOOL_BARCODE_MISMATCHES', 1)
+
+# Timeout (in seconds) of the generated sample sheets in the cache
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_SAMPLE_SHEET_CACHE_TIMEOUT = env.int(
+    'FLOWCELLTOOL_SAMPLE_SHEET_CACHE_TIMEOUT', 24 * 60 * 60)
+
+# Overlap (in seconds) subtracted from the modified_since filter of the API, such that changes
+# committed after a client's last synchronization with an earlier timestamp are not missed
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_MODIFIED_SINCE_OVERLAP = env.int('FLOWCELLTOOL_MODIFIED_SINCE_OVERLAP', 5 * 60)
+
+# Number of days to keep the tombstones of deleted objects for synchronizing API clients, see
+# the prune_tombstones management command
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_TOMBSTONE_RETENTION_DAYS = env.int('FLOWCELLTOOL_TOMBSTONE_RETENTION_DAYS', 90)
@@ -5,6 +5,8 @@ Test settings
 - Used to run tests fast on the continuous integration server and locally
 """
 
+import tempfile
+
 from .common import *  # noqa
 
 
@@ -44,6 +46,11 @@ CACHES = {
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 
+# ATTACHMENT STORAGE
+# ------------------------------------------------------------------------------
+# Keep attachments written by the tests out of the project directory
+THREADS_ATTACHMENT_STORAGE_OPTIONS = {'location': tempfile.mkdtemp(prefix='flowcelltool-test-')}
+
 # PASSWORD HASHING
 # ------------------------------------------------------------------------------
 # Use fast password hasher so tests run faster
@@ -64,3 +71,9 @@ TEMPLATES[0]['OPTIONS']['loaders'] = [
 # ------------------------------------------------------------------------------
 
 FLOWCELLS_SEND_EMAILS = True
+FLOWCELLS_EMAIL_DIGEST_WINDOW = 0
+
+# Filter the API lists by the exact modified_since
+# ------------------------------------------------------------------------------
+
+FLOWCELLS_MODIFIED_SINCE_OVERLAP = 0
@@ -1,8 +1,11 @@
 from rest_framework import serializers
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
 from django.shortcuts import get_object_or_404
 
-from ..models import BarcodeSetEntry, BarcodeSet, FlowCell, Library, SequencingMachine
+from ..models import (
+    AdapterCount, AdapterStats, BarcodeSetEntry, BarcodeSet, FlowCell, Library, SequencingMachine,
+    Tombstone)
 from ...threads.models import Message
 
 
@@ -76,6 +79,8 @@ class FlowCellSerializer(serializers.ModelSerializer):
     libraries = LibrarySerializer(many=True)
     messages = SomeKeyRelatedField(
         related_key='uuid', pk_field=serializers.UUIDField(), many=True, read_only=True)
+    #: Stored in ``FlowCellQualityScores``, read with the ``quality_scores`` action
+    info_quality_scores = serializers.JSONField(write_only=True, required=False, allow_null=True)
 
     class Meta:
         model = FlowCell
@@ -90,58 +95,147 @@ class FlowCellSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         sequencing_machine = validated_data.pop('sequencing_machine')
         libraries = validated_data.pop('libraries', [])
+        quality_scores = validated_data.pop('info_quality_scores', None)
         sequencing_machine = get_object_or_404(
             SequencingMachine, uuid=sequencing_machine.get('uuid'))
         with transaction.atomic():
             instance = super().create(validated_data)
             instance.owner = self.context['request'].user
             instance.sequencing_machine = sequencing_machine
-#            for library in libraries:
-#                barcode_set = library.pop('barcode_set', None)
-#                if barcode_set:
-#                    barcode_set = get_object_or_404(BarcodeSet, uuid=barcode_set)
-#                barcode = library.pop('barcode', None)
-#                if barcode:
-#                    barcode = get_object_or_404(BarcodeSetEntry, uuid=barcode)
-#                barcode_set2 = library.pop('barcode_set2', None)
-#                if barcode_set2:
-#                    barcode_set2 = get_object_or_404(BarcodeSet, uuid=barcode_set2)
-#                barcode = library.pop('barcode2', None)
-#                if barcode2:
-#                    barcode2 = get_object_or_404(BarcodeSetEntry, uuid=barcode2)
-#                instance.libraries.create(
-#                    barcode=barcode, barcode_set=barcode_set, barcode2=barcode2,
-#                    barcode_set2=barcode_set2, **library)
             instance.save()
+            self._save_libraries(instance, libraries)
+            if instance.info_adapters is not None:
+                AdapterStats.objects.rebuild(instance)
+            if quality_scores is not None:
+                instance.set_quality_scores(quality_scores)
         return instance
 
     def update(self, instance, validated_data):
         sequencing_machine = validated_data.pop('sequencing_machine', {})
-        libraries = validated_data.pop('libraries', [])
+        libraries = validated_data.pop('libraries', None)
         with transaction.atomic():
+            if 'info_quality_scores' in validated_data:
+                instance.set_quality_scores(validated_data.pop('info_quality_scores'))
             instance = super().update(instance, validated_data)
             if sequencing_machine:
                 instance.sequencing_machine = SequencingMachine.objects.get(
                     uuid=str(sequencing_machine.get('uuid')))
-#            instance_libs = set(lib.uuid for lib in instance.libraries.all())
-#            query_libs = set(lib.uuid for lib in libraries)
-#            for uuid in instance_libs - query_libs:  # to be removed
-#                instance.libraries.get(uuid=uuid).delete()
-#            for lib in libraries:
-#                if lib['uuid'] in query_libs - instance_libs:  # new library
-#                    instance.libraries.create(**lib)
             instance.save()
+            if libraries is not None:
+                self._save_libraries(instance, libraries)
+            if 'info_adapters' in validated_data:
+                AdapterStats.objects.rebuild(instance)
         return instance
 
+    def _save_libraries(self, instance, libraries):
+        """Create or update the ``libraries`` of ``instance`` in bulk
+
+        Existing libraries are matched by name and updated in place, such that they keep their
+        UUID.  Libraries that are not listed are left alone.
+        """
+        # Resolve all barcode sets and entries with one query each
+        set_uuids = set()
+        entry_uuids = set()
+        for library in libraries:
+            for key, uuids in (('barcode_set', set_uuids), ('barcode_set2', set_uuids),
+                               ('barcode', entry_uuids), ('barcode2', entry_uuids)):
+                if (library.get(key) or {}).get('uuid'):
+                    uuids.add(library[key]['uuid'])
+        barcode_sets = {
+            obj.uuid: obj for obj in BarcodeSet.objects.filter(uuid__in=set_uuids)}
+        barcodes = {
+            obj.uuid: obj for obj in BarcodeSetEntry.objects.filter(uuid__in=entry_uuids)}
+
+        def resolve(library, key, objs):
+            uuid = (library.get(key) or {}).get('uuid')
+            if not uuid:
+                return None
+            elif uuid not in objs:
+                raise serializers.ValidationError(
+                    {'libraries': ['Unknown {} {}'.format(key, uuid)]})
+            return objs[uuid]
+
+        # Match existing libraries by name
+        existing = {}
+        for library in instance.libraries.all():
+            existing.setdefault(library.name, []).append(library)
+        result = []
+        for values in libraries:
+            if existing.get(values['name']):
+                library = existing[values['name']].pop(0)
+            else:
+                library = Library(flow_cell=instance)
+            library.name = values['name']
+            library.reference = values.get('reference', library.reference)
+            library.lane_numbers = values['lane_numbers']
+            library.barcode_set = resolve(values, 'barcode_set', barcode_sets)
+            library.barcode = resolve(values, 'barcode', barcodes)
+            library.barcode_set2 = resolve(values, 'barcode_set2', barcode_sets)
+            library.barcode2 = resolve(values, 'barcode2', barcodes)
+            result.append(library)
+        try:
+            return Library.objects.bulk_save(instance, result)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'libraries': e.messages})
+
 
 class FlowCellPostSequencingSerializer(serializers.ModelSerializer):
     """Serializer that provides write access to the ``info_adapters`` and ``info_quality_scores``
     fields.
+
+    The adapter statistics (``AdapterStats``) are rebuilt on writing ``info_adapters``.
     """
     # TODO: add validation to JSON, for now we trust authenticated users as long as the JSON
     # TODO: is valid
 
+    #: Stored in ``FlowCellQualityScores``, read with the ``quality_scores`` action
+    info_quality_scores = serializers.JSONField(write_only=True, required=False, allow_null=True)
+
     class Meta:
         model = FlowCell
-        fields = ('uuid', 'info_adapters', 'info_quality_scores', 'status', '_permissions')
-        read_only_fields = ('uuid')
+        fields = ('uuid', 'info_adapters', 'info_quality_scores')
+        read_only_fields = ('uuid',)
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            if 'info_quality_scores' in validated_data:
+                instance.set_quality_scores(validated_data.pop('info_quality_scores'))
+            instance = super().update(instance, validated_data)
+            if 'info_adapters' in validated_data:
+                AdapterStats.objects.rebuild(instance)
+        return instance
+
+
+class AdapterCountSerializer(serializers.ModelSerializer):
+    flow_cell = serializers.UUIDField(source='stats.flow_cell.uuid', read_only=True)
+    flow_cell_name = serializers.CharField(
+        source='stats.flow_cell.get_full_name', read_only=True)
+    index_read = serializers.IntegerField(source='stats.index_read', read_only=True)
+
+    class Meta:
+        model = AdapterCount
+        fields = ('flow_cell', 'flow_cell_name', 'index_read', 'lane', 'sequence', 'count',
+                  'rank', 'ratio')
+        read_only_fields = fields
+
+
+class CollidingLibrarySerializer(serializers.Serializer):
+    uuid = serializers.UUIDField(read_only=True)
+    name = serializers.CharField(read_only=True)
+
+
+class BarcodeCollisionSerializer(serializers.Serializer):
+    """Serializer for ``collisions.BarcodeCollision`` objects"""
+
+    lane = serializers.IntegerField(read_only=True)
+    library = CollidingLibrarySerializer(read_only=True)
+    other = CollidingLibrarySerializer(read_only=True)
+    distance = serializers.IntegerField(read_only=True, allow_null=True)
+    distance2 = serializers.IntegerField(read_only=True, allow_null=True)
+
+
+class TombstoneSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tombstone
+        fields = ('uuid', 'model_name', 'deleted')
+        read_only_fields = ('uuid', 'model_name', 'deleted')
@@ -28,5 +28,7 @@ router.register(r'flowcell', views.FlowCellViewSet, base_name='flowcell')
 router.register(r'barcodeset', views.BarcodeSetViewSet, base_name='barcodeset')
 router.register(r'sequencingmachine', views.SequencingMachineViewSet, base_name='sequencingmachine')
 router.register(r'message', views.FlowCellMessageViewSet, base_name='message')
+router.register(r'adaptercount', views.AdapterCountViewSet, base_name='adaptercount')
+router.register(r'tombstone', views.TombstoneViewSet, base_name='tombstone')
 
 urlpatterns += router.urls
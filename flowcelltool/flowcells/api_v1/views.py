@@ -1,24 +1,77 @@
+import datetime
+from uuid import UUID
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Prefetch, Q, QuerySet
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import mixins, viewsets
 from rest_framework.views import APIView
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.reverse import reverse
 
-from .. import import_export
-from ..models import BarcodeSet, FlowCell, SequencingMachine
+from .. import collisions, import_export
+from ..models import (
+    AdapterCount, BarcodeSet, FlowCell, Library, SequencingMachine, Tombstone,
+    TOMBSTONE_MODEL_NAMES, get_tombstone_retention_start)
 from ...threads.models import Message
 from .serializers import (
+    AdapterCountSerializer,
+    BarcodeCollisionSerializer,
     BarcodeSetSerializer,
     FlowCellMessageSerializer,
     FlowCellSerializer,
     SequencingMachineSerializer,
-    FlowCellPostSequencingSerializer)
+    FlowCellPostSequencingSerializer,
+    TombstoneSerializer)
+
+
+# Helper for conditional GET requests -----------------------------------------
+
+
+def _is_not_modified(request, etag, last_modified):
+    """Return whether the client's cached version with ``etag`` and ``last_modified`` is current
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since`` as mandated by RFC 7232.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = [value.strip() for value in if_none_match.split(',')]
+        return '*' in etags or any(value in (etag, 'W/' + etag) for value in etags)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return bool(if_modified_since) and last_modified <= if_modified_since
+
+
+# Pagination ------------------------------------------------------------------
+
+
+class FlowCellCursorPagination(CursorPagination):
+    """Cursor pagination on ``(created, id)``, avoids ``COUNT(*)`` and ``OFFSET`` scans"""
+
+    ordering = ('-created', '-id')
+
+
+def _get_list_param(params, key):
+    """Return list of values for ``key`` from query parameters or request data ``params``
+
+    The key may be given multiple times or as a JSON list, values may be separated by commas.
+    """
+    if hasattr(params, 'getlist'):
+        values = params.getlist(key)
+    else:
+        values = params.get(key) or []
+        if not isinstance(values, list):
+            values = [values]
+    return [part.strip() for value in values for part in str(value).split(',') if part.strip()]
 
 
 # Mixin for retrieving by UUID ------------------------------------------------
@@ -28,6 +81,48 @@ class RetrieveByUuidMixin:
     lookup_field = 'uuid'
 
 
+# Mixin for incremental synchronization ---------------------------------------
+
+
+class ModifiedSinceMixin:
+    """Filter list by the ``modified_since`` query parameter (ISO 8601 date/time)
+
+    Together with the tombstones of deleted objects, this allows clients to synchronize only the
+    objects changed since their last synchronization.  The timestamps are set when saving, so a
+    change committed after the client's last synchronization can carry an earlier timestamp.
+    The filter therefore starts ``settings.FLOWCELLS_MODIFIED_SINCE_OVERLAP`` seconds before
+    ``modified_since`` and clients must expect to receive some unchanged objects again.
+    """
+
+    #: The timestamp field to filter on
+    modified_since_field = 'modified'
+
+    def get_modified_since(self):
+        """Return ``datetime`` from ``modified_since`` query parameter, ``None`` if not given"""
+        value = self.request.query_params.get('modified_since')
+        if not value:
+            return None
+        try:
+            result = parse_datetime(value)
+        except ValueError:
+            result = None
+        if result is None:
+            raise ValidationError({'modified_since': 'Invalid date/time {}'.format(value)})
+        if timezone.is_naive(result):
+            result = timezone.make_aware(result)
+        return result
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        modified_since = self.get_modified_since() if self.action == 'list' else None
+        if modified_since:
+            modified_since -= datetime.timedelta(
+                seconds=settings.FLOWCELLS_MODIFIED_SINCE_OVERLAP)
+            queryset = queryset.filter(
+                **{'{}__gte'.format(self.modified_since_field): modified_since})
+        return queryset
+
+
 # SequencingMachine API Views -------------------------------------------------
 
 
@@ -50,41 +145,198 @@ class SequencingMachineViewSet(
 
 
 class BarcodeSetViewSet(
-        RetrieveByUuidMixin, viewsets.ModelViewSet):
+        ModifiedSinceMixin, RetrieveByUuidMixin, viewsets.ModelViewSet):
     """View set for barcode sets."""
 
     queryset = BarcodeSet.objects.all()
     serializer_class = BarcodeSetSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related('entries')
+        return queryset
+
 
 # FlowCell API Views ----------------------------------------------------------
 
 
 class FlowCellViewSet(
-        RetrieveByUuidMixin, viewsets.ModelViewSet):
+        ModifiedSinceMixin, RetrieveByUuidMixin, viewsets.ModelViewSet):
     """View set for flow cells."""
 
     queryset = FlowCell.objects.all()
     serializer_class = FlowCellSerializer
+    pagination_class = FlowCellCursorPagination
 
     def by_vendor_id(self, request, vendor_id=None):
-        flowcell = get_object_or_404(self.queryset, vendor_id=vendor_id)
+        flowcell = get_object_or_404(self.get_queryset(), vendor_id=vendor_id)
         # Because this does not fit list_route or detail_route, we have to check permissions
         # manually.
         self.check_object_permissions(request, flowcell)
         return Response(self.get_serializer(flowcell).data)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'sample_sheet':
+            queryset = queryset.select_related('sequencing_machine')
+        elif self.action == 'barcode_collisions':
+            queryset = queryset.select_related('sequencing_machine').prefetch_related(
+                Prefetch('libraries', queryset=Library.objects.select_related(
+                    'barcode', 'barcode2')))
+        elif self.action in ('list', 'retrieve', 'by_vendor_id'):
+            # Load everything the serializer needs with a constant number of queries
+            queryset = queryset.select_related('sequencing_machine', 'owner').prefetch_related(
+                Prefetch('libraries', queryset=Library.objects.select_related(
+                    'barcode_set', 'barcode', 'barcode_set2', 'barcode2')),
+                Prefetch('messages', queryset=Message.objects.only(
+                    'uuid', 'content_type', 'object_id')))
+        return queryset
+
     @detail_route()
     def sample_sheet(self, request, uuid=None):
+        """Return the sample sheet in ``sheet_format``
+
+        With ``split``, the bcl2fastq v2 sample sheet is split into one file per group (see
+        ``import_export.SHEET_SPLITS``), returned as tar or zip archive as for
+        ``sample_sheets()``.
+        """
+        if request.query_params.get('split'):
+            flow_cell = self.get_object()
+            return self._sample_sheet_archive_response(
+                [flow_cell], request.query_params, file_name=flow_cell.vendor_id)
         sheet_format = request.query_params.get('sheet_format', None)
-        gen = import_export.FlowCellSampleSheetGenerator(self.get_object())
-        if sheet_format == 'csv_v1':
-            content = gen.build_v1()
-        elif sheet_format == 'csv_v2':
-            content = gen.build_v2()
-        else:  # format == 'yaml'
-            content = gen.build_yaml()
-        return HttpResponse(content, content_type='text/plain; charset=utf-8')
+        if sheet_format not in import_export.SHEET_FORMATS:
+            sheet_format = 'yaml'
+        sheet_cache = import_export.SampleSheetCache(self.get_object())
+        etag = quote_etag(sheet_cache.get_etag(sheet_format))
+        last_modified = int(sheet_cache.last_modified.timestamp())
+        if _is_not_modified(request, etag, last_modified):
+            response = HttpResponse(status=304)
+        else:
+            response = StreamingHttpResponse(
+                sheet_cache.stream(sheet_format), content_type='text/plain; charset=utf-8')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    #: Status fields that the flow cells can be selected by in ``sample_sheets()``
+    SAMPLE_SHEETS_STATUS_FILTERS = ('status_sequencing', 'status_conversion', 'status_delivery')
+
+    @list_route(methods=('get', 'post'))
+    def sample_sheets(self, request):
+        """Stream the sample sheets of many flow cells in one archive
+
+        The flow cells are selected by ``uuid`` and ``vendor_id`` (each may be given multiple
+        times) and/or the status fields, e.g., ``status_conversion=initial``.  ``sheet_format``
+        is one of ``import_export.SHEET_FORMATS``, ``archive_format`` one of
+        ``import_export.ARCHIVE_FORMATS``, defaulting to multi-document YAML for YAML sheets and
+        tar otherwise.  Flow cells without permission for the sample sheet are skipped.
+        """
+        params = request.data if request.method == 'POST' else request.query_params
+        return self._sample_sheet_archive_response(
+            self._get_sample_sheets_queryset(params), params, file_name='sample_sheets')
+
+    def _sample_sheet_archive_response(self, flow_cells, params, file_name):
+        """Return response streaming the archive with the sample sheets of ``flow_cells``
+
+        The formats and the split of the sheets are taken from ``params``, ``split`` implies v2
+        sample sheets.
+        """
+        split_by = params.get('split') or None
+        sheet_format = params.get('sheet_format') or ('csv_v2' if split_by else 'yaml')
+        if sheet_format not in import_export.SHEET_FORMATS:
+            raise ValidationError({'sheet_format': 'Invalid sheet format {}'.format(sheet_format)})
+        if split_by and (split_by not in import_export.SHEET_SPLITS or sheet_format != 'csv_v2'):
+            raise ValidationError({'split': 'Invalid split {} for sheet format {}'.format(
+                split_by, sheet_format)})
+        archive_format = params.get('archive_format') or (
+            'yaml' if sheet_format == 'yaml' else 'tar')
+        if (archive_format not in import_export.ARCHIVE_FORMATS or
+                (archive_format == 'yaml' and sheet_format != 'yaml')):
+            raise ValidationError(
+                {'archive_format': 'Invalid archive format {}'.format(archive_format)})
+        response = StreamingHttpResponse(
+            import_export.iter_sample_sheet_archive(
+                self._iter_sample_sheets_flow_cells(flow_cells), sheet_format, archive_format,
+                split_by),
+            content_type=import_export.ARCHIVE_FORMATS[archive_format])
+        if archive_format != 'yaml':
+            response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+                file_name, archive_format)
+        return response
+
+    def _get_sample_sheets_queryset(self, params):
+        """Return ``QuerySet`` of the flow cells selected by ``params`` for ``sample_sheets()``
+        """
+        uuids = _get_list_param(params, 'uuid')
+        vendor_ids = _get_list_param(params, 'vendor_id')
+        statuses = {
+            key: params.get(key) for key in self.SAMPLE_SHEETS_STATUS_FILTERS if params.get(key)}
+        if not (uuids or vendor_ids or statuses):
+            raise ValidationError('Select the flow cells by uuid, vendor_id, or status')
+        queryset = FlowCell.objects.filter(**statuses)
+        if uuids or vendor_ids:
+            try:
+                uuids = {str(UUID(value)) for value in uuids}
+            except ValueError:
+                raise ValidationError({'uuid': 'Invalid UUID'})
+            queryset = queryset.filter(Q(uuid__in=uuids) | Q(vendor_id__in=vendor_ids))
+            found = set()
+            for flow_cell_uuid, vendor_id in queryset.values_list('uuid', 'vendor_id'):
+                found |= {str(flow_cell_uuid), vendor_id}
+            missing = (uuids | set(vendor_ids)) - found
+            if missing:
+                raise ValidationError('No flow cells found for {}'.format(
+                    ', '.join(sorted(missing))))
+        return queryset
+
+    def _iter_sample_sheets_flow_cells(self, flow_cells):
+        """Yield the flow cells from ``QuerySet`` or list ``flow_cells`` that the user may get
+        the sample sheet of
+        """
+        if not isinstance(flow_cells, QuerySet):
+            flow_cells = FlowCell.objects.filter(pk__in=[flow_cell.pk for flow_cell in flow_cells])
+        for batch in import_export.iter_flow_cell_batches(flow_cells):
+            yield from (
+                flow_cell for flow_cell in batch
+                if flow_cell.has_object_sample_sheet_permission(self.request))
+
+    @detail_route()
+    def quality_scores(self, request, uuid=None):
+        """Return the quality scores, these are not part of the flow cell representation
+
+        Only the lanes given by the ``lane`` query parameters are returned, all if none is given.
+        Quality scores without the per-lane layout are always returned as a whole.
+        """
+        scores = self.get_object().get_quality_scores(
+            request.query_params.getlist('lane') or None)
+        if scores is None:
+            raise NotFound('No quality scores have been registered for this flow cell')
+        return Response(scores)
+
+    @detail_route()
+    def barcode_collisions(self, request, uuid=None):
+        """Return the libraries with colliding barcodes, optionally for ``mismatches``"""
+        mismatches = request.query_params.get('mismatches')
+        if mismatches is not None:
+            if not mismatches.isdigit():
+                raise ValidationError({'mismatches': 'Must be a non-negative integer'})
+            mismatches = int(mismatches)
+        flow_cell = self.get_object()
+        result = collisions.find_flow_cell_collisions(
+            flow_cell, flow_cell.libraries.all(), mismatches)
+        return Response(BarcodeCollisionSerializer(result, many=True).data)
+
+    @detail_route(methods=('put', 'patch'))
+    def post_sequencing(self, request, uuid=None):
+        """Write the information gathered after sequencing, e.g., by the import bot"""
+        serializer = FlowCellPostSequencingSerializer(
+            self.get_object(), data=request.data, partial=(request.method == 'PATCH'),
+            context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
 
     @detail_route(methods=('post',))
     def add_message(self, request, uuid=None):
@@ -117,3 +369,54 @@ class FlowCellMessageViewSet(
 
     queryset = Message.objects.all()
     serializer_class = FlowCellMessageSerializer
+
+
+# Adapter API Views -----------------------------------------------------------
+
+
+class AdapterCountViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """View set for looking up the runs an adapter sequence appeared in, filter with ``sequence``
+    """
+
+    queryset = AdapterCount.objects.all()
+    serializer_class = AdapterCountSerializer
+
+    def get_queryset(self):
+        sequence = self.request.query_params.get('sequence')
+        if not sequence:
+            raise ValidationError({'sequence': 'This parameter is required'})
+        return super().get_queryset().for_sequence(sequence)
+
+
+# Tombstone API Views ---------------------------------------------------------
+
+
+class TombstoneViewSet(
+        ModifiedSinceMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """View set for tombstones of deleted objects, filter with ``model`` and ``modified_since``
+
+    Tombstones are pruned after ``settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS`` days, so
+    ``modified_since`` must not be older than that.  Clients that have not synchronized for
+    longer have to fetch all objects again.
+    """
+
+    queryset = Tombstone.objects.all()
+    serializer_class = TombstoneSerializer
+    modified_since_field = 'deleted'
+
+    def get_modified_since(self):
+        result = super().get_modified_since()
+        if result is not None and result < get_tombstone_retention_start():
+            raise ValidationError({
+                'modified_since': 'Tombstones are only kept for {} days, synchronize all objects '
+                                  'again'.format(settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS)})
+        return result
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        model_name = self.request.query_params.get('model')
+        if model_name:
+            if model_name not in TOMBSTONE_MODEL_NAMES:
+                raise ValidationError({'model': 'Invalid model name {}'.format(model_name)})
+            queryset = queryset.filter(model_name=model_name)
+        return queryset
@@ -5,4 +5,4 @@ class FlowcellsAppConfig(AppConfig):
     name = 'flowcelltool.flowcells'
 
     def ready(self):
-        pass
+        from . import signals  # noqa: F401
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Detection of barcode collisions within the lanes of a flow cell
+
+Demultiplexing with bcl2fastq and ``--barcode-mismatches N`` assigns a read to a library if its
+index reads differ by at most ``N`` positions from the library's barcodes.  Two libraries on the
+same lane collide if a read can be assigned to both, i.e., if the Hamming distance between their
+barcodes is at most ``2 * N`` for each index read.  bcl2fastq refuses such sample sheets.
+
+The barcodes of a lane are encoded as NumPy arrays, from the 2-bit packed sequences stored with
+the barcodes where possible, and the pairwise Hamming distances are computed for all libraries of
+a lane at once, which keeps the check fast for 384-plex lanes.
+"""
+
+from collections import namedtuple
+
+from django.conf import settings
+import numpy as np
+
+from .models import INDEX_WORKFLOW_A
+
+#: Code used for characters other than ``ACGT`` in the encoded sequences, the codes of the
+#: bases are the ones of ``models.pack_sequence()``
+CODE_OTHER = 4
+
+#: Lookup table from byte values to the codes of the bases
+_CODE_TABLE = np.full(256, CODE_OTHER, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _CODE_TABLE[ord(_base)] = _CODE_TABLE[ord(_base.lower())] = _code
+
+#: One collision between two libraries on a lane, the distances are ``None`` if one of the
+#: libraries has no barcode for the index read
+BarcodeCollision = namedtuple(
+    'BarcodeCollision', ('lane', 'library', 'other', 'distance', 'distance2'))
+
+
+def encode_sequences(sequences):
+    """Return ``uint8`` matrix with one row of base codes per sequence in ``sequences``
+
+    All sequences are truncated to the length of the shortest one as only this prefix is
+    compared when the index reads are trimmed to it.
+    """
+    length = min((len(seq) for seq in sequences), default=0)
+    buf = ''.join(seq[:length] for seq in sequences).encode('ascii', 'replace')
+    return _CODE_TABLE[np.frombuffer(buf, dtype=np.uint8)].reshape(len(sequences), length)
+
+
+def unpack_codes(packed, length):
+    """Return ``uint8`` matrix of base codes for the ``models.pack_sequence()`` results ``packed``
+
+    Shorter sequences are padded with the code of ``A``, the matrix has ``length`` columns.
+    """
+    width = (length + 3) // 4
+    buf = b''.join(bytes(data).ljust(width, b'\0') for data in packed)
+    data = np.frombuffer(buf, dtype=np.uint8).reshape(len(packed), width)
+    codes = (data[:, :, np.newaxis] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3
+    return codes.reshape(len(packed), 4 * width)[:, :length]
+
+
+def encode_barcodes(barcodes, reverse_complement=False):
+    """Return ``uint8`` matrix with one row of base codes per ``BarcodeSetEntry`` in ``barcodes``
+
+    As for ``encode_sequences()``, all sequences are truncated to the length of the shortest one.
+    Uses the packed sequences if all barcodes have one and the precomputed reverse complements
+    otherwise.
+    """
+    packed = [barcode.sequence_2bit for barcode in barcodes]
+    if any(data is None for data in packed):
+        return encode_sequences([barcode.get_sequence(reverse_complement) for barcode in barcodes])
+    lengths = np.array([len(barcode.sequence) for barcode in barcodes], dtype=np.intp)
+    codes = unpack_codes(packed, lengths.max())
+    length = lengths.min()
+    if not reverse_complement:
+        return codes[:, :length]
+    # Reverse each sequence within its own length and complement the bases (A <-> T, C <-> G)
+    columns = lengths[:, np.newaxis] - 1 - np.arange(length)[np.newaxis, :]
+    return 3 - codes[np.arange(len(barcodes))[:, np.newaxis], columns]
+
+
+def hamming_distances(codes):
+    """Return the matrix of pairwise Hamming distances between the rows of ``codes``"""
+    result = np.zeros((codes.shape[0], codes.shape[0]), dtype=np.int32)
+    # Loop over the few positions instead of materializing an n x n x length array
+    for column in codes.T:
+        result += column[:, np.newaxis] != column[np.newaxis, :]
+    return result
+
+
+def _index_distances(barcodes, reverse_complement=False):
+    """Return ``(distances, present)`` for the ``barcodes`` of one index read
+
+    Libraries without barcode (``None``) get distance 0 to all others as they cannot be told
+    apart by this index read.
+    """
+    present = np.array([barcode is not None for barcode in barcodes], dtype=bool)
+    distances = np.zeros((len(barcodes), len(barcodes)), dtype=np.int32)
+    if present.any():
+        rows = np.flatnonzero(present)
+        distances[np.ix_(rows, rows)] = hamming_distances(encode_barcodes(
+            [barcode for barcode in barcodes if barcode is not None], reverse_complement))
+    return distances, present
+
+
+def find_collisions(libraries, dual_index_workflow=INDEX_WORKFLOW_A, mismatches=None):
+    """Return list of ``BarcodeCollision`` objects for the ``Library`` objects in ``libraries``
+
+    The second barcode is reverse-complemented for workflow B, as in the sample sheets.  By
+    default, ``settings.FLOWCELLS_BARCODE_MISMATCHES`` mismatches are allowed per index read.
+    """
+    if mismatches is None:
+        mismatches = settings.FLOWCELLS_BARCODE_MISMATCHES
+    by_lane = {}
+    for library in libraries:
+        for lane in sorted(set(library.lane_numbers or ())):
+            by_lane.setdefault(lane, []).append(library)
+
+    result = []
+    for lane, lane_libraries in sorted(by_lane.items()):
+        if len(lane_libraries) < 2:
+            continue
+        distances, present = _index_distances([lib.barcode for lib in lane_libraries])
+        distances2, present2 = _index_distances(
+            [lib.barcode2 for lib in lane_libraries],
+            reverse_complement=(dual_index_workflow != INDEX_WORKFLOW_A))
+        conflicts = np.triu(
+            (distances <= 2 * mismatches) & (distances2 <= 2 * mismatches), k=1)
+        for i, j in zip(*np.nonzero(conflicts)):
+            result.append(BarcodeCollision(
+                lane, lane_libraries[i], lane_libraries[j],
+                int(distances[i, j]) if present[i] and present[j] else None,
+                int(distances2[i, j]) if present2[i] and present2[j] else None))
+    return result
+
+
+def find_flow_cell_collisions(flow_cell, libraries=None, mismatches=None):
+    """Return list of ``BarcodeCollision`` objects for the libraries of ``flow_cell``
+
+    Uses ``libraries`` instead of the flow cell's libraries if given, e.g., for libraries that
+    are about to be imported.
+    """
+    if libraries is None:
+        libraries = flow_cell.libraries.select_related('barcode', 'barcode2')
+    machine = flow_cell.sequencing_machine
+    return find_collisions(
+        libraries, machine.dual_index_workflow if machine else INDEX_WORKFLOW_A, mismatches)
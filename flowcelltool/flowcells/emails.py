@@ -1,14 +1,37 @@
 # -*- coding: utf-8 -*-
 """Module for sending out emails
+
+Emails are not sent within the request but put into the ``OutgoingEmail`` outbox once the
+current transaction has been committed.  The ``send_queued_emails`` management command then
+sends them in batches over one SMTP connection.
 """
 
-from django.core.mail import send_mass_mail
+import datetime
+import logging
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
 from django.db.models import Q
 from django.conf import settings
+from django.utils import timezone
 
 from flowcelltool.users.models import User
 
 from . import rules
+from .models import OutgoingEmail
+
+
+#: Logger to use in this module
+LOGGER = logging.getLogger(__name__)
+
+#: Number of attempts before giving up on sending an email
+OUTBOX_MAX_ATTEMPTS = 8
+
+#: Delay before the first retry, doubled on each further failure
+OUTBOX_BACKOFF = datetime.timedelta(minutes=1)
+
+#: Maximal delay between two retries
+OUTBOX_MAX_BACKOFF = datetime.timedelta(hours=6)
 
 
 # Templates -------------------------------------------------------------------
@@ -44,6 +67,22 @@ or the Demultiplexing Operator role, or you have been assigned as the
 demultiplexing operator for this flow cell.
 """.lstrip()
 
+TEMPLATE_FLOWCELL_UPDATED_DIGEST = r"""
+Dear {recipient},
+
+The flow cell with the following id has been updated {count} times by {users}:
+
+    {full_name}
+
+You can see the updated flow cell at the following URL:
+
+    {flowcell_url}
+
+You are receiving this email because you have the Demultiplexing Administrator
+or the Demultiplexing Operator role, or you have been assigned as the
+demultiplexing operator for this flow cell.
+""".lstrip()
+
 TEMPLATE_FLOWCELL_DELETED = r"""
 Dear {recipient},
 
@@ -68,6 +107,118 @@ def _or_queries(queries):
     return result
 
 
+def _queue_emails(emails):
+    """Put ``(subject, body, sender, recipients)`` tuples into the outbox on commit
+
+    Nothing is queued if the current transaction is rolled back.
+    """
+    outgoing = [
+        OutgoingEmail(subject=subject, body=body, sender=sender, recipient=recipient)
+        for subject, body, sender, recipients in emails
+        for recipient in recipients]
+    if outgoing:
+        transaction.on_commit(lambda: OutgoingEmail.objects.bulk_create(outgoing))
+
+
+def _queue_digest_emails(emails, recipients, digest_key, template_subject, template, vals):
+    """Put emails into the outbox on commit, merging them into pending digests
+
+    ``emails`` are the ``(subject, body, sender, recipients)`` tuples of a single notification
+    for the users in ``recipients``.  Each email is held back for
+    ``settings.FLOWCELLS_EMAIL_DIGEST_WINDOW`` seconds.  Further notifications for the same
+    ``digest_key`` and recipient within this window are merged into the pending email, which is
+    then rendered from ``template_subject`` and ``template`` with the additional values
+    ``count`` and ``users``.
+    """
+    recipients = list(recipients)
+    emails = list(emails)
+    user_name = str(vals['user'])
+
+    def merge():
+        now = timezone.now()
+        window = datetime.timedelta(seconds=settings.FLOWCELLS_EMAIL_DIGEST_WINDOW)
+        with transaction.atomic():
+            # Only merge into emails that the worker will not pick up concurrently
+            pending = {
+                email.recipient: email
+                for email in OutgoingEmail.objects.select_for_update().filter(
+                    digest_key=digest_key, recipient__in=[u.email for u in recipients],
+                    failed=False, attempts=0, next_attempt__gt=now)}
+            new = []
+            for u, (subject, body, sender, _) in zip(recipients, emails):
+                email = pending.get(u.email)
+                if email is None:
+                    new.append(OutgoingEmail(
+                        subject=subject, body=body, sender=sender, recipient=u.email,
+                        next_attempt=now + window, digest_key=digest_key,
+                        digest_users=[user_name]))
+                else:
+                    email.digest_count += 1
+                    if user_name not in email.digest_users:
+                        email.digest_users.append(user_name)
+                    digest_vals = dict(
+                        vals, count=email.digest_count, users=', '.join(email.digest_users))
+                    email.subject = template_subject.format(**digest_vals)
+                    email.body = template.format(recipient=u, **digest_vals)
+                    email.save()
+            OutgoingEmail.objects.bulk_create(new)
+
+    if recipients:
+        transaction.on_commit(merge)
+
+
+# Outbox Processing -----------------------------------------------------------
+
+
+def _get_backoff(attempts):
+    """Return delay before the next attempt after ``attempts`` failed attempts"""
+    return min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+
+
+def send_queued_emails(batch_size=100):
+    """Send one batch of due emails from the outbox over one connection
+
+    Sent emails are removed from the outbox, failed ones are rescheduled with exponential backoff
+    and marked as ``failed`` after ``OUTBOX_MAX_ATTEMPTS`` attempts.  This assumes that there is
+    only one worker processing the outbox.  Return pair of numbers of sent and failed emails.
+    """
+    now = timezone.now()
+    batch = list(OutgoingEmail.objects.filter(
+        failed=False, next_attempt__lte=now).order_by('next_attempt', 'id')[:batch_size])
+    if not batch:
+        return 0, 0
+    sent, failed = [], []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:  # pylint: disable=broad-except
+        LOGGER.warning('Could not connect to mail server: %s', e)
+        failed = [(email, e) for email in batch]
+    else:
+        try:
+            for email in batch:
+                try:
+                    EmailMessage(
+                        email.subject, email.body, email.sender, [email.recipient],
+                        connection=connection).send()
+                except Exception as e:  # pylint: disable=broad-except
+                    LOGGER.warning('Could not send email to %s: %s', email.recipient, e)
+                    failed.append((email, e))
+                else:
+                    sent.append(email)
+        finally:
+            connection.close()
+    with transaction.atomic():
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in sent]).delete()
+        for email, error in failed:
+            email.attempts += 1
+            email.last_error = str(error)
+            email.failed = email.attempts >= OUTBOX_MAX_ATTEMPTS
+            email.next_attempt = now + _get_backoff(email.attempts)
+            email.save()
+    return len(sent), len(failed)
+
+
 # Signal Handlers -------------------------------------------------------------
 
 
@@ -107,8 +258,8 @@ def email_flowcell_created(user, flowcell, request=None):
             settings.EMAIL_SENDER,
             [u.email]
         ) for u in users)
-    # Actually send the emails
-    send_mass_mail(emails, fail_silently=not settings.DEBUG)
+    # Queue the emails for sending after the transaction has been committed
+    _queue_emails(emails)
 
 
 def email_flowcell_updated(user, flowcell, request=None):
@@ -147,8 +298,15 @@ def email_flowcell_updated(user, flowcell, request=None):
             settings.EMAIL_SENDER,
             [u.email]
         ) for u in users)
-    # Actually send the emails
-    send_mass_mail(emails, fail_silently=not settings.DEBUG)
+    # Queue the emails for sending after the transaction has been committed, merge updates
+    # within the digest window
+    if settings.FLOWCELLS_EMAIL_DIGEST_WINDOW:
+        _queue_digest_emails(
+            emails, users, 'flowcell_updated:{}'.format(flowcell.uuid),
+            '{EMAIL_SUBJECT_PREFIX}flow cell {full_name} updated {count} times',
+            TEMPLATE_FLOWCELL_UPDATED_DIGEST, vals)
+    else:
+        _queue_emails(emails)
 
 
 def email_flowcell_deleted(user, flowcell, request=None):
@@ -183,5 +341,5 @@ def email_flowcell_deleted(user, flowcell, request=None):
             settings.EMAIL_SENDER,
             [u.email]
         ) for u in users)
-    # Actually send the emails
-    send_mass_mail(emails, fail_silently=not settings.DEBUG)
+    # Queue the emails for sending after the transaction has been committed
+    _queue_emails(emails)
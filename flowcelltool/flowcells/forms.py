@@ -111,18 +111,34 @@ class BaseBarcodeSetEntryFormSet(BaseModelFormSet):
         super().__init__(*args, **kwargs)
         self.queryset = self.barcode_set.entries.order_by('name').all()
 
+    def clean(self):
+        """Validate uniqueness of names and sequences of the resulting entries"""
+        super().clean()
+        if any(self.errors):
+            return
+        entries = []
+        deleted = []
+        for form in self.forms:
+            if self.can_delete and self._should_delete_form(form):
+                if form.instance.pk is not None:
+                    deleted.append(form.instance)
+            elif form.has_changed():
+                entries.append(form.instance)
+        try:
+            models.BarcodeSetEntryBatchValidator(self.barcode_set).validate(entries, deleted)
+        except ValidationError as e:
+            raise ValidationError(e.messages)
+
     def save(self, *args, **kwargs):
         """Handle saving of form set, including support for deleting barcode
         set entries
+
+        All entries are validated at once and written in bulk.
         """
         with transaction.atomic():
             entries = super().save(*args, commit=False, **kwargs)
-            for entry in entries:
-                entry.barcode_set = self.barcode_set
-                entry.save()
-            for entry in self.deleted_objects:
-                entry.delete()
-            return entries
+            return models.BarcodeSetEntry.objects.bulk_save(
+                self.barcode_set, entries, deleted=self.deleted_objects)
 
 
 #: Form set for barcodes, constructed with factory function
@@ -386,18 +402,34 @@ class BaseLibraryFormSet(BaseModelFormSet):
             form.fields['barcode_set2'].choices = barcode_set_choices
             form.fields['barcode2'].choices = barcode_choices
 
+    def clean(self):
+        """Validate the resulting libraries against each other and the flow cell"""
+        super().clean()
+        if any(self.errors):
+            return
+        libraries = []
+        deleted = []
+        for form in self.forms:
+            if self.can_delete and self._should_delete_form(form):
+                if form.instance.pk is not None:
+                    deleted.append(form.instance)
+            elif form.has_changed():
+                libraries.append(form.instance)
+        try:
+            models.LibraryBatchValidator(self.flow_cell).validate(libraries, deleted)
+        except ValidationError as e:
+            raise ValidationError(e.messages)
+
     def save(self, *args, **kwargs):
         """Handle saving of form set, including support for deleting barcode
         set entries
+
+        All libraries are validated at once and written in bulk.
         """
         with transaction.atomic():
             entries = super().save(*args, commit=False, **kwargs)
-            for entry in entries:
-                entry.flow_cell = self.flow_cell
-                entry.save()
-            for entry in self.deleted_objects:
-                entry.delete()
-            return entries
+            return models.Library.objects.bulk_save(
+                self.flow_cell, entries, deleted=self.deleted_objects)
 
 
 #: Form set for barcodes, constructed with factory function
@@ -553,5 +585,30 @@ class PickColumnsForm(forms.Form):
 
 
 class ConfirmExtractionForm(forms.Form):
-    """Empty form, used for confirming that the detection worked correctly
+    """Form used for confirming that the detection worked correctly
+
+    Validates the libraries to create against each other and the flow cell's libraries, unless
+    the messages of an earlier validation are passed as ``library_errors``.
     """
+
+    def __init__(self, flow_cell=None, libraries=None, library_errors=None, *args, **kwargs):
+        super(ConfirmExtractionForm, self).__init__(*args, **kwargs)
+        self.flow_cell = flow_cell
+        self.libraries = libraries or []
+        self.library_errors = library_errors
+
+    @staticmethod
+    def validate_libraries(flow_cell, libraries):
+        """Return list of messages from validating ``libraries`` on ``flow_cell``"""
+        try:
+            models.LibraryBatchValidator(flow_cell).validate(libraries)
+        except ValidationError as e:
+            return e.messages
+        return []
+
+    def clean(self):
+        if self.library_errors is None:
+            self.library_errors = self.validate_libraries(self.flow_cell, self.libraries)
+        for message in self.library_errors:
+            self.add_error(None, message)
+        return self.cleaned_data
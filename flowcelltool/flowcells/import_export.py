@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
 """Code for importing and exporting database records to CSV and YAML sample sheets"""
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+import csv
 import datetime
+import hashlib
 import json
+import tarfile
+import time
+import zipfile
 
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.db.models import Count, Max, Prefetch
 from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+import yaml
 
 from .models import (
-    BarcodeSet, FlowCell, SequencingMachine, INDEX_WORKFLOW_A)
+    BarcodeSet, BarcodeSetEntry, FlowCell, Library, SequencingMachine, INDEX_WORKFLOW_A)
 
 # TODO: rename appropriately, we are using DRF serializer's for JSON now
 
@@ -18,114 +28,236 @@ from .models import (
 __author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
 
 
-def revcomp(s):
-    """Reverse complement function"""
-    comp_map = {
-        'A': 'T',
-        'a': 't',
-        'C': 'G',
-        'c': 'g',
-        'g': 'c',
-        'G': 'C',
-        'T': 'A',
-        't': 'a',
-    }
-    return ''.join(reversed([comp_map.get(x, x) for x in s]))
+class BarcodeSetLoader:
+    """Helper class for loading ``BarcodeSet`` with its entries from JSON
 
+    The entries are validated at once and inserted with one ``bulk_create()``, in the same
+    transaction as the barcode set.  Raises ``ValueError`` on malformed JSON, ``ValidationError``
+    on duplicate entry names or sequences, and ``IntegrityError`` on duplicate short names.
+    """
 
-def identity(s):
-    """Identity function"""
-    return s
+    def run(self, payload):
+        """Load barcode set from JSON string ``payload``, return ``BarcodeSet``"""
+        data = json.loads(payload)
+        try:
+            entries = [
+                BarcodeSetEntry(name=entry['name'], sequence=entry['sequence'])
+                for entry in data.get('entries', [])]
+            values = {
+                'name': data['name'],
+                'short_name': data['short_name'],
+                'description': data.get('description'),
+            }
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError('Invalid barcode set JSON: {}'.format(e))
+        with transaction.atomic():
+            barcode_set = BarcodeSet.objects.create(**values)
+            BarcodeSetEntry.objects.bulk_save(barcode_set, entries)
+        return barcode_set
+
+
+#: Barcode information for sample sheet generation; ``set_name`` is the short name of the barcode
+#: set or ``None``, ``sequence_revcomp`` is the precomputed reverse complement of ``sequence``
+SheetBarcode = namedtuple('SheetBarcode', ('set_name', 'name', 'sequence', 'sequence_revcomp'))
+
+#: Library information for sample sheet generation, ``barcode``/``barcode2`` are ``SheetBarcode``
+#: objects or ``None``, ``lane_numbers`` is sorted
+SheetLibrary = namedtuple(
+    'SheetLibrary', ('name', 'reference', 'barcode', 'barcode2', 'lane_numbers'))
+
+
+def _sheet_barcode(barcode_set, barcode):
+    """Return ``SheetBarcode`` for the given ``BarcodeSet`` and ``BarcodeSetEntry``"""
+    if barcode is None:
+        return None
+    else:
+        return SheetBarcode(
+            barcode_set.short_name if barcode_set else None, barcode.name, barcode.sequence,
+            barcode.get_sequence(reverse_complement=True))
+
+
+class _EchoBuffer:
+    """File-like object whose ``write()`` returns the value, for streaming ``csv.writer`` rows"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Yield the lines of CSV file with the given ``rows``"""
+    writer = csv.writer(_EchoBuffer(), lineterminator='\n')
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _FlowList(list):
+    """List that is written in YAML flow style, e.g., ``[1, 2]``"""
+
+
+class _SheetDumper(yaml.SafeDumper):
+    """YAML dumper that keeps the order of ``OrderedDict`` keys and writes ``_FlowList`` inline"""
+
+
+_SheetDumper.add_representer(
+    OrderedDict, lambda dumper, data: dumper.represent_mapping(
+        'tag:yaml.org,2002:map', data.items()))
+_SheetDumper.add_representer(
+    _FlowList, lambda dumper, data: dumper.represent_sequence(
+        'tag:yaml.org,2002:seq', data, flow_style=True))
+
+
+def dump_yaml(data, indent=0):
+    """Return YAML block representation of ``data``, each line indented by ``indent`` spaces"""
+    text = yaml.dump(data, Dumper=_SheetDumper, default_flow_style=False, allow_unicode=True)
+    return ''.join(' ' * indent + line for line in text.splitlines(True))
 
 
 class FlowCellSampleSheetGenerator:
-    """Helper class for generating sample sheet from FlowCell instance"""
+    """Helper class for generating sample sheet from FlowCell instance
 
-    def __init__(self, flow_cell):
+    The libraries are loaded with their barcodes in one query into a list of ``SheetLibrary``
+    objects that is shared by all output formats.  The ``iter_*()`` methods yield the sample
+    sheets line by line (or library by library for YAML) for streaming them, the ``build_*()``
+    methods return them as one string.
+    """
+
+    def __init__(self, flow_cell, libraries=None):
         #: The flow cell to dump
         self.flow_cell = flow_cell
+        #: The flow cell's ``Library`` objects with their barcodes and barcode sets, sorted by
+        #: name, e.g., prefetched for many flow cells; loaded from the database if ``None``
+        self.library_objects = libraries
 
-    def build_yaml(self):
-        """Return YAML representation of sample sheet"""
-        if (self.flow_cell.sequencing_machine.dual_index_workflow ==
-                INDEX_WORKFLOW_A):
-            idx2mod = identity
-        else:
-            idx2mod = revcomp
-        rows = [
-            '# CUBI Flow Cell YAML',
-            '- name: {}'.format(repr(self.flow_cell.get_full_name())),
-            '  num_lanes: {}'.format(self.flow_cell.num_lanes),
-            '  operator: {}'.format(repr(self.flow_cell.operator)),
-            '  rta_version: {}'.format(self.flow_cell.rta_version),
-            '  is_paired: {}'.format(
-                'true' if self.flow_cell.is_paired else 'false'),
-            '  status_sequencing: {}'.format(self.flow_cell.status_delivery),
-            '  status_conversion: {}'.format(self.flow_cell.status_conversion),
-            '  status_delivery: {}'.format(self.flow_cell.status_delivery),
-            '  delivery_type: {}'.format(self.flow_cell.delivery_type),
-            '  read_length: {}'.format(self.flow_cell.read_length),
-        ]
-        if not self.flow_cell.libraries.count():
-            rows.append('  libraries: []')
-            return '\n'.join(rows)
-        rows.append('  libraries:')
-        for lib in self.flow_cell.libraries.order_by('name'):
-            rows += [
-                '    - name: {}'.format(repr(lib.name)),
-                '      reference: {}'.format(repr(lib.reference)),
-            ]
-            if lib.barcode_set and lib.barcode:
-                rows += [
-                    '      barcode_set: {}'.format(repr(
-                        lib.barcode_set.short_name)),
-                    '      barcode:',
-                    '        name: {}'.format(repr(lib.barcode.name)),
-                    '        seq: {}'.format(repr(lib.barcode.sequence)),
-                ]
-            if lib.barcode_set2 and lib.barcode2:
-                rows += [
-                    '      barcode_set2: {}'.format(repr(
-                        lib.barcode_set2.short_name)),
-                    '      barcode2:',
-                    '        name: {}'.format(repr(lib.barcode2.name)),
-                    '        seq: {}'.format(repr(idx2mod(
-                        lib.barcode2.sequence))),
-                ]
-            rows += [
-                '      lanes: {}'.format(list(sorted(lib.lane_numbers))),
-            ]
-        return '\n'.join(rows) + '\n'
+    @cached_property
+    def libraries(self):
+        """Return list of ``SheetLibrary`` objects for the flow cell, sorted by name"""
+        queryset = self.library_objects
+        if queryset is None:
+            queryset = self.flow_cell.libraries.order_by('name').select_related(
+                'barcode_set', 'barcode', 'barcode_set2', 'barcode2')
+        return [
+            SheetLibrary(
+                lib.name, lib.reference,
+                _sheet_barcode(lib.barcode_set, lib.barcode),
+                _sheet_barcode(lib.barcode_set2, lib.barcode2),
+                list(sorted(lib.lane_numbers)))
+            for lib in queryset]
 
-    def build_v1(self):
-        """To bcl2fastq v1 sample sheet CSV file"""
-        rows = [['FCID', 'Lane', 'SampleID', 'SampleRef', 'Index',
-                 'Description', 'Control', 'Recipe', 'Operator',
-                 'SampleProject']]
+    def get_file_name(self, sheet_format, suffix=None):
+        """Return file name for the sample sheet in the given format, e.g., of a split sheet"""
+        extension = 'yaml' if sheet_format == 'yaml' else 'csv'
+        name = self.flow_cell.get_full_name() or self.flow_cell.vendor_id
+        if suffix:
+            name += '_' + suffix
+        return '{}.{}'.format(name, extension)
+
+    def iter(self, sheet_format):
+        """Yield the chunks of the sample sheet in the given format (see ``SHEET_FORMATS``)"""
+        return getattr(self, SHEET_FORMATS[sheet_format])()
+
+    def iter_yaml(self):
+        """Yield YAML representation of sample sheet"""
+        yield '# CUBI Flow Cell YAML\n'
+        yield dump_yaml([OrderedDict((
+            ('name', self.flow_cell.get_full_name()),
+            ('num_lanes', self.flow_cell.num_lanes),
+            ('operator', self.flow_cell.operator),
+            ('rta_version', self.flow_cell.rta_version),
+            ('is_paired', self.flow_cell.is_paired),
+            ('status_sequencing', self.flow_cell.status_sequencing),
+            ('status_conversion', self.flow_cell.status_conversion),
+            ('status_delivery', self.flow_cell.status_delivery),
+            ('delivery_type', self.flow_cell.delivery_type),
+            ('read_length', self.flow_cell.read_length),
+        ))])
+        if not self.libraries:
+            yield '  libraries: []\n'
+            return
+        yield '  libraries:\n'
+        for lib in self.libraries:
+            values = OrderedDict((('name', lib.name), ('reference', lib.reference)))
+            if lib.barcode and lib.barcode.set_name:
+                values['barcode_set'] = lib.barcode.set_name
+                values['barcode'] = OrderedDict((
+                    ('name', lib.barcode.name), ('seq', lib.barcode.sequence)))
+            if lib.barcode2 and lib.barcode2.set_name:
+                values['barcode_set2'] = lib.barcode2.set_name
+                values['barcode2'] = OrderedDict((
+                    ('name', lib.barcode2.name),
+                    ('seq', lib.barcode2.sequence_revcomp if self.use_revcomp
+                     else lib.barcode2.sequence)))
+            values['lanes'] = _FlowList(lib.lane_numbers)
+            yield dump_yaml([values], indent=4)
+
+    def iter_v1(self):
+        """Yield lines of bcl2fastq v1 sample sheet CSV file"""
+        return iter_csv(self._rows_v1())
+
+    def _rows_v1(self):
+        yield ['FCID', 'Lane', 'SampleID', 'SampleRef', 'Index', 'Description', 'Control',
+               'Recipe', 'Operator', 'SampleProject']
         if self.flow_cell.is_paired:
             recipe = 'PE_indexing'
         else:
             recipe = 'SE_indexing'
-        for lib in self.flow_cell.libraries.order_by('name'):
-            for lane_no in sorted(lib.lane_numbers):
-                rows.append([
+        for lib in self.libraries:
+            for lane_no in lib.lane_numbers:
+                yield [
                     self.flow_cell.vendor_id,
                     lane_no,
                     lib.name,
                     lib.reference,
-                    lib.barcode.sequence,
+                    lib.barcode.sequence if lib.barcode else '',
                     '',
                     'N',  # not PhiX
                     recipe,
                     self.flow_cell.operator,
                     'Project',
-                ])
-        return '\n'.join(','.join(map(str, row)) for row in rows) + '\n'  # noqa
+                ]
 
-    def build_v2(self):
-        """To bcl2fastq v2 sample sheet CSV file"""
+    @cached_property
+    def use_revcomp(self):
+        """Whether the second index is written reverse-complemented, for workflow B"""
+        machine = self.flow_cell.sequencing_machine
+        return machine is not None and machine.dual_index_workflow != INDEX_WORKFLOW_A
+
+    def iter_v2(self):
+        """Yield lines of bcl2fastq v2 sample sheet CSV file"""
+        return iter_csv(self._rows_v2(
+            (lane_no, lib) for lib in self.libraries for lane_no in lib.lane_numbers))
+
+    def split_v2(self, split_by):
+        """Return list of ``(suffix, chunks)`` for one bcl2fastq v2 sample sheet per group
+
+        The groups are the lanes for ``split_by='lane'`` and the libraries with the same lengths
+        of the indices for ``split_by='index_length'`` (see ``SHEET_SPLITS``), such that a lane
+        with libraries of different index lengths is spread over several sheets.  Each group can
+        be demultiplexed by its own bcl2fastq run.
+        """
+        groups = OrderedDict()
+        entries = sorted(
+            ((lane_no, lib) for lib in self.libraries for lane_no in lib.lane_numbers),
+            key=lambda entry: entry[0])
+        for lane_no, lib in entries:
+            if split_by == 'lane':
+                key = 'lane_{}'.format(lane_no)
+            else:
+                key = 'index_{}_{}'.format(
+                    len(lib.barcode.sequence) if lib.barcode else 0,
+                    len(lib.barcode2.sequence) if lib.barcode2 else 0)
+            groups.setdefault(key, []).append((lane_no, lib))
+        return [(key, iter_csv(self._rows_v2(group))) for key, group in groups.items()]
+
+    def _rows_v2(self, entries):
+        """Yield rows of v2 sample sheet with the ``(lane_no, library)`` pairs in ``entries``
+
+        The ``I5_Index_ID`` and ``index2`` columns are only written if any of the libraries in
+        ``entries`` has a second barcode.
+        """
+        entries = list(entries)
+        is_dual_indexed = any(lib.barcode2 for _, lib in entries)
         date = self.flow_cell.run_date.strftime("%y/%m/%d")
-        rows = [
+        yield from [
             ['[Header]'],
             ['IEMFileVersion', '4'],
             ['Investigator Name', self.flow_cell.operator],
@@ -140,24 +272,216 @@ class FlowCellSampleSheetGenerator:
             [str(self.flow_cell.read_length)],
         ]
         if self.flow_cell.is_paired:
-            rows.append([str(self.flow_cell.read_length)])
-        rows += [
-            [],
-            ['[Data]'],
-            ['Lane', 'Sample_ID', 'Sample_Name', 'Sample_Plate', 'Sample_Well',
-             'i7_Index_ID', 'index', 'Sample_Project', 'Description'],
-        ]
-        for lib in self.flow_cell.libraries.order_by('name'):
-            for lane_no in sorted(lib.lane_numbers):
-                rows.append([
-                    lane_no,
-                    lib.name,
-                    '',
-                    '',
-                    '',
-                    lib.barcode.name,
-                    lib.barcode.sequence,
-                    'Project',
-                    '',
-                ])
-        return '\n'.join(','.join(map(str, row)) for row in rows) + '\n'  # noqa
+            yield [str(self.flow_cell.read_length)]
+        header = ['Lane', 'Sample_ID', 'Sample_Name', 'Sample_Plate', 'Sample_Well',
+                  'i7_Index_ID', 'index']
+        if is_dual_indexed:
+            header += ['I5_Index_ID', 'index2']
+        yield from [[], ['[Data]'], header + ['Sample_Project', 'Description']]
+        for lane_no, lib in entries:
+            row = [
+                lane_no,
+                lib.name,
+                '',
+                '',
+                '',
+                lib.barcode.name if lib.barcode else '',
+                lib.barcode.sequence if lib.barcode else '',
+            ]
+            if is_dual_indexed:
+                row += [
+                    lib.barcode2.name if lib.barcode2 else '',
+                    (lib.barcode2.sequence_revcomp if self.use_revcomp
+                     else lib.barcode2.sequence) if lib.barcode2 else '',
+                ]
+            yield row + ['Project', '']
+
+    def build_yaml(self):
+        """Return YAML representation of sample sheet"""
+        return ''.join(self.iter_yaml())
+
+    def build_v1(self):
+        """To bcl2fastq v1 sample sheet CSV file"""
+        return ''.join(self.iter_v1())
+
+    def build_v2(self):
+        """To bcl2fastq v2 sample sheet CSV file"""
+        return ''.join(self.iter_v2())
+
+
+#: ``FlowCellSampleSheetGenerator`` methods yielding the sample sheet by format
+SHEET_FORMATS = OrderedDict((
+    ('yaml', 'iter_yaml'),
+    ('csv_v1', 'iter_v1'),
+    ('csv_v2', 'iter_v2'),
+))
+
+#: Ways of splitting the bcl2fastq v2 sample sheets, see
+#: ``FlowCellSampleSheetGenerator.split_v2()``
+SHEET_SPLITS = ('lane', 'index_length')
+
+
+class SampleSheetCache:
+    """Content-addressed cache for the sample sheets of a flow cell
+
+    The cache key (also used as the ``ETag``) is a hash over the flow cell's ``modified``
+    timestamp, the latest ``modified`` timestamp and count of its libraries and their barcodes
+    and barcode sets, and the machine's dual indexing workflow.  These values are loaded with one
+    aggregate query.  Saving or deleting libraries touches the flow cell's ``modified``
+    timestamp, so any change yields a new key and stale sheets are never served.
+    """
+
+    #: Prefix for the keys in the Django cache
+    KEY_PREFIX = 'flowcells:sample_sheet:'
+
+    def __init__(self, flow_cell):
+        #: The flow cell to generate sample sheets for
+        self.flow_cell = flow_cell
+
+    @cached_property
+    def stats(self):
+        """Return aggregated timestamps and count of the libraries and barcodes"""
+        return self.flow_cell.libraries.aggregate(
+            num_libraries=Count('pk'),
+            libraries=Max('modified'),
+            barcode_sets=Max('barcode_set__modified'),
+            barcodes=Max('barcode__modified'),
+            barcode_sets2=Max('barcode_set2__modified'),
+            barcodes2=Max('barcode2__modified'))
+
+    @cached_property
+    def last_modified(self):
+        """Return ``datetime`` of the last change that affects the sample sheets"""
+        machine = self.flow_cell.sequencing_machine
+        candidates = [self.flow_cell.modified, machine.modified if machine else None]
+        candidates += [value for key, value in self.stats.items() if key != 'num_libraries']
+        return max(value for value in candidates if value)
+
+    def get_etag(self, sheet_format):
+        """Return ``ETag`` value (and cache key) for the given sheet format"""
+        machine = self.flow_cell.sequencing_machine
+        values = [
+            self.flow_cell.uuid, self.flow_cell.modified.isoformat(),
+            machine.modified.isoformat() if machine else None,
+            machine.dual_index_workflow if machine else None, sheet_format,
+        ] + [self.stats[key] for key in sorted(self.stats)]
+        return hashlib.sha1('|'.join(map(str, values)).encode('utf-8')).hexdigest()
+
+    def get(self, sheet_format, generator=None):
+        """Return sample sheet in the given format, generate and store it if necessary"""
+        return ''.join(self.stream(sheet_format, generator))
+
+    def stream(self, sheet_format, generator=None):
+        """Yield sample sheet in the given format in chunks
+
+        A cached sheet is yielded in one piece.  Otherwise, the chunks are yielded as they are
+        generated and the sheet is stored once it is complete, so only one sheet is held in
+        memory at a time.
+        """
+        key = self.KEY_PREFIX + self.get_etag(sheet_format)
+        content = cache.get(key)
+        if content is not None:
+            yield content
+            return
+        generator = generator or FlowCellSampleSheetGenerator(self.flow_cell)
+        chunks = []
+        for chunk in generator.iter(sheet_format):
+            chunks.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(chunks), settings.FLOWCELLS_SAMPLE_SHEET_CACHE_TIMEOUT)
+
+
+# Sample sheets of many flow cells --------------------------------------------
+
+#: Archive formats for the sample sheets of many flow cells with their content types, ``yaml``
+#: is a multi-document YAML file and only available for YAML sample sheets
+ARCHIVE_FORMATS = OrderedDict((
+    ('yaml', 'text/plain; charset=utf-8'),
+    ('tar', 'application/x-tar'),
+    ('zip', 'application/zip'),
+))
+
+#: Number of flow cells loaded at a time by ``iter_flow_cell_batches()``
+BATCH_SIZE = 50
+
+
+def iter_flow_cell_batches(queryset, batch_size=BATCH_SIZE):
+    """Yield lists of the ``FlowCell`` objects in ``queryset``, ``batch_size`` at a time
+
+    Each batch is loaded with its sequencing machines and its libraries (sorted by name, with
+    their barcodes) in two queries.  Only one batch is held in memory at a time.
+    """
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    libraries = Prefetch('libraries', queryset=Library.objects.order_by('name').select_related(
+        'barcode_set', 'barcode', 'barcode_set2', 'barcode2'))
+    for start in range(0, len(pks), batch_size):
+        yield list(
+            FlowCell.objects.filter(pk__in=pks[start:start + batch_size]).order_by('pk')
+            .select_related('sequencing_machine').prefetch_related(libraries))
+
+
+class _ChunkBuffer:
+    """Write-only file-like object that collects the written data for streaming"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Return the data written since the last call"""
+        result = b''.join(self.chunks)
+        self.chunks = []
+        return result
+
+
+def _iter_tar(files):
+    for name, content in files:
+        data = content.encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT)
+        yield data + b'\0' * (-len(data) % tarfile.BLOCKSIZE)
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def _iter_zip(files):
+    buf = _ChunkBuffer()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            archive.writestr(name, content)
+            yield buf.pop()
+    yield buf.pop()
+
+
+def iter_sample_sheet_archive(flow_cells, sheet_format, archive_format, split_by=None):
+    """Yield ``bytes`` chunks of an archive with the sample sheets of ``flow_cells``
+
+    ``flow_cells`` is an iterable of ``FlowCell`` objects with prefetched libraries, e.g., from
+    ``iter_flow_cell_batches()``.  The sheets are generated one at a time, for tar and zip
+    archives each sheet is held in memory until it has been written.  v2 sheets can be split
+    into one file per group, see ``SHEET_SPLITS``.
+    """
+    generators = (
+        FlowCellSampleSheetGenerator(flow_cell, flow_cell.libraries.all())
+        for flow_cell in flow_cells)
+    if archive_format == 'yaml':
+        for generator in generators:
+            yield b'---\n'
+            for chunk in generator.iter_yaml():
+                yield chunk.encode('utf-8')
+    else:
+        files = (
+            (generator.get_file_name(sheet_format, suffix), ''.join(chunks))
+            for generator in generators
+            for suffix, chunks in (
+                generator.split_v2(split_by) if split_by
+                else [(None, generator.iter(sheet_format))]))
+        yield from (_iter_tar if archive_format == 'tar' else _iter_zip)(files)
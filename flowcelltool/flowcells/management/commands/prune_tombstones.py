@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Management command for removing old tombstones of deleted objects"""
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import Tombstone
+
+
+class Command(BaseCommand):
+    """Remove the tombstones older than the retention period"""
+
+    help = 'Remove tombstones of objects deleted before the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS,
+            help='Number of days to keep the tombstones, defaults to '
+                 'FLOWCELLS_TOMBSTONE_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        num_deleted = Tombstone.objects.prune(before)
+        self.stdout.write('Removed {} tombstone(s)'.format(num_deleted))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Management command for sending the emails queued in the outbox"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import emails
+
+
+class Command(BaseCommand):
+    """Send emails from the ``OutgoingEmail`` outbox in batches, retrying failures with backoff"""
+
+    help = 'Send emails queued in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of emails to send over one connection')
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help='Keep running and poll the outbox instead of exiting when it is drained')
+        parser.add_argument(
+            '--interval', type=float, default=10.0,
+            help='Seconds to wait between polls of an empty outbox in --loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            num_sent, num_failed = emails.send_queued_emails(options['batch_size'])
+            if num_sent or num_failed:
+                self.stdout.write('Sent {} email(s), {} failed'.format(num_sent, num_failed))
+            if num_sent + num_failed < options['batch_size']:
+                # Outbox is drained (failed emails are only due after backoff)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0011_remove_flowcell_status'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='flowcell',
+            index_together=set([('created', 'id')]),
+        ),
+    ]
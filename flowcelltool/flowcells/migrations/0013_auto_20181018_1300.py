@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0012_auto_20181018_1200'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now)),
+                ('model_name', models.CharField(db_index=True, max_length=50)),
+                ('uuid', models.UUIDField()),
+            ],
+            options={
+                'ordering': ['deleted', 'id'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='tombstone',
+            index_together=set([('deleted', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='barcodeset',
+            index_together=set([('modified', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='barcodesetentry',
+            index_together=set([('modified', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='flowcell',
+            index_together=set([('created', 'id'), ('modified', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='library',
+            index_together=set([('modified', 'id')]),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 18:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_adapter_stats(apps, schema_editor):
+    """Build the adapter statistics from the ``info_adapters`` JSON of existing flow cells"""
+    FlowCell = apps.get_model('flowcells', 'FlowCell')
+    AdapterStats = apps.get_model('flowcells', 'AdapterStats')
+    AdapterCount = apps.get_model('flowcells', 'AdapterCount')
+    for flow_cell in FlowCell.objects.exclude(info_adapters__isnull=True).iterator():
+        counts = []
+        for index_read, info in enumerate(flow_cell.info_adapters or [], 1):
+            stats = AdapterStats.objects.create(
+                flow_cell=flow_cell, index_read=index_read,
+                num_indexed_reads=info.get('num_indexed_reads') or 0,
+                min_read_threshold=info.get('min_read_threshold'))
+            for lane, histo in (info.get('per_lane') or {}).items():
+                ranked = sorted(histo.items(), key=lambda x: (-x[1], x[0]))
+                for rank, (sequence, count) in enumerate(ranked, 1):
+                    ratio = (
+                        100.0 * count / stats.num_indexed_reads if stats.num_indexed_reads
+                        else 0.0)
+                    counts.append(AdapterCount(
+                        stats=stats, lane=str(lane), sequence=sequence.upper(), count=count,
+                        rank=rank, ratio=ratio))
+        AdapterCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0015_auto_20181018_1500'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdapterCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lane', models.CharField(max_length=50)),
+                ('sequence', models.CharField(db_index=True, max_length=200)),
+                ('count', models.BigIntegerField()),
+                ('rank', models.PositiveIntegerField()),
+                ('ratio', models.FloatField()),
+            ],
+            options={
+                'ordering': ['stats', 'lane', 'rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AdapterStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_read', models.PositiveSmallIntegerField()),
+                ('num_indexed_reads', models.BigIntegerField(default=0)),
+                ('min_read_threshold', models.FloatField(blank=True, null=True)),
+                ('flow_cell', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='adapter_stats', to='flowcells.FlowCell')),
+            ],
+            options={
+                'ordering': ['flow_cell', 'index_read'],
+            },
+        ),
+        migrations.AddField(
+            model_name='adaptercount',
+            name='stats',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='flowcells.AdapterStats'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='adapterstats',
+            unique_together=set([('flow_cell', 'index_read')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='adaptercount',
+            index_together=set([('stats', 'lane', 'rank')]),
+        ),
+        migrations.RunPython(build_adapter_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 19:00
+from __future__ import unicode_literals
+
+import json
+import zlib
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def parse_quality_scores(scores):
+    """Copy of ``models.parse_quality_scores()`` at the time of writing"""
+    per_lane = scores.get('per_lane') if isinstance(scores, dict) else None
+    if not per_lane or not isinstance(per_lane, dict) or set(scores) != {'per_lane'}:
+        return None
+    result = []
+    for lane, cycles in sorted(per_lane.items()):
+        if (len(lane) > 50 or not cycles or not isinstance(cycles, list) or
+                len(cycles) > 32767):
+            return None
+        for cycle, counts in enumerate(cycles, 1):
+            if not isinstance(counts, list) or not all(
+                    type(c) is int and 0 <= c <= 2 ** 63 - 1 for c in counts):
+                return None
+            result.append((lane, cycle, counts))
+    return result
+
+
+def move_to_side_table(apps, schema_editor):
+    """Move the quality scores JSON into one ``FlowCellQualityScores`` row per lane and cycle
+
+    Scores without the per-lane layout are moved into ``FlowCellQualityScoresBlob`` unchanged.
+    """
+    FlowCell = apps.get_model('flowcells', 'FlowCell')
+    FlowCellQualityScores = apps.get_model('flowcells', 'FlowCellQualityScores')
+    FlowCellQualityScoresBlob = apps.get_model('flowcells', 'FlowCellQualityScoresBlob')
+    for pk, scores in FlowCell.objects.exclude(info_quality_scores__isnull=True).values_list(
+            'pk', 'info_quality_scores').iterator():
+        records = parse_quality_scores(scores)
+        if records is None:
+            raw = json.dumps(scores, separators=(',', ':')).encode('utf-8')
+            FlowCellQualityScoresBlob.objects.create(
+                flow_cell_id=pk, data=zlib.compress(raw), raw_size=len(raw))
+        else:
+            FlowCellQualityScores.objects.bulk_create([
+                FlowCellQualityScores(flow_cell_id=pk, lane=lane, cycle=cycle, counts=counts)
+                for lane, cycle, counts in records])
+
+
+def move_to_flow_cell(apps, schema_editor):
+    """Move the quality scores back into the ``FlowCell`` rows"""
+    FlowCell = apps.get_model('flowcells', 'FlowCell')
+    FlowCellQualityScores = apps.get_model('flowcells', 'FlowCellQualityScores')
+    FlowCellQualityScoresBlob = apps.get_model('flowcells', 'FlowCellQualityScoresBlob')
+    per_flow_cell = {}
+    for pk, lane, counts in FlowCellQualityScores.objects.order_by(
+            'flow_cell', 'lane', 'cycle').values_list('flow_cell', 'lane', 'counts').iterator():
+        per_flow_cell.setdefault(pk, {}).setdefault(lane, []).append(counts)
+    for pk, per_lane in per_flow_cell.items():
+        FlowCell.objects.filter(pk=pk).update(info_quality_scores={'per_lane': per_lane})
+    for blob in FlowCellQualityScoresBlob.objects.iterator():
+        FlowCell.objects.filter(pk=blob.flow_cell_id).update(
+            info_quality_scores=json.loads(zlib.decompress(bytes(blob.data)).decode('utf-8')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0016_adapterstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowCellQualityScores',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lane', models.CharField(max_length=50)),
+                ('cycle', models.PositiveSmallIntegerField()),
+                ('counts', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('flow_cell', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quality_scores', to='flowcells.FlowCell')),
+            ],
+            options={
+                'ordering': ['flow_cell', 'lane', 'cycle'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FlowCellQualityScoresBlob',
+            fields=[
+                ('flow_cell', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='quality_scores_blob', serialize=False, to='flowcells.FlowCell')),
+                ('data', models.BinaryField()),
+                ('raw_size', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='flowcellqualityscores',
+            unique_together=set([('flow_cell', 'lane', 'cycle')]),
+        ),
+        migrations.RunPython(move_to_side_table, move_to_flow_cell),
+        migrations.RemoveField(
+            model_name='flowcell',
+            name='info_quality_scores',
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 20:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def _get_flow_cell_mode(info_reads):
+    """Copy of ``models.get_flow_cell_mode()`` at the time of writing"""
+    res = ''
+    if info_reads:
+        read_lens = [a['num_cycles'] for a in info_reads if not a['is_indexed_read']]
+        if len(read_lens) == 1:
+            res = '1x{}'.format(read_lens[0])
+        elif len(set(read_lens)) == 1:
+            res = '2x{}'.format(read_lens[0])
+        else:
+            res = ' + '.join(map(str, read_lens))
+        index_lens = [a['num_cycles'] for a in info_reads if a['is_indexed_read']]
+        if index_lens:
+            res += '/'
+            if len(set(index_lens)) == 1:
+                res += '{}x{}'.format(len(index_lens), index_lens[0])
+            else:
+                res += '+'.join(map(str, index_lens))
+    return res
+
+
+def fill_read_summary(apps, schema_editor):
+    """Compute the read summary fields of the existing flow cells"""
+    FlowCell = apps.get_model('flowcells', 'FlowCell')
+    for pk, planned, final in FlowCell.objects.values_list(
+            'pk', 'info_planned_reads', 'info_final_reads').iterator():
+        reads = [a for a in (planned or []) if not a['is_indexed_read']]
+        FlowCell.objects.filter(pk=pk).update(
+            flow_cell_mode=_get_flow_cell_mode(planned),
+            final_flow_cell_mode=_get_flow_cell_mode(final),
+            is_paired=(len(reads) == 2) if planned else None,
+            read_length=max((a['num_cycles'] for a in reads), default=None),
+            index_read_count=len(planned or []) - len(reads))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0017_flowcellqualityscores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowcell',
+            name='final_flow_cell_mode',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='flowcell',
+            name='flow_cell_mode',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='flowcell',
+            name='index_read_count',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='flowcell',
+            name='is_paired',
+            field=models.NullBooleanField(db_index=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='flowcell',
+            name='read_length',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_read_summary, migrations.RunPython.noop),
+    ]
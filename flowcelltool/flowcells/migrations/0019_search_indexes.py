@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 21:00
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+#: Columns to create trigram indexes for, on the values and upper-case values (``icontains``)
+TRIGRAM_COLUMNS = (
+    ('flowcells_flowcell', 'vendor_id'),
+    ('flowcells_flowcell', 'label'),
+    ('flowcells_library', 'name'),
+    ('flowcells_barcodesetentry', 'name'),
+    ('flowcells_barcodesetentry', 'sequence'),
+)
+
+CREATE_SQL = []
+DROP_SQL = []
+for table, column in TRIGRAM_COLUMNS:
+    CREATE_SQL += [
+        'CREATE INDEX {0}_{1}_trgm ON {0} USING gin ({1} gin_trgm_ops);'.format(table, column),
+        'CREATE INDEX {0}_{1}_upper_trgm ON {0} USING gin (UPPER({1}) gin_trgm_ops);'.format(
+            table, column),
+    ]
+    DROP_SQL += [
+        'DROP INDEX {0}_{1}_trgm;'.format(table, column),
+        'DROP INDEX {0}_{1}_upper_trgm;'.format(table, column),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0018_flowcell_read_summary'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-19 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def _revcomp(seq):
+    """Copy of ``models.revcomp()`` at the time of writing"""
+    return seq.translate(str.maketrans('ACGTNacgtn', 'TGCANtgcan'))[::-1]
+
+
+def _pack_sequence(seq):
+    """Copy of ``models.pack_sequence()`` at the time of writing"""
+    if not frozenset('ACGTacgt').issuperset(seq):
+        return None
+    digits = seq.translate(str.maketrans('ACGTacgt', '01230123')) + '0' * (-len(seq) % 4)
+    return int(digits, 4).to_bytes(len(digits) // 4, 'big') if digits else b''
+
+
+def fill_encodings(apps, schema_editor):
+    """Compute the encodings of the sequences of the existing barcode set entries"""
+    BarcodeSetEntry = apps.get_model('flowcells', 'BarcodeSetEntry')
+    for pk, sequence in BarcodeSetEntry.objects.values_list('pk', 'sequence').iterator():
+        BarcodeSetEntry.objects.filter(pk=pk).update(
+            sequence_revcomp=_revcomp(sequence), sequence_2bit=_pack_sequence(sequence))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowcells', '0019_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barcodesetentry',
+            name='sequence_2bit',
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='barcodesetentry',
+            name='sequence_revcomp',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_encodings, migrations.RunPython.noop),
+    ]
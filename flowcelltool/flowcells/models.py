@@ -1,18 +1,28 @@
 # -*- coding: utf-8 -*-
 """Models for the flowcells app"""
 
+from collections import namedtuple
+import datetime
+import itertools
+import json
+import threading
 import uuid
+import zlib
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.contenttypes.fields import GenericRelation
+from django.contrib.contenttypes.models import ContentType
 
 from flowcelltool.users.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from model_utils.models import TimeStampedModel
-from ..threads.models import Message
+from ..threads.models import Attachment, Message
 
 from markdown_deux.templatetags.markdown_deux_tags import markdown_allowed
 
@@ -195,6 +205,7 @@ class BarcodeSet(UuidStampedMixin, TimeStampedModel):
 
     class Meta:
         ordering = ['name']
+        index_together = [('modified', 'id')]
 
     #: Full name of the index set
     name = models.CharField(
@@ -262,11 +273,128 @@ class BarcodeSet(UuidStampedMixin, TimeStampedModel):
         return tpl.format(', '.join(repr(v) for v in values))
 
 
+#: Translation table for complementing DNA sequences
+_COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+#: Translation table from bases to their 2-bit codes as base 4 digits
+_BASE_DIGITS = str.maketrans('ACGTacgt', '01230123')
+
+#: The characters that can be encoded by ``pack_sequence()``
+_PACKABLE = frozenset('ACGTacgt')
+
+
+def revcomp(seq):
+    """Return reverse complement of the DNA sequence ``seq``, other characters are kept"""
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def pack_sequence(seq):
+    """Return ``seq`` packed into ``bytes`` with 2 bits per base, four bases per byte
+
+    The bases are encoded as ``A=0``, ``C=1``, ``G=2``, ``T=3``, the first base in the highest
+    bits, and the last byte is padded with zero bits.  Return ``None`` if ``seq`` contains other
+    characters than ``ACGT``.
+    """
+    if not _PACKABLE.issuperset(seq):
+        return None
+    digits = seq.translate(_BASE_DIGITS) + '0' * (-len(seq) % 4)
+    return int(digits, 4).to_bytes(len(digits) // 4, 'big') if digits else b''
+
+
+def unpack_sequence(data, length):
+    """Return the sequence of ``length`` bases packed into ``data`` by ``pack_sequence()``"""
+    bits = format(int.from_bytes(bytes(data), 'big'), '0{}b'.format(8 * len(data)))
+    return ''.join('ACGT'[int(bits[i:i + 2], 2)] for i in range(0, 2 * length, 2))
+
+
+class BarcodeSetEntryBatchValidator:
+    """Set-based validation of many ``BarcodeSetEntry`` objects of one barcode set
+
+    Checks that names and sequences are unique within the barcode set, for the entries to
+    validate and the entries already stored, which are fetched with one query.  Entries to
+    validate replace any stored entry with the same primary key.
+    """
+
+    #: Keys that have to be unique within the barcode set
+    UNIQUE_KEYS = ('name', 'sequence')
+
+    def __init__(self, barcode_set, existing=None):
+        #: The barcode set that the entries belong to
+        self.barcode_set = barcode_set
+        #: ``QuerySet`` of already stored entries to check against, defaults to all of the barcode
+        #: set's entries; ignored if the barcode set has not been saved yet
+        self.existing = existing
+
+    def _load_existing(self):
+        if self.barcode_set.pk is None:
+            return []
+        elif self.existing is None:
+            existing = BarcodeSetEntry.objects.filter(barcode_set=self.barcode_set)
+        else:
+            existing = self.existing
+        return list(existing.values_list('pk', *self.UNIQUE_KEYS))
+
+    def validate(self, entries, deleted=()):
+        """Validate ``entries``, raise ``ValidationError`` with all problems found
+
+        ``deleted`` are entries that are to be removed and thus ignored.
+        """
+        ignore = {entry.pk for entry in deleted} | {entry.pk for entry in entries}
+        existing = [values for values in self._load_existing() if values[0] not in ignore]
+        errors = []
+        for i, key in enumerate(self.UNIQUE_KEYS, 1):
+            seen = {values[i] for values in existing}
+            for entry in entries:
+                value = getattr(entry, key)
+                if value in seen:
+                    errors.append('Barcode {} must be unique in barcode set! ({})'.format(
+                        key, value))
+                seen.add(value)
+        if errors:
+            raise ValidationError(errors)
+
+
+class BarcodeSetEntryQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``BarcodeSetEntry`` with support for saving in bulk"""
+
+    def bulk_save(self, barcode_set, entries, deleted=()):
+        """Validate and save ``entries`` of ``barcode_set``, remove ``deleted``
+
+        Validation is performed with ``BarcodeSetEntryBatchValidator`` for all entries at once.
+        New entries are inserted with one ``bulk_create()``, existing ones are written with one
+        ``UPDATE`` each, bypassing ``BarcodeSetEntry.save()``.  Return list of saved entries.
+        """
+        entries = list(entries)
+        for entry in entries:
+            entry.barcode_set = barcode_set
+            entry.update_encodings()
+        BarcodeSetEntryBatchValidator(barcode_set).validate(entries, deleted)
+        now = timezone.now()
+        with transaction.atomic():
+            if deleted:
+                self.filter(pk__in=[entry.pk for entry in deleted]).delete()
+            for entry in entries:
+                if entry.pk is not None:
+                    entry.modified = now
+                    self.filter(pk=entry.pk).update(
+                        name=entry.name, sequence=entry.sequence,
+                        sequence_revcomp=entry.sequence_revcomp,
+                        sequence_2bit=entry.sequence_2bit, modified=now)
+            self.bulk_create([entry for entry in entries if entry.pk is None])
+            BarcodeSet.objects.filter(pk=barcode_set.pk).update(modified=now)
+        barcode_set.modified = now
+        return entries
+
+
 class BarcodeSetEntry(UuidStampedMixin, TimeStampedModel):
     """A barcode sequence with an id"""
 
     class Meta:
         ordering = ['name']
+        index_together = [('modified', 'id')]
+
+    #: Default manager, with the additional ``bulk_save()`` helper
+    objects = BarcodeSetEntryQuerySet.as_manager()
 
     #: The barcode set that this barcode belongs to
     barcode_set = models.ForeignKey(BarcodeSet, related_name='entries',
@@ -280,25 +408,59 @@ class BarcodeSetEntry(UuidStampedMixin, TimeStampedModel):
     #: sequence as for workflow A
     sequence = models.CharField(max_length=200)
 
+    #: Reverse complement of ``sequence``, as used for the second index in
+    #: workflow B, maintained by ``save()``
+    sequence_revcomp = models.CharField(
+        max_length=200, blank=True, default='', editable=False)
+
+    #: ``sequence`` packed by ``pack_sequence()``, ``None`` if it contains
+    #: other characters than ``ACGT``, maintained by ``save()``
+    sequence_2bit = models.BinaryField(null=True, editable=False)
+
     def save(self, *args, **kwargs):
         """Version of save() that ensure uniqueness of the name within the
-        BarcodeSet
+        BarcodeSet and updates the encodings of the sequence
         """
         self._validate_unique()
+        self.update_encodings()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'sequence' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'sequence_revcomp', 'sequence_2bit'}
         super().save(*args, **kwargs)
 
+    def update_encodings(self):
+        """Compute ``sequence_revcomp`` and ``sequence_2bit`` from ``sequence``"""
+        self.sequence_revcomp = revcomp(self.sequence)
+        self.sequence_2bit = pack_sequence(self.sequence)
+
+    def get_sequence(self, reverse_complement=False):
+        """Return the sequence, reverse-complemented if ``reverse_complement``
+
+        Falls back to computing the reverse complement for entries that have not been saved.
+        """
+        if not reverse_complement:
+            return self.sequence
+        return self.sequence_revcomp or revcomp(self.sequence)
+
     def _validate_unique(self):
         """Validates that the name and sequence are unique within the
         BarcodeSet
         """
-        # check for unique name
-        for key in ('name', 'sequence'):
-            qs = BarcodeSetEntry.objects.filter(**{key: getattr(self, key)})
-            if self.pk is not None:
-                qs = qs.exclude(pk=self.pk)
-            if qs.filter(barcode_set=self.barcode_set).exists():
-                raise ValidationError(
-                    'Barcode {} must be unique in barcode set!'.format(key))
+        # only fetch entries that could clash
+        existing = BarcodeSetEntry.objects.filter(
+            models.Q(name=self.name) | models.Q(sequence=self.sequence),
+            barcode_set=self.barcode_set_id)
+        BarcodeSetEntryBatchValidator(self.barcode_set, existing).validate([self])
+
+    def get_absolute_url(self):
+        return self.barcode_set.get_absolute_url()
+
+    def get_search_result(self):
+        return {
+            'type': 'Barcode',
+            'title': '{} ({})'.format(self.name, self.sequence),
+            'description': 'in barcode set {}'.format(self.barcode_set.name),
+        }
 
     # Permissions -------------------------------------------------------------
 
@@ -437,9 +599,155 @@ RTA_VERSION_CHOICES = (
 )
 
 
+def get_flow_cell_mode(info_reads):
+    """Return sequencing mode (e.g., ``2x151/2x8``) for ``info_reads``, empty string for none"""
+    res = ''
+    if info_reads:
+        read_lens = [
+            a['num_cycles'] for a in info_reads if not a['is_indexed_read']]
+        if len(read_lens) == 1:
+            res = '1x{}'.format(read_lens[0])
+        elif len(set(read_lens)) == 1:
+            res = '2x{}'.format(read_lens[0])
+        else:
+            res = ' + '.join(map(str, read_lens))
+        index_lens = [
+            a['num_cycles'] for a in info_reads if a['is_indexed_read']]
+        if index_lens:
+            res += '/'
+            if len(set(index_lens)) == 1:
+                res += '{}x{}'.format(len(index_lens), index_lens[0])
+            else:
+                res += '+'.join(map(str, index_lens))
+    return res
+
+
+class LaneLayout:
+    """Assignment of the libraries of a flow cell to its lanes
+
+    Built in one pass over the libraries, e.g., the ones prefetched by ``FlowCellDetailView``.
+    """
+
+    #: Number of lanes to display in one table row
+    LANES_PER_ROW = 4
+
+    def __init__(self, num_lanes, libraries):
+        #: Number of lanes on the flow cell
+        self.num_lanes = num_lanes
+        #: List of library lists, one for each lane
+        self.lanes = [[] for _ in range(num_lanes)]
+        #: Libraries with lane numbers outside of the flow cell's lanes
+        self.invalid = []
+        for library in libraries:
+            for lane_no in sorted(library.lane_numbers):
+                if 1 <= lane_no <= num_lanes:
+                    self.lanes[lane_no - 1].append(library)
+                elif not self.invalid or self.invalid[-1] is not library:
+                    self.invalid.append(library)
+
+    @property
+    def rows(self):
+        """Return lists of ``(lane_no, libraries)`` for the table rows in the layout display"""
+        lanes = list(enumerate(self.lanes, 1))
+        return [lanes[i:i + self.LANES_PER_ROW]
+                for i in range(0, len(lanes), self.LANES_PER_ROW)]
+
+    def __len__(self):
+        return len(self.lanes)
+
+    def __iter__(self):
+        return iter(self.lanes)
+
+    def __getitem__(self, key):
+        return self.lanes[key]
+
+
+#: ``FlowCell`` fields loaded by ``FlowCellQuerySet.summary()``, the JSON fields are left out
+SUMMARY_FIELDS = (
+    'id', 'uuid', 'created', 'modified', 'owner', 'demux_operator', 'sequencing_machine',
+    'run_date', 'run_number', 'slot', 'vendor_id', 'label', 'description', 'num_lanes',
+    'operator', 'rta_version', 'status_sequencing', 'status_conversion', 'status_delivery',
+    'delivery_type', 'flow_cell_mode', 'final_flow_cell_mode', 'is_paired', 'read_length',
+    'index_read_count')
+
+
+#: ``FlowCell`` fields with read information
+READS_FIELDS = ('info_planned_reads', 'info_final_reads')
+
+#: ``FlowCell`` fields computed from ``READS_FIELDS`` by ``FlowCell.update_read_summary()``
+READS_SUMMARY_FIELDS = (
+    'flow_cell_mode', 'final_flow_cell_mode', 'is_paired', 'read_length', 'index_read_count')
+
+
+#: Primary keys of the flow cells being deleted by ``FlowCell.delete()`` in the current thread,
+#: in ``flow_cell_pks``, see ``signals.touch_flow_cell()``
+_deleting = threading.local()
+
+
+def get_deleting_flow_cell_pks():
+    """Return ``set`` of the PKs of the flow cells being deleted in the current thread"""
+    if not hasattr(_deleting, 'flow_cell_pks'):
+        _deleting.flow_cell_pks = set()
+    return _deleting.flow_cell_pks
+
+
+class FlowCellQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``FlowCell`` with helpers for list displays"""
+
+    def summary(self):
+        """Return ``QuerySet`` only loading the ``SUMMARY_FIELDS``
+
+        The read configuration is available from the scalar fields computed on saving (e.g.,
+        ``flow_cell_mode``), so no JSON has to be loaded and decoded.
+        """
+        return self.only(*SUMMARY_FIELDS)
+
+    def for_list(self):
+        """Return ``QuerySet`` prepared for list displays
+
+        Joins the related machine and users and only loads the summary fields.  Use
+        ``load_list_counts()`` on the displayed page for the number of libraries, messages, and
+        files.
+        """
+        return self.summary().select_related('sequencing_machine', 'owner', 'demux_operator')
+
+
+def load_list_counts(flow_cells):
+    """Set ``num_libraries``, ``num_messages``, and ``num_files`` on the ``FlowCell`` objects
+
+    Uses one grouped query per relation for all of ``flow_cells`` instead of joining all of
+    them at once, which would multiply the rows to aggregate per flow cell.
+    """
+    flow_cells = list(flow_cells)
+    if not flow_cells:
+        return
+    pks = [flow_cell.pk for flow_cell in flow_cells]
+    messages = Message.objects.filter(
+        content_type=ContentType.objects.get_for_model(FlowCell), object_id__in=pks)
+    num_libraries = dict(
+        Library.objects.filter(flow_cell__in=pks).values_list(
+            'flow_cell').annotate(count=models.Count('pk')).order_by())
+    num_messages = dict(
+        messages.values_list('object_id').annotate(count=models.Count('pk')).order_by())
+    num_files = dict(
+        Attachment.objects.filter(message__in=messages).values_list(
+            'message__object_id').annotate(count=models.Count('pk')).order_by())
+    for flow_cell in flow_cells:
+        flow_cell.num_libraries = num_libraries.get(flow_cell.pk, 0)
+        flow_cell.num_messages = num_messages.get(flow_cell.pk, 0)
+        flow_cell.num_files = num_files.get(flow_cell.pk, 0)
+
+
 class FlowCell(UuidStampedMixin, TimeStampedModel):
     """Information stored for each flow cell"""
 
+    class Meta:
+        #: Support the cursor pagination and the ``modified_since`` filter in the API
+        index_together = [('created', 'id'), ('modified', 'id')]
+
+    #: Default manager, with the additional ``for_list()`` helper
+    objects = FlowCellQuerySet.as_manager()
+
     #: Owner of the flow cell.  Set to NULL when the user is deleted to
     #: circumvent any possible data loss.  Users should be deactivated
     #: instead of being deleted anyway
@@ -540,8 +848,27 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
     #:     }
     info_adapters = JSONField(null=True, blank=True)
 
-    #: Summary information on the raw quality scores as extracted from BCL data.
-    info_quality_scores = JSONField(null=True, blank=True)
+    # The following fields are computed from the read information on saving, such that lists
+    # do not have to load the JSON fields
+
+    #: Sequencing mode of the planned reads, e.g., ``2x151/2x8``, empty if unknown
+    flow_cell_mode = models.CharField(
+        max_length=100, blank=True, default='', editable=False, db_index=True)
+
+    #: Sequencing mode of the final reads, empty if unknown
+    final_flow_cell_mode = models.CharField(
+        max_length=100, blank=True, default='', editable=False)
+
+    #: Whether the planned reads are paired, ``None`` if unknown
+    is_paired = models.NullBooleanField(editable=False, db_index=True)
+
+    #: Length of the longest planned non-index read, ``None`` if unknown
+    read_length = models.PositiveIntegerField(
+        null=True, blank=True, editable=False, db_index=True)
+
+    #: Number of planned index reads
+    index_read_count = models.PositiveSmallIntegerField(
+        default=0, editable=False, db_index=True)
 
     #: Status of sequencing
     status_sequencing = models.CharField(
@@ -563,6 +890,27 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
         max_length=50, default=DELIVERY_TYPE_SEQ, choices=DELIVERY_CHOICES,
         help_text='Choices for data delivery type')
 
+    def get_quality_scores(self, lanes=None):
+        """Return the summary information on the raw quality scores, ``None`` if not set
+
+        The information is stored in ``FlowCellQualityScores`` and loaded with an extra query,
+        only for the given ``lanes`` if any.  Scores without the per-lane layout are loaded from
+        ``FlowCellQualityScoresBlob`` with a second query and returned as a whole.
+        """
+        queryset = self.quality_scores.all()
+        if lanes is not None:
+            queryset = queryset.filter(lane__in=lanes)
+        scores = queryset.to_json()
+        if scores is None:
+            blob = FlowCellQualityScoresBlob.objects.filter(flow_cell=self).first()
+            if blob:
+                scores = blob.get_scores()
+        return scores
+
+    def set_quality_scores(self, scores):
+        """Store the summary information on the raw quality scores, remove it for ``None``"""
+        FlowCellQualityScores.objects.rebuild(self, scores)
+
     def get_full_name(self):
         """Return full flow cell name"""
         if all(not x for x in (self.run_date, self.sequencing_machine,
@@ -580,21 +928,48 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
                 self.label
             ] if x]))
 
+    @cached_property
+    def lane_layout(self):
+        """Return ``LaneLayout`` for this flow cell, computed once per instance"""
+        return LaneLayout(self.num_lanes, self.libraries.all())
+
     def get_lanes(self):
         """Return a list of Library lists, for the layout on the flow cell"""
-        try:
-            lanes = [[] for i in range(self.num_lanes)]
-            for lib in self.libraries.all():
-                for lane in lib.lane_numbers:
-                    lanes[lane - 1].append(lib)
-            return lanes
-        except IndexError:
-            return '(invalid)'
+        return self.lane_layout.lanes
 
     def save(self, *args, **kwargs):
         self._validate_num_lanes()
+        self.__dict__.pop('lane_layout', None)  # invalidate cached_property
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(READS_FIELDS):
+            self.update_read_summary()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(READS_SUMMARY_FIELDS)
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        """Delete flow cell, its libraries do not touch it while they are removed along"""
+        pks = get_deleting_flow_cell_pks()
+        pks.add(self.pk)
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            pks.discard(self.pk)
+
+    def update_read_summary(self):
+        """Compute the read summary fields (e.g., ``flow_cell_mode``) from the read information
+        """
+        reads = [a for a in (self.info_planned_reads or []) if not a['is_indexed_read']]
+        self.flow_cell_mode = get_flow_cell_mode(self.info_planned_reads)
+        self.final_flow_cell_mode = get_flow_cell_mode(self.info_final_reads)
+        self.is_paired = (len(reads) == 2) if self.info_planned_reads else None
+        self.read_length = max((a['num_cycles'] for a in reads), default=None)
+        self.index_read_count = len(self.info_planned_reads or []) - len(reads)
+
+    def is_flow_cell_mode_ok(self):
+        """Return whether the final reads are known and match the planned ones"""
+        return bool(self.flow_cell_mode) and self.flow_cell_mode == self.final_flow_cell_mode
+
     def _validate_num_lanes(self):
         """Check that the num_lanes value is compatible with any contained
         Library
@@ -607,37 +982,24 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
                         self.num_lanes))
 
     def count_files(self):
-        """Return total number of attached files"""
-        result = 0
-        for message in self.messages.all():  # pylint:disable=no-member
-            result += message.attachments.all().count()
-        return result
+        """Return total number of attached files
+
+        Uses the ``num_files`` attribute from ``load_list_counts()`` if present.
+        """
+        if hasattr(self, 'num_files'):
+            return self.num_files
+        return self.messages.aggregate(  # pylint:disable=no-member
+            num_files=models.Count('attachments'))['num_files']
 
     def get_absolute_url(self):
         return reverse('flowcell_view', kwargs={'uuid': self.uuid})
 
-    # Read and Adapter Shortcuts ----------------------------------------------
-
-    @property
-    def is_paired(self):
-        if not self.info_planned_reads:
-            return None
-        else:
-            return len([a for a in self.info_planned_reads if not a['is_indexed_read']]) == 2
-
-    @property
-    def read_length(self):
-        if not self.info_planned_reads:
-            return None
-        else:
-            return max(a['num_cycles'] for a in self.info_planned_reads if not a['is_indexed_read'])
-
-    @property
-    def index_read_count(self):
-        if not self.info_planned_reads:
-            return 0
-        else:
-            return len([a for a in self.info_planned_reads if a['is_indexed_read']])
+    def get_search_result(self):
+        return {
+            'type': 'Flow Cell',
+            'title': self.get_full_name(),
+            'description': self.label,
+        }
 
     # Permissions -------------------------------------------------------------
 
@@ -665,6 +1027,11 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
     def has_create_permission(request):
         return request.user.has_perm('flowcells.FlowCell:create')
 
+    @staticmethod
+    def has_sample_sheets_permission(request):
+        """Special action for the sample sheets of many flow cells, same as list."""
+        return request.user.has_perm('flowcells.FlowCell:sample_sheets')
+
     def has_object_retrieve_permission(self, request):
         return request.user.has_perm('flowcells.FlowCell:retrieve', self)
 
@@ -676,9 +1043,21 @@ class FlowCell(UuidStampedMixin, TimeStampedModel):
         """Special action for querying by vendor id, same as retrieve."""
         return request.user.has_perm('flowcells.FlowCell:by_vendor_id', self)
 
+    def has_object_quality_scores_permission(self, request):
+        """Special action for reading the quality scores, same as retrieve."""
+        return request.user.has_perm('flowcells.FlowCell:quality_scores', self)
+
+    def has_object_barcode_collisions_permission(self, request):
+        """Special action for checking the barcodes for collisions, same as retrieve."""
+        return request.user.has_perm('flowcells.FlowCell:barcode_collisions', self)
+
     def has_object_update_permission(self, request):
         return request.user.has_perm('flowcells.FlowCell:update', self)
 
+    def has_object_post_sequencing_permission(self, request):
+        """Special action for reading and writing post-sequencing information"""
+        return request.user.has_perm('flowcells.FlowCell:post_sequencing', self)
+
     def has_object_destroy_permission(self, request):
         return request.user.has_perm('flowcells.FlowCell:destroy', self)
 
@@ -750,12 +1129,142 @@ def try_helper(f, arg, exc=AttributeError, default=''):
         return default
 
 
+#: Lightweight representation of a library for ``LibraryBatchValidator``
+_LibraryRecord = namedtuple(
+    '_LibraryRecord', ('key', 'name', 'barcode_id', 'barcode2_id', 'lane_numbers'))
+
+
+class LibraryBatchValidator:
+    """Set-based validation of many ``Library`` objects on one flow cell
+
+    The libraries to validate are checked against each other and against the libraries already
+    stored for the flow cell, which are fetched with one query.  The following is checked:
+
+    - the lane numbers must be valid for the flow cell
+    - no two libraries sharing a lane may have the same name
+    - no two libraries sharing a lane may have the same pair of barcodes
+
+    Libraries to validate replace any stored library with the same primary key.
+    """
+
+    #: Fields to fetch for the existing libraries
+    FIELDS = ('pk', 'name', 'barcode_id', 'barcode2_id', 'lane_numbers')
+
+    def __init__(self, flow_cell, existing=None, check_lanes=True):
+        #: The flow cell that the libraries are on
+        self.flow_cell = flow_cell
+        #: ``QuerySet`` or iterable of already stored libraries to check against, defaults to all
+        #: of the flow cell's libraries
+        self.existing = existing
+        #: Whether or not to check the lane numbers against the flow cell
+        self.check_lanes = check_lanes
+
+    def _load_existing(self):
+        if self.existing is None:
+            existing = Library.objects.filter(flow_cell=self.flow_cell)
+        else:
+            existing = self.existing
+        if isinstance(existing, models.QuerySet):
+            return [_LibraryRecord(*values) for values in existing.values_list(*self.FIELDS)]
+        else:
+            return [self._to_record(lib) for lib in existing]
+
+    @staticmethod
+    def _to_record(library):
+        return _LibraryRecord(
+            library.pk if library.pk is not None else ('new', id(library)), library.name,
+            library.barcode_id, library.barcode2_id, library.lane_numbers or [])
+
+    def validate(self, libraries, deleted=()):
+        """Validate ``libraries``, raise ``ValidationError`` with all problems found
+
+        ``deleted`` are libraries that are to be removed and thus ignored.
+        """
+        batch = [self._to_record(lib) for lib in libraries]
+        errors = []
+        if self.check_lanes:
+            errors += self._check_lane_numbers(batch)
+        ignore = {lib.pk for lib in deleted} | {rec.key for rec in batch}
+        existing = [rec for rec in self._load_existing() if rec.key not in ignore]
+        errors += self._check_uniqueness(existing, batch)
+        if errors:
+            raise ValidationError(errors)
+
+    def _check_lane_numbers(self, batch):
+        num_lanes = self.flow_cell.num_lanes
+        return [
+            'Lane no {} > flow cell lane count {}'.format(list(sorted(rec.lane_numbers)), num_lanes)
+            for rec in batch if any(l < 1 or l > num_lanes for l in rec.lane_numbers)]
+
+    @staticmethod
+    def _check_uniqueness(existing, batch):
+        errors = []
+        seen_names = {}
+        seen_barcodes = {}
+        reported = set()
+        batch_keys = {rec.key for rec in batch}
+        for rec in existing + batch:
+            for lane_no in set(rec.lane_numbers):
+                name_other = seen_names.setdefault((lane_no, rec.name), rec)
+                barcodes_other = seen_barcodes.setdefault(
+                    (lane_no, rec.barcode_id, rec.barcode2_id), rec)
+                for other, tpl in (
+                        (name_other, ('There are libraries sharing flow cell lane with the '
+                                      'same name as {}')),
+                        (barcodes_other, ('There are libraries sharing flow cell lane with the '
+                                          'same barcodes as {} ({})'))):
+                    if other is rec or rec.key not in batch_keys:
+                        continue
+                    if (tpl, rec.key) not in reported:
+                        reported.add((tpl, rec.key))
+                        errors.append(tpl.format(rec.name, other.name))
+        return errors
+
+
+#: Fields written by ``LibraryQuerySet.bulk_save()`` for existing libraries
+LIBRARY_BULK_UPDATE_FIELDS = (
+    'name', 'reference', 'barcode_set_id', 'barcode_id', 'barcode_set2_id', 'barcode2_id',
+    'lane_numbers', 'modified')
+
+
+class LibraryQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``Library`` with support for saving in bulk"""
+
+    def bulk_save(self, flow_cell, libraries, deleted=(), validate=True):
+        """Validate and save ``libraries`` on ``flow_cell``, remove ``deleted``
+
+        Validation is performed with ``LibraryBatchValidator`` for all libraries at once, pass
+        ``validate=False`` if the caller has done this already.  New libraries are inserted with
+        one ``bulk_create()``, existing ones are written with one ``UPDATE`` each, bypassing
+        ``Library.save()``.  Return list of saved libraries.
+        """
+        libraries = list(libraries)
+        for library in libraries:
+            library.flow_cell = flow_cell
+        if validate:
+            LibraryBatchValidator(flow_cell).validate(libraries, deleted)
+        now = timezone.now()
+        with transaction.atomic():
+            if deleted:
+                self.filter(pk__in=[lib.pk for lib in deleted]).delete()
+            for library in libraries:
+                if library.pk is not None:
+                    library.modified = now
+                    self.filter(pk=library.pk).update(**{
+                        field: getattr(library, field) for field in LIBRARY_BULK_UPDATE_FIELDS})
+            self.bulk_create([lib for lib in libraries if lib.pk is None])
+            FlowCell.objects.filter(pk=flow_cell.pk).update(modified=now)
+        flow_cell.modified = now
+        return libraries
+
+
 class Library(UuidStampedMixin, TimeStampedModel):
     """The data stored for each library that is to be sequenced
     """
 
     class Meta:
         ordering = ['name']
+        index_together = [('modified', 'id')]
 
     #: The flow cell that this library has been sequenced on
     flow_cell = models.ForeignKey(FlowCell, related_name='libraries',
@@ -790,6 +1299,9 @@ class Library(UuidStampedMixin, TimeStampedModel):
     lane_numbers = ArrayField(
         models.IntegerField(validators=[MinValueValidator(1)]))
 
+    #: Default manager, with the additional ``bulk_save()`` helper
+    objects = LibraryQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         """ Override to check name/barcode being unique on the flow cell
         lanes and lane numbers are compatible
@@ -799,41 +1311,15 @@ class Library(UuidStampedMixin, TimeStampedModel):
         return super().save(*args, **kwargs)
 
     def _validate_lane_nos(self):
-        if any(l > self.flow_cell.num_lanes for l in self.lane_numbers):
-            raise ValidationError(
-                'Lane no {} > flow cell lane count {}'.format(
-                    list(sorted(self.lane_numbers)),
-                    self.flow_cell.num_lanes))
+        LibraryBatchValidator(self.flow_cell, existing=()).validate([self])
 
     def _validate_uniqueness(self):
-        # Get all libraries sharing any lane on the same flow cell
+        # Only consider libraries sharing any lane on the same flow cell
         libs_on_lanes = Library.objects.filter(
-            flow_cell=self.flow_cell,
-            lane_numbers__overlap=self.lane_numbers
-        ).exclude(
-            uuid=self.uuid
-        )
-        # Check that no libraries exist with the same
-        if libs_on_lanes.filter(name=self.name).exists():
-            raise ValidationError(
-                ('There are libraries sharing flow cell lane with the '
-                 'same name as {}'.format(self.name)))
-        # Check that no libraries exist with the same primary and secondary
-        # barcode
-        kwargs = {}
-        if self.barcode is None:
-            kwargs['barcode__isnull'] = True
-        else:
-            kwargs['barcode'] = self.barcode
-        if self.barcode2 is None:
-            kwargs['barcode2__isnull'] = True
-        else:
-            kwargs['barcode2'] = self.barcode2
-        if libs_on_lanes.filter(**kwargs).exists():
-            raise ValidationError(
-                ('There are libraries sharing flow cell lane with the '
-                 'same barcodes as {}: {}/{}'.format(
-                     self.name, self.barcode, self.barcode2)))
+            flow_cell=self.flow_cell_id,
+            lane_numbers__overlap=self.lane_numbers)
+        LibraryBatchValidator(
+            self.flow_cell, existing=libs_on_lanes, check_lanes=False).validate([self])
 
     def get_absolute_url(self):
         return self.flow_cell.get_absolute_url()
@@ -897,3 +1383,408 @@ class Library(UuidStampedMixin, TimeStampedModel):
         values = (self.flow_cell.get_full_name(), self.reference,
                   self.barcode_set, self.barcode, self.lane_numbers)
         return tpl.format(', '.join(map(repr, values)))  # noqa
+
+
+# Quality scores --------------------------------------------------------------
+
+
+#: Largest value of a Postgres ``bigint``, for the quality score counts
+MAX_QUALITY_SCORE_COUNT = 2 ** 63 - 1
+
+
+def parse_quality_scores(scores):
+    """Return list of ``(lane, cycle, counts)`` for the quality scores JSON ``scores``
+
+    Return ``None`` if ``scores`` does not have the layout described in
+    ``FlowCellQualityScores``, such scores are stored as a whole in
+    ``FlowCellQualityScoresBlob``.
+    """
+    per_lane = scores.get('per_lane') if isinstance(scores, dict) else None
+    if not per_lane or not isinstance(per_lane, dict) or set(scores) != {'per_lane'}:
+        return None
+    result = []
+    for lane, cycles in sorted(per_lane.items()):
+        if (len(lane) > FlowCellQualityScores._meta.get_field('lane').max_length or
+                not cycles or not isinstance(cycles, list) or len(cycles) > 32767):
+            return None
+        for cycle, counts in enumerate(cycles, 1):
+            if not isinstance(counts, list) or not all(
+                    type(c) is int and 0 <= c <= MAX_QUALITY_SCORE_COUNT for c in counts):
+                return None
+            result.append((lane, cycle, counts))
+    return result
+
+
+def encode_quality_scores(scores):
+    """Return ``(data, raw_size)`` with the zlib-compressed JSON of ``scores`` and its size"""
+    raw = json.dumps(scores, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw), len(raw)
+
+
+class FlowCellQualityScoresQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``FlowCellQualityScores`` with conversion from and to JSON"""
+
+    def rebuild(self, flow_cell, scores):
+        """Replace the quality scores of ``flow_cell`` by the ones from the JSON ``scores``
+
+        Scores without the per-lane layout go to ``FlowCellQualityScoresBlob``.  The quality
+        scores are removed for ``scores`` being ``None``.
+        """
+        records = None if scores is None else parse_quality_scores(scores)
+        with transaction.atomic():
+            self.filter(flow_cell=flow_cell).delete()
+            FlowCellQualityScoresBlob.objects.filter(flow_cell=flow_cell).delete()
+            if records is None:
+                if scores is not None:
+                    data, raw_size = encode_quality_scores(scores)
+                    FlowCellQualityScoresBlob.objects.create(
+                        flow_cell=flow_cell, data=data, raw_size=raw_size)
+                return []
+            return self.bulk_create([
+                FlowCellQualityScores(flow_cell=flow_cell, lane=lane, cycle=cycle, counts=counts)
+                for lane, cycle, counts in records])
+
+    def to_json(self):
+        """Return the quality scores JSON for the records, ``None`` if there are none"""
+        per_lane = {}
+        for lane, counts in self.order_by('lane', 'cycle').values_list('lane', 'counts'):
+            per_lane.setdefault(lane, []).append(counts)
+        return {'per_lane': per_lane} if per_lane else None
+
+
+class FlowCellQualityScores(models.Model):
+    """Histogram of the raw quality scores of one cycle on one lane, as extracted from BCL data
+
+    The histograms of a flow cell can be several hundred KB of JSON, so they are kept out of
+    the flow cell rows.  Scores written as ``{"per_lane": {"<lane>": [<counts of cycle 1>,
+    ...]}}``, where the counts of a cycle are the numbers of base calls by quality score
+    starting at 0, are split into one integer array per lane and cycle.  Any other JSON is
+    kept as a whole in ``FlowCellQualityScoresBlob``.  Use ``FlowCell.get_quality_scores()``
+    and ``FlowCell.set_quality_scores()`` for access.
+    """
+
+    class Meta:
+        ordering = ['flow_cell', 'lane', 'cycle']
+        unique_together = [('flow_cell', 'lane', 'cycle')]
+
+    objects = FlowCellQualityScoresQuerySet.as_manager()
+
+    #: The flow cell
+    flow_cell = models.ForeignKey(
+        FlowCell, related_name='quality_scores', on_delete=models.CASCADE)
+
+    #: Key of the lane in the JSON
+    lane = models.CharField(max_length=50)
+
+    #: Number of the cycle, starting at 1
+    cycle = models.PositiveSmallIntegerField()
+
+    #: Numbers of base calls by quality score
+    counts = ArrayField(models.BigIntegerField())
+
+    def __str__(self):
+        return 'FlowCellQualityScores({}, {}, {})'.format(self.flow_cell_id, self.lane, self.cycle)
+
+
+class FlowCellQualityScoresBlob(models.Model):
+    """Quality scores of a flow cell without the per-lane layout, as zlib-compressed JSON
+
+    See ``FlowCellQualityScores`` for the layout that is split per lane and cycle.
+    """
+
+    #: The flow cell, also used as primary key
+    flow_cell = models.OneToOneField(
+        FlowCell, primary_key=True, related_name='quality_scores_blob', on_delete=models.CASCADE)
+
+    #: The zlib-compressed JSON
+    data = models.BinaryField()
+
+    #: Size of the uncompressed JSON in bytes
+    raw_size = models.BigIntegerField(default=0)
+
+    def get_scores(self):
+        """Return the decoded quality scores"""
+        return json.loads(zlib.decompress(bytes(self.data)).decode('utf-8'))
+
+    def __str__(self):
+        return 'FlowCellQualityScoresBlob({}, {})'.format(self.flow_cell_id, self.raw_size)
+
+
+# Adapter statistics ----------------------------------------------------------
+
+
+class AdapterStatsQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``AdapterStats`` with support for rebuilding from JSON"""
+
+    def rebuild(self, flow_cell):
+        """Replace the adapter statistics of ``flow_cell`` by the ones from ``info_adapters``
+
+        Counts are ranked per lane by decreasing count and their ratio of the indexed reads is
+        computed, such that displays do not have to touch the JSON.
+        """
+        infos = flow_cell.info_adapters or []
+        with transaction.atomic():
+            self.filter(flow_cell=flow_cell).delete()
+            all_stats = self.bulk_create([
+                AdapterStats(
+                    flow_cell=flow_cell, index_read=index_read,
+                    num_indexed_reads=info.get('num_indexed_reads') or 0,
+                    min_read_threshold=info.get('min_read_threshold'))
+                for index_read, info in enumerate(infos, 1)])
+            counts = []
+            for stats, info in zip(all_stats, infos):
+                for lane, histo in (info.get('per_lane') or {}).items():
+                    ranked = sorted(histo.items(), key=lambda x: (-x[1], x[0]))
+                    for rank, (sequence, count) in enumerate(ranked, 1):
+                        counts.append(AdapterCount(
+                            stats=stats, lane=str(lane), sequence=sequence.upper(), count=count,
+                            rank=rank, ratio=stats.get_ratio(count)))
+            AdapterCount.objects.bulk_create(counts)
+        return all_stats
+
+
+class AdapterStats(models.Model):
+    """Adapter statistics of one index read of a flow cell, built from ``info_adapters``
+
+    Use ``AdapterStats.objects.rebuild()`` for updating after writing ``info_adapters``.
+    """
+
+    class Meta:
+        ordering = ['flow_cell', 'index_read']
+        unique_together = [('flow_cell', 'index_read')]
+
+    objects = AdapterStatsQuerySet.as_manager()
+
+    #: The flow cell
+    flow_cell = models.ForeignKey(
+        FlowCell, related_name='adapter_stats', on_delete=models.CASCADE)
+
+    #: Number of the index read, starting at 1, position in ``info_adapters``
+    index_read = models.PositiveSmallIntegerField()
+
+    #: Number of indexed reads the counts are based on
+    num_indexed_reads = models.BigIntegerField(default=0)
+
+    #: Lower threshold on the adapter portion used for selecting the adapters
+    min_read_threshold = models.FloatField(null=True, blank=True)
+
+    def get_ratio(self, count):
+        """Return percentage of ``count`` of the indexed reads"""
+        if not self.num_indexed_reads:
+            return 0.0
+        return 100.0 * count / self.num_indexed_reads
+
+    def get_lanes(self):
+        """Return list of ``(lane, counts)`` pairs ordered by lane, counts ordered by rank
+
+        Uses the prefetched ``counts`` if present, e.g., restricted with
+        ``AdapterCountQuerySet.top()``.
+        """
+        counts = sorted(self.counts.all(), key=lambda c: (c.lane, c.rank))
+        return [
+            (lane, list(group)) for lane, group in itertools.groupby(counts, lambda c: c.lane)]
+
+    def __str__(self):
+        return 'AdapterStats({}, {})'.format(self.flow_cell_id, self.index_read)
+
+
+class AdapterCountQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``AdapterCount`` with the common queries"""
+
+    def top(self, num):
+        """Return the ``num`` most frequent adapters of each lane, all for ``num`` being ``None``"""
+        if num is None:
+            return self
+        return self.filter(rank__lte=num)
+
+    def for_sequence(self, sequence):
+        """Return the counts of adapter ``sequence`` in all flow cells, latest runs first"""
+        return self.filter(sequence=sequence.upper()).select_related(
+            'stats__flow_cell', 'stats__flow_cell__sequencing_machine').order_by(
+                '-stats__flow_cell__run_date', '-stats__flow_cell__id', 'stats__index_read',
+                'lane')
+
+
+class AdapterCount(models.Model):
+    """Count of one adapter sequence in one lane, part of ``AdapterStats``"""
+
+    class Meta:
+        ordering = ['stats', 'lane', 'rank']
+        index_together = [('stats', 'lane', 'rank')]
+
+    objects = AdapterCountQuerySet.as_manager()
+
+    #: The statistics of the index read
+    stats = models.ForeignKey(AdapterStats, related_name='counts', on_delete=models.CASCADE)
+
+    #: Key of the lane in ``info_adapters``
+    lane = models.CharField(max_length=50)
+
+    #: The adapter sequence
+    sequence = models.CharField(max_length=200, db_index=True)
+
+    #: Number of reads with the adapter sequence
+    count = models.BigIntegerField()
+
+    #: Rank of the count in the lane, starting at 1 for the most frequent adapter
+    rank = models.PositiveIntegerField()
+
+    #: Percentage of the indexed reads
+    ratio = models.FloatField()
+
+    # Permissions -------------------------------------------------------------
+
+    # The boilerplate below ("DRY permissions") hooks up the DRY REST permission system into our
+    # django-rules based system.
+
+    @staticmethod
+    def has_read_permission(request):
+        return True
+
+    @staticmethod
+    def has_write_permission(request):
+        return False
+
+    @staticmethod
+    def has_list_permission(request):
+        return request.user.has_perm('flowcells.AdapterCount:list')
+
+    # Boilerplate str/repr ----------------------------------------------------
+
+    def __str__(self):
+        return 'AdapterCount({}, {}, {}, {})'.format(
+            self.stats_id, self.lane, self.sequence, self.count)
+
+
+# Tombstone -------------------------------------------------------------------
+
+#: Names of the models for which tombstones are recorded
+TOMBSTONE_MODEL_NAMES = ('flowcell', 'library', 'barcodeset', 'barcodesetentry')
+
+
+def get_tombstone_retention_start():
+    """Return ``datetime`` before which tombstones are pruned
+
+    This is ``settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS`` days ago.
+    """
+    return timezone.now() - datetime.timedelta(days=settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS)
+
+
+class TombstoneQuerySet(models.QuerySet):
+    """Custom ``QuerySet`` for ``Tombstone`` with support for pruning"""
+
+    def prune(self, before=None):
+        """Delete the tombstones of objects deleted before ``before``, return their number
+
+        ``before`` defaults to ``get_tombstone_retention_start()``.
+        """
+        if before is None:
+            before = get_tombstone_retention_start()
+        num_deleted, _ = self.filter(deleted__lt=before).delete()
+        return num_deleted
+
+
+class Tombstone(models.Model):
+    """Record of a deleted object, allows API clients to synchronize deletions
+
+    Created in the ``post_delete`` signal handlers of the models listed in
+    ``TOMBSTONE_MODEL_NAMES``.  Tombstones are kept for
+    ``settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS`` days and removed with the
+    ``prune_tombstones`` management command.
+    """
+
+    class Meta:
+        ordering = ['deleted', 'id']
+        index_together = [('deleted', 'id')]
+
+    objects = TombstoneQuerySet.as_manager()
+
+    #: Date and time of deletion
+    deleted = models.DateTimeField(default=timezone.now)
+
+    #: Lower-case name of the deleted object's model
+    model_name = models.CharField(max_length=50, db_index=True)
+
+    #: UUID of the deleted object
+    uuid = models.UUIDField()
+
+    # Permissions -------------------------------------------------------------
+
+    # The boilerplate below ("DRY permissions") hooks up the DRY REST permission system into our
+    # django-rules based system.
+
+    @staticmethod
+    def has_read_permission(request):
+        return True
+
+    @staticmethod
+    def has_write_permission(request):
+        return False
+
+    @staticmethod
+    def has_list_permission(request):
+        return request.user.has_perm('flowcells.Tombstone:list')
+
+    # Boilerplate str/repr ----------------------------------------------------
+
+    def __str__(self):
+        return 'Tombstone({}, {}, {})'.format(self.model_name, self.uuid, self.deleted)
+
+    def __repr__(self):
+        return str(self)
+
+
+# Email outbox ----------------------------------------------------------------
+
+
+class OutgoingEmail(TimeStampedModel):
+    """An email waiting in the outbox to be sent by the ``send_queued_emails`` command
+
+    Emails are removed from the outbox once sent.  When sending fails, the next attempt is
+    scheduled with exponential backoff until the email is marked as ``failed``.  Emails with a
+    ``digest_key`` are held back for the digest window and further notifications with the same
+    key and recipient are merged into them.
+    """
+
+    class Meta:
+        ordering = ['next_attempt', 'id']
+        index_together = [('failed', 'next_attempt')]
+
+    #: The email subject
+    subject = models.CharField(max_length=998)
+
+    #: The email body
+    body = models.TextField()
+
+    #: The sender's email address
+    sender = models.CharField(max_length=254)
+
+    #: The recipient's email address
+    recipient = models.CharField(max_length=254)
+
+    #: Number of failed attempts to send the email
+    attempts = models.PositiveIntegerField(default=0)
+
+    #: The email is not sent before this point in time
+    next_attempt = models.DateTimeField(default=timezone.now)
+
+    #: Error message of the last failed attempt
+    last_error = models.TextField(blank=True, default='')
+
+    #: Whether sending the email has been given up
+    failed = models.BooleanField(default=False)
+
+    #: Key for merging notifications into a digest, e.g., ``flowcell_updated:<uuid>``
+    digest_key = models.CharField(max_length=100, blank=True, default='', db_index=True)
+
+    #: Names of the users that triggered the notifications merged into this email
+    digest_users = ArrayField(models.CharField(max_length=150), default=list, blank=True)
+
+    #: Number of notifications merged into this email
+    digest_count = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return 'OutgoingEmail({}, {}, {})'.format(self.recipient, self.subject, self.attempts)
+
+    def __repr__(self):
+        return str(self)
@@ -7,59 +7,84 @@ DEMUX_OPERATOR = 'Demultiplexing Operator'
 DEMUX_ADMIN = 'Demultiplexing Admin'
 IMPORT_BOT = 'Import Bot'
 
+# Group Membership -------------------------------------------------------
+
+
+def get_group_names(user):
+    """Return names of the user's groups
+
+    The names are loaded with one query and memoized on the user object.  As the user object is
+    loaded anew for each request, this is a per-request cache serving all predicates and
+    template checks.
+    """
+    if user is None or not hasattr(user, 'groups'):
+        return frozenset()
+    if not hasattr(user, '_group_names_cache'):
+        user._group_names_cache = frozenset(user.groups.values_list('name', flat=True))
+    return user._group_names_cache
+
+
+def is_group_member(*groups):
+    """Return predicate checking membership in all ``groups`` using ``get_group_names()``"""
+    @rules.predicate('is_group_member:{}'.format(','.join(groups)))
+    def fn(user):
+        return set(groups).issubset(get_group_names(user))
+    return fn
+
+
 # Predicates -------------------------------------------------------------
 
 
 @rules.predicate
 def is_flow_cell_owner(user, flow_cell):
     """Whether or not user is owner of the given flow cell"""
-    if not flow_cell:
+    if not flow_cell or not flow_cell.owner_id:
         return False
     else:
-        return flow_cell.owner == user
+        return flow_cell.owner_id == user.pk
 
 
 @rules.predicate
 def is_librarys_flow_cell_owner(user, library):
     """Whether or not is owner of the given flow cell's library'"""
-    if not library or not library.flow_cell:
+    if not library or not library.flow_cell or not library.flow_cell.owner_id:
         return False
     else:
-        return library.flow_cell.owner == user
+        return library.flow_cell.owner_id == user.pk
 
 
 @rules.predicate
 def is_message_author(user, message):
     """Whether or not the user created the message"""
-    if not message or not message.author:
+    if not message or not message.author_id:
         return False
     else:
-        return message.author == user
+        return message.author_id == user.pk
 
 
 @rules.predicate
 def is_attachment_message_author(user, att):
     """Whether or not the user created the attachment's message"""
-    if not att or not att.message or not att.message.author:
+    if not att or not att.message or not att.message.author_id:
         return False
     else:
-        return att.message.author == user
+        return att.message.author_id == user.pk
 
 
 #: Whether or not has the "guest" group
-is_guest = rules.is_group_member(GUEST)
+is_guest = is_group_member(GUEST)
 
 #: Whether or not has the "Instrument Operator" group
-is_instrument_operator = rules.is_group_member(INSTRUMENT_OPERATOR)
+is_instrument_operator = is_group_member(INSTRUMENT_OPERATOR)
 
 #: Whether or not has the "Demultiplexing Operator" group
-is_demux_operator = rules.is_group_member(DEMUX_OPERATOR)
+is_demux_operator = is_group_member(DEMUX_OPERATOR)
 
 #: Whether or not has the "Demultiplexing Admin" group
-is_demux_admin = rules.is_group_member(DEMUX_ADMIN)
+is_demux_admin = is_group_member(DEMUX_ADMIN)
 
 #: Whether or not has the "Import Bot" group
-is_import_bot = rules.is_group_member(IMPORT_BOT)
+is_import_bot = is_group_member(IMPORT_BOT)
 
 
 # Permissions ------------------------------------------------------------
@@ -126,6 +151,15 @@ rules.add_perm('flowcells.FlowCell:by_vendor_id',
 rules.add_perm('flowcells.FlowCell:sample_sheet',
                is_guest | is_instrument_operator | is_demux_operator |
                is_demux_admin | is_import_bot | rules.is_superuser)
+rules.add_perm('flowcells.FlowCell:sample_sheets',
+               is_guest | is_instrument_operator | is_demux_operator |
+               is_demux_admin | is_import_bot | rules.is_superuser)
+rules.add_perm('flowcells.FlowCell:quality_scores',
+               is_guest | is_instrument_operator | is_demux_operator |
+               is_demux_admin | is_import_bot | rules.is_superuser)
+rules.add_perm('flowcells.FlowCell:barcode_collisions',
+               is_guest | is_instrument_operator | is_demux_operator |
+               is_demux_admin | is_import_bot | rules.is_superuser)
 
 # Adding flow cells can be done by everyone, updating is only possible to
 # owners, demux operators and upwards.
@@ -139,6 +173,12 @@ rules.add_perm(
     is_flow_cell_owner | is_demux_operator | is_demux_admin |
     rules.is_superuser
 )
+# Post-sequencing information (adapters, quality scores) is also written by the import bot
+rules.add_perm(
+    'flowcells.FlowCell:post_sequencing',
+    is_flow_cell_owner | is_demux_operator | is_demux_admin |
+    is_import_bot | rules.is_superuser
+)
 rules.add_perm(
     'flowcells.FlowCell:destroy',
     is_flow_cell_owner | is_demux_operator | is_demux_admin |
@@ -170,6 +210,16 @@ rules.add_perm(
     is_import_bot | rules.is_superuser
 )
 
+# Searching adapter counts across flow cells requires at least the guest group
+rules.add_perm('flowcells.AdapterCount:list',
+               is_guest | is_instrument_operator | is_demux_operator |
+               is_demux_admin | is_import_bot | rules.is_superuser)
+
+# Listing tombstones of deleted objects requires at least the guest group
+rules.add_perm('flowcells.Tombstone:list',
+               is_guest | is_instrument_operator | is_demux_operator |
+               is_demux_admin | is_import_bot | rules.is_superuser)
+
 # Viewing and listing messages requires at least the guest group
 rules.add_perm('flowcells.Message:list',
                is_guest | is_instrument_operator | is_demux_operator |
@@ -193,6 +243,13 @@ rules.add_perm(
     is_message_author | is_demux_admin | rules.is_superuser
 )
 
+# Downloading attached files requires at least the guest role
+rules.add_perm(
+    'threads.Attachment:retrieve',
+    is_guest | is_instrument_operator | is_demux_operator |
+    is_demux_admin | is_import_bot | rules.is_superuser
+)
+
 # Attaching files to messages to flow cells and modifying messages
 rules.add_perm(
     'threads.Attachment:create',
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Search over flow cells, libraries, barcodes, and messages
+
+Names and sequences are matched as substrings or by trigram similarity, backed by ``pg_trgm``
+GIN indexes.  Messages are matched by full text search on ``Message.search_vector``.  The
+results of all types are ranked together and ``SearchResults`` can be paginated with Django's
+``Paginator``.
+"""
+
+from collections import namedtuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils.functional import cached_property
+
+from ..threads.models import Message
+from .models import BarcodeSetEntry, FlowCell, Library
+
+#: Text search configuration, must match the one of the trigger maintaining ``search_vector``
+SEARCH_CONFIG = 'english'
+
+#: One search result for display
+SearchResult = namedtuple('SearchResult', ('type', 'title', 'description', 'url', 'rank'))
+
+
+def _trigram_search(queryset, query, fields):
+    """Filter ``queryset`` to records with ``query`` in ``fields`` and annotate ``rank``
+
+    Records match if they contain ``query`` or are similar to it.  Both conditions can use the
+    ``gin_trgm_ops`` indexes on the fields.
+    """
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{field + '__icontains': query})
+        condition |= Q(**{field + '__trigram_similar': query})
+    similarities = [TrigramSimilarity(field, query) for field in fields]
+    rank = similarities[0] if len(similarities) == 1 else Greatest(*similarities)
+    return queryset.filter(condition).annotate(rank=rank).order_by('-rank', 'pk')
+
+
+def search_flow_cells(query):
+    """Return ``FlowCell`` objects matching ``query`` by vendor ID or label"""
+    return _trigram_search(
+        FlowCell.objects.summary().select_related('sequencing_machine'), query,
+        ('vendor_id', 'label'))
+
+
+def search_libraries(query):
+    """Return ``Library`` objects matching ``query`` by name"""
+    return _trigram_search(
+        Library.objects.select_related('flow_cell').only(
+            'name', 'flow_cell', 'flow_cell__uuid', 'flow_cell__vendor_id'),
+        query, ('name',))
+
+
+def search_barcodes(query):
+    """Return ``BarcodeSetEntry`` objects matching ``query`` by name or sequence"""
+    return _trigram_search(
+        BarcodeSetEntry.objects.select_related('barcode_set'), query, ('name', 'sequence'))
+
+
+def search_messages(query):
+    """Return ``Message`` objects matching ``query`` in title or body by full text search"""
+    search_query = SearchQuery(query, config=SEARCH_CONFIG)
+    return Message.objects.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)).order_by('-rank', 'pk')
+
+
+#: The functions for searching the different types, the order breaks ties in the ranking
+SEARCH_FUNCTIONS = (search_flow_cells, search_libraries, search_barcodes, search_messages)
+
+
+def _load_thread_objects(messages):
+    """Set the flow cells of ``messages`` as their ``thread_object``, loaded with one query"""
+    content_type = ContentType.objects.get_for_model(FlowCell)
+    flow_cells = FlowCell.objects.summary().select_related('sequencing_machine').in_bulk(
+        [msg.object_id for msg in messages if msg.content_type_id == content_type.pk])
+    for msg in messages:
+        if msg.object_id in flow_cells and msg.content_type_id == content_type.pk:
+            msg.thread_object = flow_cells[msg.object_id]
+
+
+class SearchResults:
+    """The ranked ``SearchResult`` objects for ``query``
+
+    Supports ``count()`` and slicing as used by ``Paginator``.  For a slice, the top records of
+    each type are fetched up to the end of the slice and merged by rank, with the related
+    objects needed for display loaded in bulk.
+    """
+
+    def __init__(self, query):
+        #: The search query
+        self.query = query
+        #: One ``QuerySet`` per type, ordered by decreasing rank
+        self.querysets = [func(query) for func in SEARCH_FUNCTIONS]
+
+    @cached_property
+    def _count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop if key.stop is not None else self._count
+        objects = []
+        for queryset in self.querysets:
+            objects += list(queryset[:stop])
+        objects.sort(key=lambda obj: -obj.rank)  # stable, keeps order of types for ties
+        objects = objects[start:stop]
+        _load_thread_objects([obj for obj in objects if isinstance(obj, Message)])
+        return [self._build_result(obj) for obj in objects]
+
+    @staticmethod
+    def _build_result(obj):
+        values = obj.get_search_result()
+        return SearchResult(
+            values['type'], values['title'], values['description'], obj.get_absolute_url(),
+            obj.rank)
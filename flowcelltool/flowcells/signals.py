@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Signal handlers for the flowcells app"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    BarcodeSet, BarcodeSetEntry, FlowCell, Library, Tombstone, get_deleting_flow_cell_pks)
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+def touch_flow_cell(sender, instance, **kwargs):
+    """Update ``modified`` of the flow cell on changes to its libraries
+
+    This invalidates the cached sample sheets (see ``import_export.SampleSheetCache``).  Skipped
+    for the libraries removed along with their flow cell by ``FlowCell.delete()``.
+    """
+    if instance.flow_cell_id in get_deleting_flow_cell_pks():
+        return
+    FlowCell.objects.filter(pk=instance.flow_cell_id).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=BarcodeSetEntry)
+@receiver(post_delete, sender=BarcodeSetEntry)
+def touch_barcode_set(sender, instance, **kwargs):
+    """Update ``modified`` of the barcode set on changes to its entries
+
+    The entries are part of the barcode set in the API, so they are synchronized with it.
+    """
+    BarcodeSet.objects.filter(pk=instance.barcode_set_id).update(modified=timezone.now())
+
+
+@receiver(post_delete, sender=FlowCell)
+@receiver(post_delete, sender=Library)
+@receiver(post_delete, sender=BarcodeSet)
+@receiver(post_delete, sender=BarcodeSetEntry)
+def create_tombstone(sender, instance, **kwargs):
+    """Record deletion of objects for the ``modified_since`` synchronization in the API"""
+    Tombstone.objects.create(model_name=sender._meta.model_name, uuid=instance.uuid)
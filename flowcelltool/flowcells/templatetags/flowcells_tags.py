@@ -4,10 +4,12 @@ import textwrap
 
 from django.shortcuts import reverse
 from django import template
-from django.contrib.auth.models import Group
 
 import pagerange
 
+from ..models import get_flow_cell_mode
+from ..rules import get_group_names
+
 register = template.Library()
 
 
@@ -58,41 +60,18 @@ def startswith(text, starts):
 
 @register.filter
 def has_group(user, group_name):
-    group = Group.objects.get(name=group_name)
-    return group in user.groups.all()
+    return group_name in get_group_names(user)
 
 
 @register.filter(is_safe=True)
 def flow_cell_mode(info_reads):
     """Return flow cell sequencing mode."""
-    res = ''
-    if info_reads:
-        read_lens = [
-            a['num_cycles'] for a in info_reads if not a['is_indexed_read']]
-        if len(read_lens) == 1:
-            res = '1x{}'.format(read_lens[0])
-        elif len(set(read_lens)) == 1:
-            res = '2x{}'.format(read_lens[0])
-        else:
-            res = ' + '.join(map(str, read_lens))
-        index_lens = [
-            a['num_cycles'] for a in info_reads if a['is_indexed_read']]
-        if index_lens:
-            res += '/'
-            if len(set(index_lens)) == 1:
-                res += '{}x{}'.format(len(index_lens), index_lens[0])
-            else:
-                res += '+'.join(map(str, index_lens))
-    return res or '?x?'
+    return get_flow_cell_mode(info_reads) or '?x?'
 
 
 @register.filter
 def flowcell_mode_ok(flowcell):
-    if (not flowcell.info_planned_reads or
-            not flowcell.info_final_reads):
-        return False
-    return (flow_cell_mode(flowcell.info_planned_reads) ==
-            flow_cell_mode(flowcell.info_final_reads))
+    return flowcell.is_flow_cell_mode_ok()
 
 
 @register.filter
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""Tests for the behaviour of the API beyond permissions"""
+
+import datetime
+import io
+import tarfile
+import zipfile
+
+from django.utils import timezone
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from test_plus.test import TestCase
+import yaml
+
+from .. import models
+from .test_models import (
+    SequencingMachineMixin, FlowCellMixin, BarcodeSetMixin, BarcodeSetEntryMixin, LibraryMixin,
+    INFO_ADAPTERS)
+from .test_permissions import DEMUX_OPERATOR, IMPORT_BOT, INSTRUMENT_OPERATOR
+
+
+class TestFlowCellList(
+        TestCase, LibraryMixin, SequencingMachineMixin, FlowCellMixin,
+        BarcodeSetEntryMixin, BarcodeSetMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=DEMUX_OPERATOR))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.barcode_set = self._make_barcode_set()
+        self.barcode = self._make_barcode_set_entry(self.barcode_set)
+        self.barcode2 = self._make_barcode_set_entry(self.barcode_set, 'AR02', 'CGATATA')
+
+    def _make_flow_cells(self, count):
+        result = []
+        for i in range(count):
+            flow_cell = self._make_flow_cell(
+                self.user, datetime.date(2016, 3, 3), self.machine, 815 + i, 'A',
+                'BCDEFGH{:03}'.format(i), 'LABEL', 8, models.STATUS_COMPLETE,
+                'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+            self._make_library(
+                flow_cell, 'LIB_001', models.REFERENCE_HUMAN, self.barcode_set, self.barcode,
+                [1, 2], self.barcode_set, self.barcode2)
+            self._make_library(
+                flow_cell, 'LIB_002', models.REFERENCE_HUMAN, self.barcode_set, self.barcode2,
+                [1, 2])
+            result.append(flow_cell)
+        return result
+
+    def _get_num_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('api_v1:flowcell-list'))
+            self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count(self):
+        self._make_flow_cells(2)
+        self._get_num_queries()  # warm up caches, e.g., content types
+        num_queries = self._get_num_queries()
+        self._make_flow_cells(5)
+        self.assertEqual(self._get_num_queries(), num_queries)
+
+    def test_list_cursor_pagination(self):
+        self._make_flow_cells(3)
+        response = self.client.get(reverse('api_v1:flowcell-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(
+            [lib['barcode2'] for lib in response.data['results'][0]['libraries']],
+            [str(self.barcode2.uuid), None])
+
+    def test_list_modified_since(self):
+        flow_cells = self._make_flow_cells(3)
+        since = timezone.now()
+        flow_cells[0].libraries.get(name='LIB_002').delete()
+        flow_cells[1].delete()
+        response = self.client.get(
+            reverse('api_v1:flowcell-list'), {'modified_since': since.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [fc['uuid'] for fc in response.data['results']], [str(flow_cells[0].uuid)])
+        self.assertEqual(len(response.data['results'][0]['libraries']), 1)
+        response = self.client.get(
+            reverse('api_v1:tombstone-list'),
+            {'modified_since': since.isoformat(), 'model': 'flowcell'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [t['uuid'] for t in response.data['results']], [str(flow_cells[1].uuid)])
+
+    def test_list_modified_since_overlap(self):
+        flow_cells = self._make_flow_cells(2)
+        since = timezone.now()
+        models.FlowCell.objects.filter(pk=flow_cells[0].pk).update(
+            modified=since - datetime.timedelta(seconds=30))
+        models.FlowCell.objects.filter(pk=flow_cells[1].pk).update(
+            modified=since - datetime.timedelta(seconds=90))
+        with self.settings(FLOWCELLS_MODIFIED_SINCE_OVERLAP=60):
+            response = self.client.get(
+                reverse('api_v1:flowcell-list'), {'modified_since': since.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [fc['uuid'] for fc in response.data['results']], [str(flow_cells[0].uuid)])
+
+    def test_tombstones_retention(self):
+        since = timezone.now() - datetime.timedelta(days=11)
+        with self.settings(FLOWCELLS_TOMBSTONE_RETENTION_DAYS=10):
+            response = self.client.get(
+                reverse('api_v1:tombstone-list'), {'modified_since': since.isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('modified_since', response.data)
+
+    def test_list_modified_since_invalid(self):
+        response = self.client.get(reverse('api_v1:flowcell-list'), {'modified_since': 'xxx'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestFlowCellRules(TestCase, SequencingMachineMixin, FlowCellMixin):
+
+    def setUp(self):
+        self.machine = self._make_machine()
+        self.inst_op = self.make_user('inst_op')
+        self.inst_op.groups.add(Group.objects.get(name=INSTRUMENT_OPERATOR))
+        self.other = self.make_user('other')
+        self.flow_cells = [
+            self._make_flow_cell(
+                owner, datetime.date(2016, 3, 3), self.machine, 815 + i, 'A',
+                'BCDEFGH{:03}'.format(i), 'LABEL', 8, models.STATUS_COMPLETE,
+                'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+            for i, owner in enumerate((self.inst_op, self.other, self.inst_op))]
+
+    def test_rule_queries(self):
+        flow_cells = list(models.FlowCell.objects.order_by('pk'))
+        with self.assertNumQueries(1):  # groups of user
+            retrieve = [
+                fc.pk for fc in flow_cells
+                if self.inst_op.has_perm('flowcells.FlowCell:retrieve', fc)]
+            update = [
+                fc.pk for fc in flow_cells
+                if self.inst_op.has_perm('flowcells.FlowCell:update', fc)]
+        self.assertEqual(retrieve, [fc.pk for fc in self.flow_cells])
+        self.assertEqual(update, [self.flow_cells[0].pk, self.flow_cells[2].pk])
+
+
+class TestAdapterStats(TestCase, SequencingMachineMixin, FlowCellMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=IMPORT_BOT))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            None, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+
+    def test_post_sequencing(self):
+        response = self.client.patch(
+            reverse('api_v1:flowcell-post-sequencing', kwargs={'uuid': self.flow_cell.uuid}),
+            {'info_adapters': INFO_ADAPTERS}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.flow_cell.refresh_from_db()
+        self.assertEqual(self.flow_cell.info_adapters, INFO_ADAPTERS)
+        self.assertEqual(models.AdapterCount.objects.count(), 4)
+
+    def test_adapter_count_by_sequence(self):
+        self.flow_cell.info_adapters = INFO_ADAPTERS
+        self.flow_cell.save()
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        response = self.client.get(
+            reverse('api_v1:adaptercount-list'), {'sequence': 'CGATCGAT'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(r['flow_cell'], r['lane'], r['count']) for r in response.data['results']],
+            [(str(self.flow_cell.uuid), '1', 500), (str(self.flow_cell.uuid), '2', 100)])
+        response = self.client.get(reverse('api_v1:adaptercount-list'))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestQualityScores(TestCase, SequencingMachineMixin, FlowCellMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=IMPORT_BOT))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            None, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.scores = {'per_lane': {'1': [[0, 12, 1000, 3000]] * 151}}
+
+    def test_post_and_get(self):
+        url = reverse('api_v1:flowcell-quality-scores', kwargs={'uuid': self.flow_cell.uuid})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.patch(
+            reverse('api_v1:flowcell-post-sequencing', kwargs={'uuid': self.flow_cell.uuid}),
+            {'info_quality_scores': self.scores}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('info_quality_scores', response.data)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.scores)
+        response = self.client.get(
+            reverse('api_v1:flowcell-detail', kwargs={'uuid': self.flow_cell.uuid}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('info_quality_scores', response.data)
+        response = self.client.get(url, {'lane': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.scores)
+        self.assertEqual(self.client.get(url, {'lane': '2'}).status_code, 404)
+
+    def test_post_other_layout(self):
+        scores = {'per_lane': {'1': [['Q30']]}, 'version': 2}
+        response = self.client.patch(
+            reverse('api_v1:flowcell-post-sequencing', kwargs={'uuid': self.flow_cell.uuid}),
+            {'info_quality_scores': scores}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            reverse('api_v1:flowcell-quality-scores', kwargs={'uuid': self.flow_cell.uuid}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, scores)
+
+
+class TestBarcodeCollisions(
+        TestCase, SequencingMachineMixin, FlowCellMixin, BarcodeSetMixin, BarcodeSetEntryMixin,
+        LibraryMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=DEMUX_OPERATOR))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            None, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.barcode_set = self._make_barcode_set()
+        self.barcode1 = self._make_barcode_set_entry(self.barcode_set, 'AR01', 'ACGTACGT')
+        self.barcode2 = self._make_barcode_set_entry(self.barcode_set, 'AR02', 'ACGTTTGT')
+        self.library1 = self._make_library(
+            self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN, self.barcode_set, self.barcode1,
+            [1])
+        self.library2 = self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN, self.barcode_set, self.barcode2,
+            [1])
+        self.url = reverse(
+            'api_v1:flowcell-barcode-collisions', kwargs={'uuid': self.flow_cell.uuid})
+
+    def test_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{
+            'lane': 1,
+            'library': {'uuid': str(self.library1.uuid), 'name': 'LIB_001'},
+            'other': {'uuid': str(self.library2.uuid), 'name': 'LIB_002'},
+            'distance': 2,
+            'distance2': None,
+        }])
+
+    def test_get_mismatches(self):
+        response = self.client.get(self.url, {'mismatches': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+        response = self.client.get(self.url, {'mismatches': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSampleSheet(
+        TestCase, SequencingMachineMixin, FlowCellMixin, BarcodeSetMixin, BarcodeSetEntryMixin,
+        LibraryMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=DEMUX_OPERATOR))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            None, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.barcode_set = self._make_barcode_set()
+        self.barcode = self._make_barcode_set_entry(self.barcode_set)
+        self._make_library(
+            self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN, self.barcode_set, self.barcode,
+            [1, 2])
+
+    def test_streaming(self):
+        url = reverse('api_v1:flowcell-sample-sheet', kwargs={'uuid': self.flow_cell.uuid})
+        response = self.client.get(url, {'sheet_format': 'csv_v1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(content.splitlines()[1:], [
+            'BCDEFGHIXX,1,LIB_001,hg19,ACGTGTTA,,N,PE_indexing,John Doe,Project',
+            'BCDEFGHIXX,2,LIB_001,hg19,ACGTGTTA,,N,PE_indexing,John Doe,Project',
+        ])
+
+
+class TestSampleSheets(
+        TestCase, SequencingMachineMixin, FlowCellMixin, BarcodeSetMixin, BarcodeSetEntryMixin,
+        LibraryMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=DEMUX_OPERATOR))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.machine = self._make_machine()
+        self.barcode_set = self._make_barcode_set()
+        self.barcode = self._make_barcode_set_entry(self.barcode_set)
+        self.flow_cells = []
+        for i in range(3):
+            flow_cell = self._make_flow_cell(
+                None, datetime.date(2016, 3, 3), self.machine, 815 + i, 'A',
+                'BCDEFGHI{}X'.format(i), 'LABEL', 8, models.STATUS_COMPLETE,
+                'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+            self._make_library(
+                flow_cell, 'LIB_00{}'.format(i), models.REFERENCE_HUMAN, self.barcode_set,
+                self.barcode, [1, 2])
+            self.flow_cells.append(flow_cell)
+        self.url = reverse('api_v1:flowcell-sample-sheets')
+
+    def _get_content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_yaml(self):
+        response = self.client.get(self.url, {
+            'uuid': [str(self.flow_cells[0].uuid)], 'vendor_id': 'BCDEFGHI1X'})
+        sheets = list(yaml.safe_load_all(self._get_content(response).decode('utf-8')))
+        self.assertEqual(
+            [sheet[0]['libraries'][0]['name'] for sheet in sheets], ['LIB_000', 'LIB_001'])
+
+    def test_tar(self):
+        response = self.client.post(self.url, {
+            'vendor_id': ['BCDEFGHI0X', 'BCDEFGHI2X'], 'sheet_format': 'csv_v2'}, format='json')
+        with tarfile.open(fileobj=io.BytesIO(self._get_content(response))) as archive:
+            names = archive.getnames()
+            content = archive.extractfile(names[1]).read().decode('utf-8')
+        self.assertEqual(names, [
+            self.flow_cells[0].get_full_name() + '.csv',
+            self.flow_cells[2].get_full_name() + '.csv'])
+        self.assertIn('1,LIB_002,,,,AR01,ACGTGTTA,Project,', content)
+
+    def test_zip(self):
+        response = self.client.get(self.url, {
+            'status_conversion': models.STATUS_INITIAL, 'archive_format': 'zip'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(self._get_content(response))) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
+    def test_queries(self):
+        # warm up caches, e.g., content types
+        self._get_content(self.client.get(self.url, {'vendor_id': 'BCDEFGHI2X'}))
+        counts = []
+        for vendor_ids in (['BCDEFGHI0X'], ['BCDEFGHI0X', 'BCDEFGHI1X', 'BCDEFGHI2X']):
+            with CaptureQueriesContext(connection) as context:
+                self._get_content(self.client.get(self.url, {'vendor_id': vendor_ids}))
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'vendor_id': 'UNKNOWN'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'uuid': 'invalid'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {
+            'vendor_id': 'BCDEFGHI0X', 'sheet_format': 'csv_v1', 'archive_format': 'yaml',
+        }).status_code, 400)
+
+    def test_split(self):
+        response = self.client.get(
+            self.url, {'vendor_id': 'BCDEFGHI0X', 'split': 'lane', 'archive_format': 'zip'})
+        with zipfile.ZipFile(io.BytesIO(self._get_content(response))) as archive:
+            self.assertEqual(archive.namelist(), [
+                self.flow_cells[0].get_full_name() + '_lane_1.csv',
+                self.flow_cells[0].get_full_name() + '_lane_2.csv'])
+        response = self.client.get(self.url, {
+            'vendor_id': 'BCDEFGHI0X', 'split': 'lane', 'sheet_format': 'csv_v1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_split_one_flow_cell(self):
+        url = reverse('api_v1:flowcell-sample-sheet', kwargs={'uuid': self.flow_cells[1].uuid})
+        response = self.client.get(url, {'split': 'index_length'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="BCDEFGHI1X.tar"')
+        with tarfile.open(fileobj=io.BytesIO(self._get_content(response))) as archive:
+            self.assertEqual(
+                archive.getnames(), [self.flow_cells[1].get_full_name() + '_index_8_0.csv'])
@@ -182,12 +182,12 @@ class TestPermissionsFlowCellApi(FlowCellMixin, SequencingMachineMixin, TestApiP
             self.import_bot_flow_cell.delete()
         self.inst_op_flow_cell = self._make_flow_cell(
             self.inst_op, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description',
             uuid=self.inst_op_flow_cell_uuid)
         self.import_bot_flow_cell = self._make_flow_cell(
             self.import_bot, datetime.date(2016, 3, 3), self.machine, 816, 'A',
-            'BCDEFGHIXY', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXY', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description',
             uuid=self.bot_flow_cell_uuid)
 
@@ -207,6 +207,32 @@ class TestPermissionsFlowCellApi(FlowCellMixin, SequencingMachineMixin, TestApiP
         self.assert_render_200_ok(URL, GOOD, 'get')
         self.assert_render_403_permission_denied(URL, BAD, 'get')
 
+    def test_flowcell_sample_sheet_conditional(self):
+        URL = reverse(
+            'api_v1:flowcell-sample-sheet', kwargs={'uuid': self.import_bot_flow_cell.uuid})
+        client = APIClient()
+        client.force_authenticate(user=self.demux_op)
+        response = client.get(URL, {'sheet_format': 'csv_v2'})
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+        response = client.get(URL, {'sheet_format': 'csv_v2'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        response = client.get(URL, {'sheet_format': 'yaml'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.import_bot_flow_cell.save()
+        response = client.get(URL, {'sheet_format': 'csv_v2'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+    def test_flowcell_sample_sheets(self):
+        URL = reverse('api_v1:flowcell-sample-sheets')
+        GOOD = (self.inst_op, self.guest, self.demux_op, self.demux_admin,
+                self.import_bot, self.superuser)
+        BAD = (self.anonymous, self.nogroup)
+        data = {'uuid': str(self.import_bot_flow_cell.uuid)}
+        self.assert_render_200_ok(URL, GOOD, 'get', data=data)
+        self.assert_render_403_permission_denied(URL, BAD, 'get', data=data)
+
     def test_flowcell_destroy_inst_op_owned(self):
         URL = reverse('api_v1:flowcell-detail', kwargs={'uuid': self.inst_op_flow_cell.uuid})
         GOOD = (self.demux_admin, self.superuser, self.demux_op, self.inst_op)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Tests for module collisions
+"""
+
+import itertools
+import random
+
+from test_plus.test import TestCase
+
+from .. import collisions, models
+
+
+def _make_barcode(sequence, encode):
+    if not sequence:
+        return None
+    result = models.BarcodeSetEntry(name=sequence, sequence=sequence)
+    if encode:
+        result.update_encodings()
+    return result
+
+
+def _make_library(name, lane_numbers, sequence, sequence2=None, encode=False):
+    """Return unsaved Library with unsaved barcodes for testing, with the precomputed encodings
+    of the sequences if ``encode``
+    """
+    return models.Library(
+        name=name, lane_numbers=lane_numbers, barcode=_make_barcode(sequence, encode),
+        barcode2=_make_barcode(sequence2, encode))
+
+
+class TestHammingDistances(TestCase):
+
+    def test_encode_sequences(self):
+        codes = collisions.encode_sequences(['ACGT', 'acgtN'])
+        self.assertEqual(codes.tolist(), [[0, 1, 2, 3], [0, 1, 2, 3]])
+
+    def test_hamming_distances(self):
+        codes = collisions.encode_sequences(['ACGT', 'ACGA', 'TTTT'])
+        self.assertEqual(
+            collisions.hamming_distances(codes).tolist(),
+            [[0, 1, 3], [1, 0, 4], [3, 4, 0]])
+
+
+class TestFindCollisions(TestCase):
+
+    def test_single_index(self):
+        libraries = [
+            _make_library('LIB_1', [1, 2], 'ACGTACGT'),
+            _make_library('LIB_2', [1], 'ACGTACGA'),
+            _make_library('LIB_3', [2], 'ACGTACGA'),
+            _make_library('LIB_4', [1], 'TTGCACGA'),
+        ]
+        result = collisions.find_collisions(libraries)
+        self.assertEqual(
+            [(c.lane, c.library.name, c.other.name, c.distance, c.distance2) for c in result],
+            [(1, 'LIB_1', 'LIB_2', 1, None), (2, 'LIB_1', 'LIB_3', 1, None)])
+
+    def test_mismatches(self):
+        libraries = [
+            _make_library('LIB_1', [1], 'ACGTACGT'),
+            _make_library('LIB_2', [1], 'ACGTATTA'),
+        ]
+        self.assertEqual(collisions.find_collisions(libraries, mismatches=1), [])
+        self.assertEqual(len(collisions.find_collisions(libraries, mismatches=2)), 1)
+
+    def test_dual_index(self):
+        libraries = [
+            _make_library('LIB_1', [1], 'ACGTACGT', 'AAAAAAAA'),
+            _make_library('LIB_2', [1], 'ACGTACGT', 'AAATTTTT'),
+            _make_library('LIB_3', [1], 'ACGTACGA', 'AAAAAAAT'),
+        ]
+        for workflow in (models.INDEX_WORKFLOW_A, models.INDEX_WORKFLOW_B):
+            result = collisions.find_collisions(libraries, workflow)
+            self.assertEqual(
+                [(c.library.name, c.other.name, c.distance, c.distance2) for c in result],
+                [('LIB_1', 'LIB_3', 1, 1)])
+
+    def test_workflow_b_compares_revcomp(self):
+        # Compared on the shortest length, i.e., the first six bases of the reverse complement
+        libraries = [
+            _make_library('LIB_1', [1], 'ACGTACGT', 'GGAAATTT'),
+            _make_library('LIB_2', [1], 'ACGTACGT', 'AAATTT'),
+        ]
+        self.assertEqual(collisions.find_collisions(libraries, models.INDEX_WORKFLOW_A), [])
+        result = collisions.find_collisions(libraries, models.INDEX_WORKFLOW_B)
+        self.assertEqual([(c.distance, c.distance2) for c in result], [(0, 0)])
+
+    def test_packed_sequences(self):
+        rng = random.Random(42)
+        barcodes = [
+            _make_barcode(''.join(rng.choice('ACGT') for _ in range(length)), True)
+            for length in (6, 8, 8, 10)]
+        for reverse_complement in (False, True):
+            self.assertEqual(
+                collisions.encode_barcodes(barcodes, reverse_complement).tolist(),
+                collisions.encode_sequences([
+                    barcode.get_sequence(reverse_complement) for barcode in barcodes]).tolist())
+
+    def test_packed_sequences_workflow_b(self):
+        libraries = [
+            _make_library('LIB_1', [1], 'ACGTACGT', 'GGAAATTT', encode=True),
+            _make_library('LIB_2', [1], 'ACGTACGT', 'AAATTT', encode=True),
+        ]
+        self.assertEqual(collisions.find_collisions(libraries, models.INDEX_WORKFLOW_A), [])
+        result = collisions.find_collisions(libraries, models.INDEX_WORKFLOW_B)
+        self.assertEqual([(c.distance, c.distance2) for c in result], [(0, 0)])
+
+    def test_missing_barcode(self):
+        libraries = [
+            _make_library('LIB_1', [1], 'ACGTACGT'),
+            _make_library('LIB_2', [1], None),
+        ]
+        result = collisions.find_collisions(libraries)
+        self.assertEqual([(c.distance, c.distance2) for c in result], [(None, None)])
+
+    def test_384_plex(self):
+        rng = random.Random(42)
+        sequences = sorted({
+            ''.join(rng.choice('ACGT') for _ in range(8)) for _ in range(384)})
+        libraries = [
+            _make_library('LIB_{}'.format(i), [1], seq) for i, seq in enumerate(sequences)]
+        result = collisions.find_collisions(libraries)
+        expected = [
+            (lib.name, other.name) for lib, other in itertools.combinations(libraries, 2)
+            if sum(a != b for a, b in zip(lib.barcode.sequence, other.barcode.sequence)) <= 2]
+        self.assertEqual([(c.library.name, c.other.name) for c in result], expected)
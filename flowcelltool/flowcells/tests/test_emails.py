@@ -3,9 +3,12 @@
 """
 
 import datetime
+from unittest.mock import patch
 
 from django.core import mail
 from django.contrib.auth.models import Group
+from django.test import override_settings
+from django.utils import timezone
 
 from .. import emails, models, rules
 from .test_models import FlowCellMixin, SequencingMachineMixin
@@ -17,16 +20,23 @@ class FlowCellEmailTest(
         TestCase, FlowCellMixin, SequencingMachineMixin):
 
     def setUp(self):
+        # Run on-commit callbacks right away, the test's transaction is never committed
+        self.on_commit_patcher = patch(
+            'django.db.transaction.on_commit', side_effect=lambda func: func())
+        self.on_commit_patcher.start()
         self._create_users()
         self.machine = self._make_machine()
         self.flow_cell_name = '160303_{}_0815_A_BCDEFGHIXX_LABEL'.format(
             self.machine.vendor_id)
         self.flowcell = self._make_flow_cell(
             self.owner, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description',
             self.demux_operator)
 
+    def tearDown(self):
+        self.on_commit_patcher.stop()
+
     def make_user(self, username, email, groups=[], is_superuser=False):
         result = super().make_user(username=username, password='testpassword')
         result.email = email
@@ -51,6 +61,9 @@ class FlowCellEmailTest(
 
     def test_email_on_created(self):
         emails.email_flowcell_created(self.owner, self.flowcell)
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual(emails.send_queued_emails(), (5, 0))
+        self.assertEqual(0, models.OutgoingEmail.objects.count())
         EXPECTED = {
             'owner@example.com', 'admin@example.com',
             'operator@example.com', 'demux-operator@example.com',
@@ -62,6 +75,7 @@ class FlowCellEmailTest(
 
     def test_email_on_updated(self):
         emails.email_flowcell_updated(self.other, self.flowcell)
+        emails.send_queued_emails()
         EXPECTED = {
             'owner@example.com', 'admin@example.com',
             'operator@example.com', 'demux-operator@example.com',
@@ -73,6 +87,7 @@ class FlowCellEmailTest(
 
     def test_email_on_deleted(self):
         emails.email_flowcell_deleted(self.other, self.flowcell)
+        emails.send_queued_emails()
         EXPECTED = {
             'owner@example.com', 'admin@example.com',
             'operator@example.com', 'demux-operator@example.com',
@@ -81,3 +96,39 @@ class FlowCellEmailTest(
         ACTUAL = set(', '.join(m.to) for m in mail.outbox)
         self.assertEqual(EXPECTED, ACTUAL)
         self.assertEqual(6, len(mail.outbox))
+
+    def test_send_queued_emails_batch(self):
+        emails.email_flowcell_updated(self.other, self.flowcell)
+        self.assertEqual(emails.send_queued_emails(batch_size=4), (4, 0))
+        self.assertEqual(emails.send_queued_emails(batch_size=4), (2, 0))
+        self.assertEqual(emails.send_queued_emails(batch_size=4), (0, 0))
+        self.assertEqual(6, len(mail.outbox))
+
+    def test_send_queued_emails_retry(self):
+        emails.email_flowcell_created(self.owner, self.flowcell)
+        with patch('django.core.mail.EmailMessage.send', side_effect=IOError('refused')):
+            self.assertEqual(emails.send_queued_emails(), (0, 5))
+        email = models.OutgoingEmail.objects.first()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, 'refused')
+        self.assertGreater(email.next_attempt, timezone.now())
+        # Not due yet because of backoff
+        self.assertEqual(emails.send_queued_emails(), (0, 0))
+        models.OutgoingEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(emails.send_queued_emails(), (5, 0))
+        self.assertEqual(5, len(mail.outbox))
+
+    @override_settings(FLOWCELLS_EMAIL_DIGEST_WINDOW=600)
+    def test_email_on_updated_digest(self):
+        emails.email_flowcell_updated(self.other, self.flowcell)
+        emails.email_flowcell_updated(self.owner, self.flowcell)
+        emails.email_flowcell_updated(self.other, self.flowcell)
+        self.assertEqual(6, models.OutgoingEmail.objects.count())
+        # Held back for the digest window
+        self.assertEqual(emails.send_queued_emails(), (0, 0))
+        models.OutgoingEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(emails.send_queued_emails(), (6, 0))
+        self.assertEqual(6, len(mail.outbox))
+        message = [m for m in mail.outbox if m.to == ['admin@example.com']][0]
+        self.assertIn('updated 3 times', message.subject)
+        self.assertIn('updated 3 times by other, owner', message.body)
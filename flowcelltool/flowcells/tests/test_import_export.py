@@ -3,9 +3,17 @@
 """
 
 import datetime
+import json
 import textwrap
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from test_plus.test import TestCase
+import yaml
 
 from .. import import_export
 from ..models import BarcodeSet, BarcodeSetEntry
@@ -87,6 +95,29 @@ class TestBarcodeSetLoader(TestCase):
         self.assertEquals(entries[1].name, 'AR02')
         self.assertEquals(entries[1].sequence, 'CGGC')
 
+    def test_run_many_entries(self):
+        entries = [{'name': 'AR{:03}'.format(i), 'sequence': 'ACGT{:04}'.format(i)}
+                   for i in range(384)]
+        JSON = json.dumps({'name': 'Big Set', 'short_name': 'BigSet', 'entries': entries})
+        # savepoint, insert set, fetch existing entries, savepoint, bulk insert, touch set,
+        # 2x release
+        with self.assertNumQueries(8):
+            barcode_set = import_export.BarcodeSetLoader().run(JSON)
+        self.assertEquals(barcode_set.entries.count(), 384)
+
+    def test_run_duplicate_sequence(self):
+        JSON = json.dumps({
+            'name': 'Agilent SureSelect XT Test',
+            'short_name': 'SureSelectTest',
+            'entries': [
+                {'name': 'AR01', 'sequence': 'ATTA'},
+                {'name': 'AR02', 'sequence': 'ATTA'},
+            ]})
+        with self.assertRaises(ValidationError):
+            import_export.BarcodeSetLoader().run(JSON)
+        self.assertEquals(BarcodeSet.objects.count(), 0)
+        self.assertEquals(BarcodeSetEntry.objects.count(), 0)
+
 
 class TestsFlowCellDumper(
         TestCase, LibraryMixin, SequencingMachineMixin, FlowCellMixin,
@@ -101,7 +132,7 @@ class TestsFlowCellDumper(
             self.barcode_set, 'AR02', 'CGATATA')
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -225,7 +256,7 @@ class TestsSampleSheetGenerator(
             self.machine.vendor_id)
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -239,24 +270,27 @@ class TestsSampleSheetGenerator(
         RESULT = self.generator.build_yaml()
         EXPECTED = textwrap.dedent(r"""
             # CUBI Flow Cell YAML
-            - name: '160303_NS5001234_0815_A_BCDEFGHIXX_LABEL'
+            - name: 160303_NS5001234_0815_A_BCDEFGHIXX_LABEL
               num_lanes: 8
-              operator: 'John Doe'
+              operator: John Doe
               rta_version: 2
               is_paired: true
-              status: seq_complete
+              status_sequencing: initial
+              status_conversion: initial
+              status_delivery: initial
+              delivery_type: seq
               read_length: 151
               libraries:
-                - name: 'LIB_001'
-                  reference: 'hg19'
-                  barcode_set: 'SureSelectTest'
+                - name: LIB_001
+                  reference: hg19
+                  barcode_set: SureSelectTest
                   barcode:
-                    name: 'AR01'
-                    seq: 'ACGTGTTA'
-                  barcode_set2: 'SureSelectTest'
+                    name: AR01
+                    seq: ACGTGTTA
+                  barcode_set2: SureSelectTest
                   barcode2:
-                    name: 'AR02'
-                    seq: 'TATATCG'
+                    name: AR02
+                    seq: TATATCG
                   lanes: [1, 2]
         """).lstrip()
         self.assertEqual(RESULT, EXPECTED)
@@ -288,8 +322,169 @@ class TestsSampleSheetGenerator(
             151
 
             [Data]
-            Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,i7_Index_ID,index,Sample_Project,Description
-            1,LIB_001,,,,AR01,ACGTGTTA,Project,
-            2,LIB_001,,,,AR01,ACGTGTTA,Project,
+            Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,i7_Index_ID,index,I5_Index_ID,index2,Sample_Project,Description
+            1,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,
+            2,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,
         """).lstrip()
         self.assertEqual(RESULT, EXPECTED)
+
+    def test_build_v2_workflow_a(self):
+        self.machine.dual_index_workflow = models.INDEX_WORKFLOW_A
+        self.machine.save()
+        RESULT = self.generator.build_v2()
+        self.assertIn('1,LIB_001,,,,AR01,ACGTGTTA,AR02,CGATATA,Project,', RESULT)
+
+    def test_build_v2_single_index(self):
+        self.library.barcode2 = None
+        self.library.barcode_set2 = None
+        self.library.save()
+        RESULT = self.generator.build_v2()
+        self.assertIn(
+            'Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,i7_Index_ID,index,'
+            'Sample_Project,Description\n', RESULT)
+        self.assertIn('1,LIB_001,,,,AR01,ACGTGTTA,Project,\n', RESULT)
+
+    def test_split_v2(self):
+        barcode3 = self._make_barcode_set_entry(self.barcode_set, 'AR03', 'GGCCAA')
+        self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN, self.barcode_set, barcode3, [1])
+        generator = import_export.FlowCellSampleSheetGenerator(self.flow_cell)
+        data_rows = {
+            split_by: [
+                (suffix, ''.join(chunks).split('[Data]\n')[1].splitlines()[1:])
+                for suffix, chunks in generator.split_v2(split_by)]
+            for split_by in import_export.SHEET_SPLITS}
+        self.assertEqual(data_rows['lane'], [
+            ('lane_1', ['1,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,',
+                        '1,LIB_002,,,,AR03,GGCCAA,,,Project,']),
+            ('lane_2', ['2,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,']),
+        ])
+        self.assertEqual(data_rows['index_length'], [
+            ('index_8_7', ['1,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,',
+                           '2,LIB_001,,,,AR01,ACGTGTTA,AR02,TATATCG,Project,']),
+            ('index_6_0', ['1,LIB_002,,,,AR03,GGCCAA,Project,']),
+        ])
+        chunks = dict(generator.split_v2('index_length'))['index_6_0']
+        self.assertIn(
+            'Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,i7_Index_ID,index,'
+            'Sample_Project,Description\n', ''.join(chunks))
+        self.assertEqual(
+            generator.get_file_name('csv_v2', 'lane_1'), self.flow_cell_name + '_lane_1.csv')
+
+    def test_build_yaml_quoting(self):
+        self.library.name = '001: "LIB"'
+        self.library.save()
+        generator = import_export.FlowCellSampleSheetGenerator(self.flow_cell)
+        sheet = yaml.safe_load(generator.build_yaml())
+        self.assertEqual(sheet[0]['libraries'][0]['name'], '001: "LIB"')
+        self.assertEqual(sheet[0]['libraries'][0]['lanes'], [1, 2])
+
+    def test_build_v1_quoting(self):
+        self.library.name = 'LIB,001'
+        self.library.save()
+        generator = import_export.FlowCellSampleSheetGenerator(self.flow_cell)
+        self.assertIn('BCDEFGHIXX,1,"LIB,001",hg19', generator.build_v1())
+
+    def test_iter(self):
+        self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN,
+            self.barcode_set, self.barcode2, [1, 2])
+        generator = import_export.FlowCellSampleSheetGenerator(self.flow_cell)
+        for sheet_format, method in (
+                ('yaml', generator.build_yaml), ('csv_v1', generator.build_v1),
+                ('csv_v2', generator.build_v2)):
+            chunks = list(generator.iter(sheet_format))
+            self.assertGreater(len(chunks), 2)
+            self.assertEqual(''.join(chunks), method())
+
+    def test_build_all_one_query(self):
+        self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN,
+            self.barcode_set, self.barcode2, [1, 2])
+        generator = import_export.FlowCellSampleSheetGenerator(self.flow_cell)
+        with self.assertNumQueries(1):
+            generator.build_yaml()
+            generator.build_v1()
+            generator.build_v2()
+
+
+class TestSampleSheetCache(
+        TestCase, LibraryMixin, SequencingMachineMixin, FlowCellMixin,
+        BarcodeSetEntryMixin, BarcodeSetMixin):
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.barcode_set = self._make_barcode_set()
+        self.barcode = self._make_barcode_set_entry(self.barcode_set)
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.library = self._make_library(
+            self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
+            self.barcode_set, self.barcode, [1, 2])
+
+    def _get_cache(self):
+        return import_export.SampleSheetCache(
+            models.FlowCell.objects.select_related('sequencing_machine').get(
+                pk=self.flow_cell.pk))
+
+    def test_get_cached(self):
+        content = self._get_cache().get('csv_v2')
+        self.assertIn('LIB_001', content)
+        sheet_cache = self._get_cache()
+        # aggregate query for the cache key only
+        with self.assertNumQueries(1):
+            self.assertEqual(sheet_cache.get('csv_v2'), content)
+
+    def test_stream(self):
+        sheet_cache = self._get_cache()
+        chunks = list(sheet_cache.stream('csv_v1'))
+        self.assertEqual(len(chunks), 3)
+        sheet_cache = self._get_cache()
+        # aggregate query for the cache key only, the complete sheet comes from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(list(sheet_cache.stream('csv_v1')), [''.join(chunks)])
+
+    def test_etag_changes(self):
+        etags = {self._get_cache().get_etag(fmt) for fmt in import_export.SHEET_FORMATS}
+        self.assertEqual(len(etags), 3)
+        etag = self._get_cache().get_etag('yaml')
+        self.assertEqual(self._get_cache().get_etag('yaml'), etag)
+        self.library.name = 'LIB_002'
+        self.library.save()
+        self.assertNotEqual(self._get_cache().get_etag('yaml'), etag)
+        self.assertIn('LIB_002', self._get_cache().get('yaml'))
+
+    def test_etag_changes_barcode(self):
+        etag = self._get_cache().get_etag('csv_v1')
+        self.barcode.sequence = 'GATTACA'
+        self.barcode.save()
+        self.assertNotEqual(self._get_cache().get_etag('csv_v1'), etag)
+
+    def test_etag_changes_machine(self):
+        etag = self._get_cache().get_etag('yaml')
+        self.machine.vendor_id = 'NS5004321'
+        self.machine.save()
+        self.assertNotEqual(self._get_cache().get_etag('yaml'), etag)
+        self.assertIn('NS5004321', self._get_cache().get('yaml'))
+
+    def test_delete_flow_cell(self):
+        self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN, self.barcode_set, None, [3])
+        with CaptureQueriesContext(connection) as context:
+            self.flow_cell.delete()
+        self.assertFalse([
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "flowcells_flowcell"')])
+
+    def test_delete_flow_cell_failed(self):
+        modified = models.FlowCell.objects.get(pk=self.flow_cell.pk).modified
+        with patch('django.db.models.sql.DeleteQuery.delete_batch', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.flow_cell.delete()
+        self.library.name = 'LIB_002'
+        self.library.save()
+        self.assertGreater(models.FlowCell.objects.get(pk=self.flow_cell.pk).modified, modified)
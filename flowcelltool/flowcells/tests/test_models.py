@@ -3,10 +3,13 @@
 """
 
 import datetime
+import io
 from uuid import uuid4
 
 from django.forms.models import model_to_dict
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.utils import timezone
 
 from test_plus.test import TestCase
 
@@ -159,6 +162,35 @@ class TestBarcodeSetEntry(TestCase, BarcodeSetEntryMixin, BarcodeSetMixin):
         with self.assertRaises(ValidationError):
             self._make_barcode_set_entry(self.barcode_set, 'ARNN', 'ACGTGTTA')
 
+    def test_encodings(self):
+        self.assertEqual(self.barcode.sequence_revcomp, 'TAACACGT')
+        self.assertEqual(bytes(self.barcode.sequence_2bit), b'\x1b\xbc')
+        self.assertEqual(self.barcode.get_sequence(reverse_complement=True), 'TAACACGT')
+        self.barcode.sequence = 'ACGTN'
+        self.barcode.save(update_fields=['sequence'])
+        self.barcode.refresh_from_db()
+        self.assertEqual(self.barcode.sequence_revcomp, 'NACGT')
+        self.assertIsNone(self.barcode.sequence_2bit)
+
+    def test_encodings_bulk_save(self):
+        self.barcode.sequence = 'TTTTGGGG'
+        entries = models.BarcodeSetEntry.objects.bulk_save(self.barcode_set, [
+            self.barcode, models.BarcodeSetEntry(name='AR02', sequence='CCA')])
+        for entry in entries:
+            entry.refresh_from_db()
+        self.assertEqual(
+            [(e.sequence_revcomp, bytes(e.sequence_2bit)) for e in entries],
+            [('CCCCAAAA', b'\xff\xaa'), ('TGG', b'\x50')])
+
+    def test_pack_sequence(self):
+        self.assertEqual(models.pack_sequence(''), b'')
+        self.assertEqual(models.pack_sequence('ACGTT'), b'\x1b\xc0')
+        self.assertIsNone(models.pack_sequence('ACGTN'))
+        self.assertEqual(models.unpack_sequence(models.pack_sequence('ACGTT'), 5), 'ACGTT')
+
+    def test_revcomp(self):
+        self.assertEqual(models.revcomp('AACGTNt'), 'aNACGTT')
+
 
 class FlowCellMixin:
     """Helper mixin that provides _make_flow_cell()"""
@@ -166,7 +198,7 @@ class FlowCellMixin:
     @classmethod
     def _make_flow_cell(
             cls, owner, run_date, sequencing_machine, run_number, slot,
-            vendor_id, label, num_lanes, status, operator, is_paired,
+            vendor_id, label, num_lanes, status_sequencing, operator, is_paired,
             index_read_count, rta_version, read_length, description,
             demux_operator=None, uuid=None):
         uuid = uuid or uuid4()
@@ -187,7 +219,7 @@ class FlowCellMixin:
             'vendor_id': vendor_id,
             'label': label,
             'num_lanes': num_lanes,
-            'status': status,
+            'status_sequencing': status_sequencing,
             'operator': operator,
             'rta_version': rta_version,
             'description': description,
@@ -208,7 +240,7 @@ class TestFlowCell(TestCase, SequencingMachineMixin, FlowCellMixin,
         self.barcode = self._make_barcode_set_entry(self.barcode_set)
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def test_initialization(self):
@@ -219,7 +251,7 @@ class TestFlowCell(TestCase, SequencingMachineMixin, FlowCellMixin,
             'description': 'Description',
             'sequencing_machine': self.machine.pk,
             'num_lanes': 8,
-            'status': models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'status': models.STATUS_COMPLETE,
             'operator': 'John Doe',
             'info_adapters': None,
             'info_final_reads': None,
@@ -228,7 +260,6 @@ class TestFlowCell(TestCase, SequencingMachineMixin, FlowCellMixin,
                 {'is_indexed_read': False, 'num_cycles': 151, 'number': 2},
                 {'is_indexed_read': True,'num_cycles': 8, 'number': 3},
             ],
-            'info_quality_scores': None,
             'rta_version': models.RTA_VERSION_V2,
             'label': 'LABEL',
             'run_date': datetime.date(2016, 3, 3),
@@ -239,6 +270,27 @@ class TestFlowCell(TestCase, SequencingMachineMixin, FlowCellMixin,
         }
         self.assertEqual(model_to_dict(self.flow_cell), EXPECTED)
 
+    def test_read_summary(self):
+        self.assertEqual(self.flow_cell.flow_cell_mode, '2x151/1x8')
+        self.assertEqual(self.flow_cell.final_flow_cell_mode, '')
+        self.assertTrue(self.flow_cell.is_paired)
+        self.assertEqual(self.flow_cell.read_length, 151)
+        self.assertEqual(self.flow_cell.index_read_count, 1)
+        self.assertFalse(self.flow_cell.is_flow_cell_mode_ok())
+        self.flow_cell.info_final_reads = self.flow_cell.info_planned_reads
+        self.flow_cell.save(update_fields=('info_final_reads',))
+        flow_cell = models.FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(flow_cell.final_flow_cell_mode, '2x151/1x8')
+        self.assertTrue(flow_cell.is_flow_cell_mode_ok())
+
+    def test_summary(self):
+        with self.assertNumQueries(1):
+            flow_cell = models.FlowCell.objects.summary().get(pk=self.flow_cell.pk)
+            self.assertEqual(flow_cell.flow_cell_mode, '2x151/1x8')
+        self.assertEqual(
+            flow_cell.get_deferred_fields(),
+            {'info_planned_reads', 'info_final_reads', 'info_adapters'})
+
     def test__str__(self):
         EXPECTED = '160303_NS5001234_0815_A_BCDEFGHIXX_LABEL'
         self.assertEqual(str(self.flow_cell), EXPECTED)
@@ -289,7 +341,7 @@ class TestLibrary(
             self.barcode_set, 'AR02', 'CGATATA')
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -350,6 +402,29 @@ class TestLibrary(
                 self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN,
                 self.barcode_set, self.barcode, [9, 10])
 
+    def test_lane_layout(self):
+        library2 = self._make_library(
+            self.flow_cell, 'LIB_002', models.REFERENCE_HUMAN,
+            self.barcode_set, self.barcode2, [2, 3])
+        flow_cell = models.FlowCell.objects.prefetch_related('libraries').get(
+            pk=self.flow_cell.pk)
+        with self.assertNumQueries(0):
+            layout = flow_cell.lane_layout
+            self.assertIs(layout, flow_cell.lane_layout)
+        self.assertEqual(len(layout), 8)
+        self.assertEqual(layout[0], [self.library])
+        self.assertEqual(layout[1], [self.library, library2])
+        self.assertEqual(layout[2], [library2])
+        self.assertEqual(layout.invalid, [])
+        self.assertEqual([len(row) for row in layout.rows], [4, 4])
+        self.assertEqual(layout.rows[1][0][0], 5)
+
+    def test_lane_layout_invalid(self):
+        self.library.lane_numbers = [2, 9, 10]
+        layout = models.LaneLayout(8, [self.library])
+        self.assertEqual(layout[1], [self.library])
+        self.assertEqual(layout.invalid, [self.library])
+
     def test_validate_flow_cell_lane_nos_(self):
         """Check that the lane count is compatible with lane numbers in the
         contained libraries
@@ -362,3 +437,193 @@ class TestLibrary(
         self.flow_cell.num_lanes = 4
         with self.assertRaises(ValidationError):
             self.flow_cell.save()
+
+
+class TestLibraryBulkSave(
+        TestCase, LibraryMixin, SequencingMachineMixin, FlowCellMixin,
+        BarcodeSetEntryMixin, BarcodeSetMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.barcode_set = self._make_barcode_set()
+        self.barcode = self._make_barcode_set_entry(self.barcode_set)
+        self.barcode2 = self._make_barcode_set_entry(
+            self.barcode_set, 'AR02', 'CGATATA')
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.library = self._make_library(
+            self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
+            self.barcode_set, self.barcode, [1, 2])
+
+    def _build_library(self, name, barcode, lane_numbers):
+        return models.Library(
+            name=name, reference=models.REFERENCE_HUMAN, barcode_set=self.barcode_set,
+            barcode=barcode, lane_numbers=lane_numbers)
+
+    def test_bulk_save(self):
+        libraries = [
+            self._build_library('LIB_{:03}'.format(i), self.barcode, [3 + i])
+            for i in range(6)]
+        self.library.name = 'UPDATED'
+        # fetch existing, savepoint, update, bulk insert, touch flow cell, release savepoint
+        with self.assertNumQueries(6):
+            models.Library.objects.bulk_save(self.flow_cell, libraries + [self.library])
+        self.assertEqual(models.Library.objects.count(), 7)
+        self.assertEqual(models.Library.objects.get(pk=self.library.pk).name, 'UPDATED')
+
+    def test_bulk_save_delete(self):
+        library = self._build_library('LIB_001', self.barcode, [1])
+        models.Library.objects.bulk_save(self.flow_cell, [library], deleted=[self.library])
+        self.assertEqual(models.Library.objects.count(), 1)
+        self.assertEqual(models.Library.objects.get().lane_numbers, [1])
+
+    def test_validate_name_in_batch(self):
+        libraries = [
+            self._build_library('LIB_002', self.barcode, [3]),
+            self._build_library('LIB_002', self.barcode2, [3, 4])]
+        with self.assertRaises(ValidationError):
+            models.Library.objects.bulk_save(self.flow_cell, libraries)
+        self.assertEqual(models.Library.objects.count(), 1)
+
+    def test_validate_barcodes_against_existing(self):
+        libraries = [self._build_library('LIB_002', self.barcode, [2, 3])]
+        with self.assertRaises(ValidationError):
+            models.Library.objects.bulk_save(self.flow_cell, libraries)
+
+    def test_validate_lane_nos(self):
+        libraries = [self._build_library('LIB_002', self.barcode2, [9])]
+        with self.assertRaises(ValidationError):
+            models.Library.objects.bulk_save(self.flow_cell, libraries)
+
+
+#: Example ``info_adapters`` value for the adapter statistics tests
+INFO_ADAPTERS = [
+    {
+        'num_indexed_reads': 1000,
+        'min_read_threshold': 0.01,
+        'per_lane': {
+            '2': {'CGATCGAT': 100, 'ATTATATA': 300},
+            '1': {'CGATCGAT': 500},
+        },
+    },
+    {
+        'num_indexed_reads': 1000,
+        'min_read_threshold': 0.01,
+        'per_lane': {
+            '1': {'tttttttt': 50},
+        },
+    },
+]
+
+
+class TestAdapterStats(TestCase, SequencingMachineMixin, FlowCellMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.flow_cell.info_adapters = INFO_ADAPTERS
+        self.flow_cell.save()
+
+    def test_rebuild(self):
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        stats = list(self.flow_cell.adapter_stats.all())
+        self.assertEqual([s.index_read for s in stats], [1, 2])
+        lanes = stats[0].get_lanes()
+        self.assertEqual([lane for lane, _ in lanes], ['1', '2'])
+        self.assertEqual(
+            [(c.sequence, c.count, c.rank, c.ratio) for c in lanes[1][1]],
+            [('ATTATATA', 300, 1, 30.0), ('CGATCGAT', 100, 2, 10.0)])
+        self.assertEqual(stats[1].get_lanes()[0][1][0].sequence, 'TTTTTTTT')
+
+    def test_rebuild_replaces(self):
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        self.flow_cell.info_adapters = INFO_ADAPTERS[:1]
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        self.assertEqual(models.AdapterStats.objects.count(), 1)
+        self.assertEqual(models.AdapterCount.objects.count(), 3)
+
+    def test_top(self):
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        self.assertEqual(
+            sorted(models.AdapterCount.objects.top(1).values_list('lane', 'sequence')),
+            [('1', 'CGATCGAT'), ('1', 'TTTTTTTT'), ('2', 'ATTATATA')])
+
+    def test_for_sequence(self):
+        models.AdapterStats.objects.rebuild(self.flow_cell)
+        counts = list(models.AdapterCount.objects.for_sequence('cgatcgat'))
+        self.assertEqual([(c.lane, c.count) for c in counts], [('1', 500), ('2', 100)])
+        self.assertEqual(counts[0].stats.flow_cell, self.flow_cell)
+
+
+class TestFlowCellQualityScores(TestCase, SequencingMachineMixin, FlowCellMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.scores = {
+            'per_lane': {'1': [[0, 12, 1000, 3000]] * 151, '2': [[0, 10, 900, 3100]] * 151}}
+
+    def test_set_get(self):
+        self.assertIsNone(self.flow_cell.get_quality_scores())
+        self.flow_cell.set_quality_scores(self.scores)
+        flow_cell = models.FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(flow_cell.get_quality_scores(), self.scores)
+        self.assertEqual(models.FlowCellQualityScores.objects.count(), 2 * 151)
+        record = models.FlowCellQualityScores.objects.get(lane='2', cycle=151)
+        self.assertEqual(record.counts, [0, 10, 900, 3100])
+
+    def test_get_lanes(self):
+        self.flow_cell.set_quality_scores(self.scores)
+        self.assertEqual(
+            self.flow_cell.get_quality_scores(['2']),
+            {'per_lane': {'2': self.scores['per_lane']['2']}})
+        self.assertIsNone(self.flow_cell.get_quality_scores(['3']))
+
+    def test_set_other_layout(self):
+        for scores in ({'per_lane': {'1': [[0, -1]]}}, {'per_lane': {'1': {}}}, {'1': []}, [],
+                       {'per_lane': {}}, {'per_lane': {'1': [[True]]}}):
+            self.flow_cell.set_quality_scores(scores)
+            self.assertEqual(self.flow_cell.get_quality_scores(), scores)
+            self.assertEqual(self.flow_cell.get_quality_scores(['1']), scores)
+            self.assertFalse(models.FlowCellQualityScores.objects.exists())
+            self.assertEqual(models.FlowCellQualityScoresBlob.objects.count(), 1)
+        self.flow_cell.set_quality_scores(self.scores)
+        self.assertFalse(models.FlowCellQualityScoresBlob.objects.exists())
+        self.assertEqual(self.flow_cell.get_quality_scores(), self.scores)
+
+    def test_set_none(self):
+        self.flow_cell.set_quality_scores(self.scores)
+        self.flow_cell.set_quality_scores(None)
+        self.assertIsNone(self.flow_cell.get_quality_scores())
+        self.assertFalse(models.FlowCellQualityScores.objects.exists())
+
+
+class TestTombstone(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.tombstones = [
+            models.Tombstone.objects.create(
+                model_name='flowcell', uuid=uuid4(), deleted=now - datetime.timedelta(days=days))
+            for days in (1, 100)]
+
+    def test_prune(self):
+        self.assertEqual(models.Tombstone.objects.prune(), 1)
+        self.assertEqual(list(models.Tombstone.objects.all()), self.tombstones[:1])
+
+    def test_prune_command(self):
+        stdout = io.StringIO()
+        call_command('prune_tombstones', '--days', '0', stdout=stdout)
+        self.assertIn('Removed 2 tombstone(s)', stdout.getvalue())
+        self.assertFalse(models.Tombstone.objects.exists())
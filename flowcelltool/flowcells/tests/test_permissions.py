@@ -267,11 +267,11 @@ class TestFlowCellViews(
             self.machine.vendor_id)
         self.inst_op_flow_cell = self._make_flow_cell(
             self.inst_op, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.import_bot_flow_cell = self._make_flow_cell(
             self.import_bot, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def test_list(self):
@@ -380,7 +380,7 @@ class TestFlowCellMessageViews(
         self.machine = self._make_machine()
         self.flow_cell = self._make_flow_cell(
             self.inst_op, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         # One message by import bot, instrument operator, and demux operator
         self.msg_import_bot = self._make_message(
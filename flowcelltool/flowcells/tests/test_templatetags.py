@@ -2,8 +2,11 @@
 """Tests for template tags
 """
 
+from django.contrib.auth.models import Group
+
 from test_plus.test import TestCase
 
+from .. import rules
 from ..templatetags import flowcells_tags
 
 
@@ -47,3 +50,18 @@ class TestFAMimeType(TestCase):
     def test_other(self):
         self.assertEquals(
             flowcells_tags.fa_mime_type(''), 'file-o')
+
+
+class TestHasGroup(TestCase):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.user.groups.add(Group.objects.get(name=rules.DEMUX_OPERATOR))
+
+    def test_has_group_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(flowcells_tags.has_group(self.user, rules.DEMUX_OPERATOR))
+            self.assertFalse(flowcells_tags.has_group(self.user, rules.DEMUX_ADMIN))
+            self.assertFalse(flowcells_tags.has_group(self.user, rules.IMPORT_BOT))
+            self.assertTrue(rules.is_demux_operator(self.user))
+            self.assertFalse(rules.is_demux_admin(self.user))
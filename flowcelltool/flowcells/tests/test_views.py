@@ -12,13 +12,17 @@ from test_plus.test import TestCase
 from django.urls import reverse
 from django.forms.models import model_to_dict
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
 
-from .. import models
+from .. import models, views
 from ..models import SequencingMachine, FlowCell, BarcodeSet, \
     BarcodeSetEntry, Library
 
 from ...threads import models as threads_models
+from ...threads.storage import attachment_storage
 
 from .test_models import SequencingMachineMixin, FlowCellMixin, \
     BarcodeSetMixin, BarcodeSetEntryMixin, LibraryMixin
@@ -49,7 +53,7 @@ class TestFlowCellListView(
         self.machine = self._make_machine()
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def test_render(self):
@@ -59,6 +63,34 @@ class TestFlowCellListView(
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['flowcell_list']), 1)
 
+    def test_render_query_count(self):
+        """Test that the number of queries does not depend on the messages and flow cells"""
+        with self.login(self.user):
+            self.client.get(reverse('flowcell_list'))  # warm up caches, e.g., content types
+            with CaptureQueriesContext(connection) as ctx_before:
+                self.client.get(reverse('flowcell_list'))
+        for i in range(3):
+            flow_cell = self._make_flow_cell(
+                self.user, datetime.date(2016, 3, 3), self.machine, 816 + i, 'A',
+                'BCDEFGHI{}X'.format(i), 'LABEL', 8, models.STATUS_COMPLETE,
+                'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+            for title in ('first', 'second'):
+                msg = threads_models.Message.objects.create(
+                    author=self.user,
+                    content_type=ContentType.objects.get_for_model(flow_cell),
+                    object_id=flow_cell.pk, title=title, body='body')
+                msg.attachments.create(payload=ContentFile(b'content', name='file.txt'))
+        with self.login(self.user):
+            with CaptureQueriesContext(connection) as ctx_after:
+                response = self.client.get(reverse('flowcell_list'))
+        self.assertEqual(len(ctx_before), len(ctx_after))
+        flow_cells = {
+            flow_cell.vendor_id: flow_cell for flow_cell in response.context['flowcell_list']}
+        self.assertEqual(flow_cells['BCDEFGHI0X'].num_messages, 2)
+        self.assertEqual(flow_cells['BCDEFGHI0X'].num_files, 2)
+        self.assertEqual(flow_cells['BCDEFGHIXX'].num_messages, 0)
+        self.assertEqual(flow_cells['BCDEFGHIXX'].num_libraries, 0)
+
 
 class TestFlowCellCreateView(
         SuperUserTestCase, FlowCellMixin, SequencingMachineMixin):
@@ -112,7 +144,6 @@ class TestFlowCellCreateView(
             'operator': 'John Doe',
             'demux_operator': None,
             'info_adapters': None,
-            'info_quality_scores': None,
             'info_final_reads': None,
             'info_planned_reads': None,
             'rta_version': models.RTA_VERSION_V2,
@@ -144,7 +175,7 @@ class TestFlowCellDetailView(
         self.client = Client()
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def test_render(self):
@@ -172,7 +203,7 @@ class TestFlowCellUpdateView(
         self.client = Client()
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def tearDown(self):
@@ -209,7 +240,6 @@ class TestFlowCellUpdateView(
             'operator': 'John Doe',
             'demux_operator': None,
             'info_adapters': None,
-            'info_quality_scores': None,
             'info_final_reads': None,
             'info_planned_reads': [
                 {'is_indexed_read': False, 'num_cycles': 151, 'number': 1},
@@ -245,7 +275,7 @@ class TestFlowCellDeleteView(
         self.client = Client()
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
 
     def _set_up_mock(self):
@@ -310,7 +340,7 @@ class TestLibraryUpdateView(
         # Create Flow cell
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library1 = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -738,7 +768,7 @@ class TestFlowCellSetExportView(
             self.barcode_set, 'AR02', 'CGATATA')
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -1315,7 +1345,7 @@ class TestSearchView(
         # Create Flow cell
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library1 = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -1333,13 +1363,118 @@ class TestSearchView(
         with self.login(self.user):
             response = self.client.get(reverse('search'), {'q': '001'})
         self.assertEqual(len(response.context['results']), 1)
-        self.assertEqual(response.context['results'][0].name, 'LIB_001')
+        self.assertEqual(response.context['results'][0].title, 'LIB_001')
+        self.assertEqual(response.context['results'][0].url, self.flow_cell.get_absolute_url())
 
     def test_without_result(self):
         with self.login(self.user):
             response = self.client.get(reverse('search'), {'q': '003'})
         self.assertEqual(len(response.context['results']), 0)
 
+    def test_barcode_and_flow_cell(self):
+        with self.login(self.user):
+            response = self.client.get(reverse('search'), {'q': 'cgatcgat'})
+            self.assertEqual(
+                [(r.type, r.title) for r in response.context['results']],
+                [('Barcode', 'AR01 (CGATCGAT)')])
+            response = self.client.get(reverse('search'), {'q': 'BCDEFGHIXX'})
+            self.assertEqual(response.context['results'][0].type, 'Flow Cell')
+
+    def test_message(self):
+        threads_models.Message.objects.create(
+            author=self.user, content_type=ContentType.objects.get_for_model(self.flow_cell),
+            object_id=self.flow_cell.pk, title='Run finished',
+            body='The adapters look contaminated')
+        with self.login(self.user):
+            response = self.client.get(reverse('search'), {'q': 'contamination'})
+        results = response.context['results']
+        self.assertEqual([(r.type, r.title) for r in results], [('Message', 'Run finished')])
+        self.assertEqual(results[0].url, self.flow_cell.get_absolute_url())
+
+    def test_pagination(self):
+        with patch.object(views.SearchView, 'paginate_by', 1):
+            with self.login(self.user):
+                response = self.client.get(reverse('search'), {'q': 'LIB_00', 'page': 2})
+        self.assertEqual(response.context['paginator'].count, 2)
+        self.assertEqual(len(response.context['results']), 1)
+
+
+# Library Extraction Related ---------------------------------------------
+
+
+class TestBarcodeSuffixIndex(
+        SuperUserTestCase, BarcodeSetMixin, BarcodeSetEntryMixin):
+
+    def setUp(self):
+        self.barcode_set = self._make_barcode_set()
+        for i, name in enumerate(('1', '01', '11', 'A01', 'AR02', 'AR12')):
+            self._make_barcode_set_entry(self.barcode_set, name, 'ACGT{:04}'.format(i))
+        self.index = views.BarcodeSuffixIndex(self.barcode_set.entries.all())
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('1').name, '1')
+        self.assertEqual(self.index.lookup('01').name, '01')
+        self.assertEqual(self.index.lookup('2').name, 'AR02')
+        self.assertEqual(self.index.lookup('02').name, 'AR02')
+        self.assertEqual(self.index.lookup('12').name, 'AR12')
+        self.assertIsNone(self.index.lookup('3'))
+
+
+class TestFlowCellExtractLibrariesView(
+        SuperUserTestCase, FlowCellMixin, SequencingMachineMixin,
+        BarcodeSetMixin, BarcodeSetEntryMixin):
+
+    def setUp(self):
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.barcode_set = self._make_barcode_set()
+        self.barcode1 = self._make_barcode_set_entry(
+            self.barcode_set, 'AR01', 'CGATCGAT')
+        self.barcode2 = self._make_barcode_set_entry(
+            self.barcode_set, 'AR02', 'ATTATATA')
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.url = reverse('flowcell_extract', kwargs={'uuid': self.flow_cell.uuid})
+        self.step_key = 'flow_cell_extract_libraries_view-current_step'
+
+    def test_extract(self):
+        payload = 'LIB_001\t1\t1-2\nLIB_002\t02\t1-2\n'
+        with self.login(self.user), patch.object(
+                views.FlowCellExtractLibrariesView, '_extract_payload',
+                wraps=views.FlowCellExtractLibrariesView._extract_payload) as mock_extract:
+            self.client.post(self.url, {
+                self.step_key: 'paste_tsv',
+                'paste_tsv-payload': payload,
+            })
+            self.client.post(self.url, {
+                self.step_key: 'pick_columns',
+                'pick_columns-reference': models.REFERENCE_HUMAN,
+                'pick_columns-sample_column': 1,
+                'pick_columns-barcode_set': self.barcode_set.uuid,
+                'pick_columns-barcode_column': 2,
+                'pick_columns-first_row': 1,
+                'pick_columns-lane_numbers_column': 3,
+            })
+            with patch.object(
+                    views.FlowCellExtractLibrariesView, '_build_libraries', autospec=True,
+                    side_effect=views.FlowCellExtractLibrariesView._build_libraries
+                    ) as mock_build, patch.object(
+                    models.LibraryBatchValidator, 'validate', autospec=True,
+                    side_effect=models.LibraryBatchValidator.validate) as mock_validate:
+                response = self.client.post(self.url, {self.step_key: 'confirm'})
+        self.assertRedirects(
+            response, reverse('flowcell_view', kwargs={'uuid': self.flow_cell.uuid}),
+            fetch_redirect_response=False)
+        self.assertEqual(mock_extract.call_count, 1)
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertEqual(mock_validate.call_count, 1)
+        libraries = list(Library.objects.order_by('name'))
+        self.assertEqual([lib.name for lib in libraries], ['LIB_001', 'LIB_002'])
+        self.assertEqual([lib.barcode for lib in libraries], [self.barcode1, self.barcode2])
+        self.assertEqual([lib.lane_numbers for lib in libraries], [[1, 2], [1, 2]])
+
 
 # Message Related --------------------------------------------------------
 
@@ -1362,7 +1497,7 @@ class TestMessageCreateView(
         # Create Flow cell
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library1 = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -1410,9 +1545,9 @@ class TestMessageCreateView(
         self.assertEquals(
             threads_models.Message.objects.all().count(), 1)
         self.assertEquals(
-            threads_models.AttachmentFile.objects.all().count(), 1)
+            threads_models.Attachment.objects.all().count(), 1)
         self.assertEquals(
-            threads_models.AttachmentFile.objects.all().count(), 1)
+            threads_models.AttachmentFile.objects.all().count(), 0)
 
         EXPECTED = {
             'object_id': self.flow_cell.pk,
@@ -1428,8 +1563,17 @@ class TestMessageCreateView(
         att = threads_models.Attachment.objects.all()[0]
         self.assertEquals(att.message_id, msg.pk)
 
-        att_file = threads_models.AttachmentFile.objects.all()[0]
-        self.assertEquals(att_file.bytes, 'RXhhbXBsZSBGaWxlIENvbnRlbnQK')
+        self.assertEquals(att.size, len(b'Example File Content\n'))
+        self.assertTrue(att.filename)
+        with attachment_storage.open(att.payload.name) as f:
+            self.assertEquals(f.read(), b'Example File Content\n')
+
+        # Download the attachment again
+        with self.login(self.user):
+            response = self.client.get(att.get_absolute_url())
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(b''.join(response.streaming_content), b'Example File Content\n')
+        self.assertEquals(response['Content-Length'], str(att.size))
 
 
 class MessageMixin:
@@ -1445,6 +1589,68 @@ class MessageMixin:
         return msg
 
 
+class TestAttachmentDeduplication(
+        SuperUserTestCase, FlowCellMixin, SequencingMachineMixin, MessageMixin):
+
+    def setUp(self):
+        self.on_commit_patcher = patch(
+            'django.db.transaction.on_commit', side_effect=lambda func: func())
+        self.on_commit_patcher.start()
+        self.user = self.make_user()
+        self.machine = self._make_machine()
+        self.flow_cell = self._make_flow_cell(
+            self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
+            'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
+        self.msg1 = self._make_message(self.user, self.flow_cell, 'Title 1', 'Body 1')
+        self.msg2 = self._make_message(self.user, self.flow_cell, 'Title 2', 'Body 2')
+
+    def tearDown(self):
+        self.on_commit_patcher.stop()
+
+    def _attach(self, msg, content):
+        return msg.attachments.create(payload=ContentFile(content, name='RunInfo.xml'))
+
+    def test_identical_payloads_stored_once(self):
+        att1 = self._attach(self.msg1, b'<RunInfo />')
+        att2 = self._attach(self.msg2, b'<RunInfo />')
+        att3 = self._attach(self.msg2, b'<RunParameters />')
+
+        self.assertEqual(att1.payload.name, att2.payload.name)
+        self.assertNotEqual(att1.payload.name, att3.payload.name)
+        self.assertEqual(threads_models.AttachmentBlob.objects.count(), 2)
+        blob = threads_models.AttachmentBlob.objects.get(sha256=att1.sha256)
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.size, len(b'<RunInfo />'))
+
+    def test_delete_frees_blob_with_last_reference(self):
+        att1 = self._attach(self.msg1, b'<RunInfo />')
+        att2 = self._attach(self.msg2, b'<RunInfo />')
+        name = att1.payload.name
+
+        att1.delete()
+        blob = threads_models.AttachmentBlob.objects.get(sha256=att2.sha256)
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(att2.payload.storage.exists(name))
+
+        self.msg2.delete()  # cascades to the attachment
+        self.assertEqual(threads_models.AttachmentBlob.objects.count(), 0)
+        self.assertFalse(att2.payload.storage.exists(name))
+
+    def test_upload_before_payload_deletion(self):
+        att1 = self._attach(self.msg1, b'<RunInfo />')
+        name = att1.payload.name
+        callbacks = []
+        with patch('django.db.transaction.on_commit', side_effect=callbacks.append):
+            att1.delete()
+        att2 = self._attach(self.msg2, b'<RunInfo />')
+        for func in callbacks:
+            func()
+        blob = threads_models.AttachmentBlob.objects.get(sha256=att2.sha256)
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(att2.payload.storage.exists(name))
+
+
 class TestMessageDeleteView(
         SuperUserTestCase, FlowCellMixin, SequencingMachineMixin, LibraryMixin,
         BarcodeSetMixin, BarcodeSetEntryMixin, MessageMixin):
@@ -1463,7 +1669,7 @@ class TestMessageDeleteView(
         # Create Flow cell
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library1 = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -1514,7 +1720,7 @@ class TestMessageUpdateView(
         # Create Flow cell
         self.flow_cell = self._make_flow_cell(
             self.user, datetime.date(2016, 3, 3), self.machine, 815, 'A',
-            'BCDEFGHIXX', 'LABEL', 8, models.FLOWCELL_STATUS_SEQ_COMPLETE,
+            'BCDEFGHIXX', 'LABEL', 8, models.STATUS_COMPLETE,
             'John Doe', True, 1, models.RTA_VERSION_V2, 151, 'Description')
         self.library1 = self._make_library(
             self.flow_cell, 'LIB_001', models.REFERENCE_HUMAN,
@@ -2,7 +2,10 @@ import json
 import logging
 import re
 
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db import transaction
+from django.db.models import Prefetch
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404, redirect
 from django.http import HttpResponse, HttpResponseServerError
@@ -16,6 +19,7 @@ from django.views.generic.detail import DetailView, SingleObjectMixin
 from django.views.generic.edit import (
     CreateView, UpdateView, DeleteView, FormView)
 from django.db import IntegrityError
+from django.core.exceptions import ValidationError
 
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field
@@ -23,7 +27,7 @@ from rules.contrib.views import PermissionRequiredMixin
 from formtools.wizard.views import SessionWizardView
 import pagerange
 
-from . import models, forms, import_export
+from . import models, forms, collisions, import_export, search
 from ..threads.views import MessageCreateView, MessageUpdateView, \
     MessageDeleteView
 from . import emails
@@ -235,6 +239,10 @@ class BarcodeSetImportView(
                 'json_file',
                 'Problem during import. Is the barcode set name unique?')
             return self.form_invalid(form)
+        except ValidationError as e:
+            for message in e.messages:
+                form.add_error('json_file', 'Problem during import. {}'.format(message))
+            return self.form_invalid(form)
         return redirect(reverse('barcodeset_view',
                                 kwargs={'uuid': barcode_set.uuid}))
 
@@ -278,8 +286,6 @@ class BarcodeSetEntryUpdateView(
         return barcode_set_entry_form
 
     def form_valid(self, request, barcode_set_entry_form):
-        for form in barcode_set_entry_form:
-            form.instance.barcode_set = self.object
         barcode_set_entry_form.save()
         if request.POST.get('submit_more'):
             return redirect(request.get_full_path())
@@ -322,11 +328,16 @@ class FlowCellListView(
 
     #: Flow cells are sorted by run date (inferred from the name when being
     #: created, latest come first)
-    queryset = models.FlowCell.objects.order_by('-run_date')
+    queryset = models.FlowCell.objects.for_list().order_by('-run_date', '-pk')
 
     #: Pagination with 50 items should work fine for us
     paginate_by = 50
 
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        models.load_list_counts(context['object_list'])
+        return context
+
 
 class FlowCellCreateView(
         LoginRequiredMixin, PermissionRequiredMixin, UuidViewMixin, CreateView):
@@ -378,22 +389,15 @@ class FlowCellDetailView(
         context['helper'].form_tag = False
         context['helper'].form_method = 'GET'
         context['messages'] = self.object.messages.prefetch_related('attachments')
-        # Properly sort the adapters information
+        # Adapter statistics, sorted and with ratios precomputed on write (see AdapterStats)
         if self.object.info_adapters is None:
-            context['info_adapters'] = None
+            context['adapter_stats'] = None
         else:
-            context['info_adapters'] = []
-            for info in self.object.info_adapters:
-                sorted_info = dict(info)
-                sorted_info['per_lane'] = dict(sorted(info['per_lane'].items()))
-                for key in info['per_lane']:
-                    for seq, num in sorted(
-                            info['per_lane'][key].items(), key=lambda x: x[1], reverse=True):
-                        sorted_info['per_lane'][key][seq] = {
-                            'num': num,
-                            'ratio': 100.0 * num / info['num_indexed_reads'],
-                        }
-                context['info_adapters'].append(sorted_info)
+            context['adapter_stats'] = self.object.adapter_stats.prefetch_related(Prefetch(
+                'counts', queryset=models.AdapterCount.objects.top(
+                    settings.FLOWCELLS_ADAPTERS_TOP_N)))
+        context['barcode_collisions'] = collisions.find_flow_cell_collisions(
+            self.object, self.object.libraries.all())
         return context
 
 
@@ -520,12 +524,16 @@ class FlowCellSampleSheetView(
     #: The template
     template_name = 'flowcells/flowcell_sheet.html'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('sequencing_machine')
+
     def get_context_data(self, *args, **kwargs):
+        sheet_cache = import_export.SampleSheetCache(self.object)
         gen = import_export.FlowCellSampleSheetGenerator(self.object)
         context = super().get_context_data(*args, **kwargs)
-        context['csv_v1'] = gen.build_v1()
-        context['csv_v2'] = gen.build_v2()
-        context['yaml'] = gen.build_yaml()
+        # The sheets are rendered chunk by chunk from the cache or the generator
+        for sheet_format in import_export.SHEET_FORMATS:
+            context[sheet_format] = sheet_cache.stream(sheet_format, gen)
         return context
 
 
@@ -639,6 +647,46 @@ class LibraryUpdateView(
         return context
 
 
+class BarcodeSuffixIndex:
+    """Lookup of the "best" matching barcode set entry for a suffix of its name
+
+    The heuristic used for a "best" match is as follows:
+
+    - if the value from the pasted data is equal to the barcode set entry
+      name, pick this one
+    - suffix has to be a suffix of the barcode name
+    - count the number of preceding digits [1-9] before the suffix
+    - the first one with fewest number of digits [1-9] wins
+
+    Effectively this breaks the tie of "1" against "01" and "11" in
+    favour of "01", against "1" and "11" in favour of "1" and so on.
+
+    All suffixes of all entry names are precomputed, such that each lookup is a dict access.
+    """
+
+    def __init__(self, entries):
+        #: Mapping from suffix to (rank, entry)
+        best = {}
+        for pos, entry in enumerate(entries):
+            name = entry.name
+            for i in range(len(name) + 1):
+                suffix = name[i:]
+                if not suffix:
+                    rank = (0, pos)  # the empty suffix matches everything
+                elif i == 0:
+                    rank = (-1, pos)  # perfect match
+                else:
+                    rank = (1 if re.match(r'([1-9]+)$', name[:i]) else 0, pos)
+                if suffix not in best or rank < best[suffix][0]:
+                    best[suffix] = (rank, entry)
+        #: Mapping from suffix to best matching entry
+        self.index = {suffix: entry for suffix, (_, entry) in best.items()}
+
+    def lookup(self, suffix):
+        """Return best matching entry for ``suffix`` or ``None``"""
+        return self.index.get(suffix)
+
+
 class FlowCellExtractLibrariesView(
         LoginRequiredMixin, PermissionRequiredMixin, SessionWizardView):
     """Display of flow cell as sample sheet"""
@@ -672,48 +720,100 @@ class FlowCellExtractLibrariesView(
         """Pass extra arguments to form"""
         kwargs = super(FlowCellExtractLibrariesView, self).get_form_kwargs(step)
         if step == 'pick_columns':
-            table_rows, table_ncols = self._extract_payload(
-                self.get_cleaned_data_for_step('paste_tsv')['payload'])
+            table_rows, table_ncols = self._get_table()
             kwargs.update({
                 'table_rows': table_rows,
                 'table_ncols': table_ncols})
+        elif step == 'confirm':
+            libraries, library_errors = self._get_libraries()
+            kwargs.update({
+                'flow_cell': self._get_flow_cell(),
+                'libraries': libraries,
+                'library_errors': library_errors})
         return kwargs
 
     def get_template_names(self):
         """Return name of current template"""
         return self.TEMPLATES[self.steps.current]
 
+    def process_step(self, form):
+        """Parse the pasted TSV once and keep the resulting table in the wizard storage"""
+        if self.steps.current == 'paste_tsv':
+            table_rows, table_ncols = self._extract_payload(form.cleaned_data['payload'])
+            extra_data = self.storage.extra_data
+            extra_data['table_rows'] = table_rows
+            extra_data['table_ncols'] = len(table_ncols)
+            self.storage.extra_data = extra_data
+            self._table = (table_rows, table_ncols)  # noqa
+        return super().process_step(form)
+
+    def _get_table(self):
+        """Return ``(table_rows, table_ncols)`` for the pasted TSV
+
+        Uses the table stored by ``process_step()`` and only parses the payload again if it is
+        missing, e.g., for wizard runs started before this was introduced.
+        """
+        if not hasattr(self, '_table'):
+            extra_data = self.storage.extra_data
+            if 'table_rows' in extra_data:
+                self._table = (  # noqa
+                    extra_data['table_rows'], list(range(extra_data['table_ncols'])))
+            else:
+                self._table = self._extract_payload(  # noqa
+                    self.get_cleaned_data_for_step('paste_tsv')['payload'])
+        return self._table
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        context['object'] = get_object_or_404(
-            models.FlowCell, uuid=self.kwargs['uuid'])
+        context['object'] = self._get_flow_cell()
         context['helper'] = FormHelper()
         context['helper'].form_tag = False
         context['helper'].template_pack = 'bootstrap4'
         if self.steps.current == 'pick_columns':
-            table_rows, table_ncols = self._extract_payload(
-                self.get_cleaned_data_for_step('paste_tsv')['payload'])
+            table_rows, table_ncols = self._get_table()
             context['table_rows'] = table_rows
             context['table_cols'] = table_ncols
         elif self.steps.current == 'confirm':
-            context['libraries'] = self._build_libraries()
+            context['libraries'] = context['form'].libraries
+            context['barcode_collisions'] = collisions.find_flow_cell_collisions(
+                context['object'], context['form'].libraries)
         return context
 
-    def done(self, *args, **kwargs):
-        flow_cell = get_object_or_404(models.FlowCell, uuid=self.kwargs['uuid'])
+    def done(self, form_list, form_dict, **kwargs):
+        confirm_form = form_dict['confirm']
+        flow_cell = confirm_form.flow_cell
         with transaction.atomic():
-            for library in self._build_libraries():
-                library.save()
+            # validated by the confirm form in this request already
+            models.Library.objects.bulk_save(flow_cell, confirm_form.libraries, validate=False)
             return redirect(reverse(
                 'flowcell_view', kwargs={'uuid': flow_cell.uuid}))
 
+    def _get_flow_cell(self):
+        """Return the flow cell to extract the libraries for, fetched once per request"""
+        if not hasattr(self, '_flow_cell'):
+            self._flow_cell = get_object_or_404(  # noqa
+                models.FlowCell, uuid=self.kwargs['uuid'])
+        return self._flow_cell
+
+    def _get_libraries(self):
+        """Return ``(libraries, library_errors)`` for the confirm step
+
+        On the final POST, formtools creates the confirm form twice, in ``post()`` and in
+        ``render_done()``.  The libraries are built and validated only once per request.
+        """
+        if not hasattr(self, '_libraries'):
+            libraries = self._build_libraries()
+            self._libraries = (  # noqa
+                libraries, forms.ConfirmExtractionForm.validate_libraries(
+                    self._get_flow_cell(), libraries))
+        return self._libraries
+
     def _build_libraries(self):
         """Build library objects from result of paste_tsv and pick_columns
         steps
         """
-        flow_cell = get_object_or_404(models.FlowCell, uuid=self.kwargs['uuid'])
-        table_rows, _ = self._extract_payload(
-            self.get_cleaned_data_for_step('paste_tsv')['payload'])
+        flow_cell = self._get_flow_cell()
+        table_rows, _ = self._get_table()
         pick_results = self.get_cleaned_data_for_step('pick_columns')
         result = []
         for row in table_rows[pick_results['first_row'] - 1:]:
@@ -745,36 +845,18 @@ class FlowCellExtractLibrariesView(
     def _select_barcode(self, row, barcode_set, barcode_column):
         """Select barcode from barcode_set with "best" match
 
-        The heuristic used for a "best" match is as follows:
-
-        - if the value from the pasted data is equal to the barcode set entry
-          name, pick this one
-        - suffix has to be a suffix of the barcode name
-        - count the number of preceding digits [1-9] before the suffix
-        - the first one with fewest number of digits [1-9] wins
-
-        Effectively this breaks the tie of "1" against "01" and "11" in
-        favour of "01", against "1" and "11" in favour of "1" and so on.
+        See ``BarcodeSuffixIndex`` for the heuristic used.  The index is built once per barcode
+        set and request.
         """
-        if not barcode_column:
-            return None
-        else:
-            suffix = row[barcode_column - 1].strip()
-        candidates = []
-        for entry in barcode_set.entries.all():
-            if not entry.name.endswith(suffix):
-                continue  # ignore
-            elif suffix == entry.name:  # perfect match
-                candidates = [(0, entry)]
-                break
-            else:
-                m = re.match(r'([1-9]+)$', entry.name[:-(len(suffix))])
-                le = 0 if not m else len(m.groups(1))
-                candidates.append((le, entry))
-        if not candidates:
+        if not barcode_column or not barcode_set:
             return None
-        else:
-            return list(sorted(candidates, key=lambda x: x[0]))[0][1]
+        if not hasattr(self, '_barcode_indices'):
+            self._barcode_indices = {}  # noqa
+        if barcode_set.pk not in self._barcode_indices:
+            self._barcode_indices[barcode_set.pk] = BarcodeSuffixIndex(
+                barcode_set.entries.all())
+        return self._barcode_indices[barcode_set.pk].lookup(
+            row[barcode_column - 1].strip())
 
     @classmethod
     def _extract_payload(cls, payload):
@@ -802,13 +884,25 @@ class SearchView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
 
     template_name = 'flowcells/search.html'
 
+    #: Number of results per page
+    paginate_by = 25
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        query = self.request.GET.get('q', '')
+        query = self.request.GET.get('q', '').strip()
         context['is_search'] = True
         if query:
-            context['results'] = models.Library.objects.filter(
-                name__icontains=query)
+            paginator = Paginator(search.SearchResults(query), self.paginate_by)
+            try:
+                page = paginator.page(self.request.GET.get('page', 1))
+            except PageNotAnInteger:
+                page = paginator.page(1)
+            except EmptyPage:
+                page = paginator.page(paginator.num_pages)
+            context['paginator'] = paginator
+            context['page_obj'] = page
+            context['is_paginated'] = page.has_other_pages()
+            context['results'] = page.object_list
         else:
             context['results'] = []
         context['query'] = query
@@ -0,0 +1 @@
+default_app_config = 'flowcelltool.threads.apps.ThreadsAppConfig'
@@ -1,5 +1,8 @@
 from django.apps import AppConfig
 
 
-class MessagesConfig(AppConfig):
-    name = 'messages'
+class ThreadsAppConfig(AppConfig):
+    name = 'flowcelltool.threads'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Management command for moving attachment payloads into the content-addressed storage"""
+
+import os.path
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Attachment, AttachmentBlob, AttachmentFile, hash_file
+from ...storage import attachment_storage, is_legacy_name
+
+
+class Command(BaseCommand):
+    """Move payloads without digest into the ``AttachmentBlob`` storage
+
+    This covers the payloads in the ``AttachmentFile`` table and identical payloads end up being
+    stored once.  The payloads are processed one at a time, each in its own transaction, so the
+    command can be interrupted and restarted at any time.
+    """
+
+    help = 'Move attachment payloads from the database into the deduplicated attachment storage'
+
+    def handle(self, *args, **options):
+        num_moved = 0
+        pks = list(Attachment.objects.filter(sha256__isnull=True).values_list('pk', flat=True))
+        for pk in pks:
+            with transaction.atomic():
+                attachment = Attachment.objects.select_for_update().get(pk=pk)
+                if not attachment.sha256:
+                    self._move(attachment)
+                    num_moved += 1
+        self.stdout.write('Moved {} attachment payload(s)'.format(num_moved))
+
+    def _move(self, attachment):
+        old_name = attachment.payload.name
+        filename = attachment.filename or os.path.basename(old_name)
+        mimetype = attachment.mimetype
+        if not mimetype and is_legacy_name(old_name):
+            mimetype = AttachmentFile.objects.filter(filename=old_name).values_list(
+                'mimetype', flat=True).first()
+        with attachment_storage.open(old_name) as old_file:
+            sha256, size = hash_file(old_file)
+            new_name = AttachmentBlob.acquire(old_file, sha256, size)
+        Attachment.objects.filter(pk=attachment.pk).update(
+            payload=new_name, sha256=sha256, size=size, filename=filename,
+            mimetype=mimetype or 'application/octet-stream')
+        transaction.on_commit(lambda: attachment_storage.delete(old_name))
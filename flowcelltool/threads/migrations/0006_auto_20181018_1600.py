@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 16:00
+from __future__ import unicode_literals
+
+import os.path
+
+from django.db import migrations, models
+import flowcelltool.threads.storage
+
+
+def fill_file_info(apps, schema_editor):
+    """Copy file name and MIME type of the attachments stored in the database"""
+    Attachment = apps.get_model('threads', 'Attachment')
+    AttachmentFile = apps.get_model('threads', 'AttachmentFile')
+    mimetypes = dict(AttachmentFile.objects.values_list('filename', 'mimetype'))
+    for attachment in Attachment.objects.all():
+        attachment.filename = os.path.basename(attachment.payload.name)
+        attachment.mimetype = mimetypes.get(attachment.payload.name, '')
+        attachment.save(update_fields=('filename', 'mimetype'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('threads', '0005_auto_20180321_0911'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='mimetype',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='payload',
+            field=models.FileField(max_length=255, storage=flowcelltool.threads.storage.AttachmentStorage(), upload_to='attachments/%Y/%m/%d'),
+        ),
+        migrations.RunPython(fill_file_info, migrations.RunPython.noop),
+    ]
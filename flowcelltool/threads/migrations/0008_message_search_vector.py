@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2018-10-18 21:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+#: Maintain search_vector on insert and update, the configuration must match ``search.py``
+CREATE_SQL = [
+    """
+    CREATE TRIGGER threads_message_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, body, search_vector ON threads_message
+    FOR EACH ROW EXECUTE PROCEDURE
+    tsvector_update_trigger(search_vector, 'pg_catalog.english', title, body);
+    """,
+    "UPDATE threads_message SET search_vector = to_tsvector("
+    "'pg_catalog.english', coalesce(title, '') || ' ' || coalesce(body, ''));",
+    'CREATE INDEX threads_message_search_vector ON threads_message USING gin (search_vector);',
+]
+
+DROP_SQL = [
+    'DROP INDEX threads_message_search_vector;',
+    'DROP TRIGGER threads_message_search_vector_update ON threads_message;',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('threads', '0007_attachmentblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
@@ -1,14 +1,20 @@
+import hashlib
+import mimetypes
+import os.path
 import uuid
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchVectorField
+from django.urls import reverse
 
-from db_file_storage.model_utils import delete_file, delete_file_if_needed
 from model_utils.models import TimeStampedModel
 
 from django.conf import settings
 
+from .storage import attachment_storage
+
 # Mixin for UUID ---------------------------------------------------------
 
 
@@ -58,6 +64,19 @@ class Message(UuidStampedMixin, TimeStampedModel):
     mime_type = models.CharField(max_length=50, default='text/plain',
                                  choices=FORMAT_CHOICES)
 
+    #: Full text search vector of title and body, maintained by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    def get_absolute_url(self):
+        return self.thread_object.get_absolute_url()
+
+    def get_search_result(self):
+        return {
+            'type': 'Message',
+            'title': self.title or '(untitled message)',
+            'description': 'on {}'.format(self.thread_object),
+        }
+
     # Permissions -------------------------------------------------------------
 
     # The boilerplate below ("DRY permissions") hooks up the DRY REST permission system into our
@@ -104,21 +123,142 @@ class Message(UuidStampedMixin, TimeStampedModel):
 
 
 class AttachmentFile(UuidStampedMixin, TimeStampedModel):
+    """Payload stored in the database by ``db_file_storage``, only used for legacy attachments"""
 
     bytes = models.TextField()
     filename = models.CharField(max_length=255)
     mimetype = models.CharField(max_length=255)
 
 
+#: Size of chunks to read when hashing payloads
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(content):
+    """Return SHA-256 hex digest and size of the file-like ``content``, reading it in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    content.seek(0)
+    for chunk in iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        digest.update(chunk)
+        size += len(chunk)
+    content.seek(0)
+    return digest.hexdigest(), size
+
+
+class AttachmentBlob(TimeStampedModel):
+    """A payload in the attachment storage, shared by all attachments with the same content
+
+    The payload is stored under a name derived from its SHA-256 digest (see ``get_name()``).
+    ``ref_count`` counts the referencing ``Attachment`` objects and the payload is removed from
+    the storage when the last one goes away.
+    """
+
+    #: Hex digest of the SHA-256 hash of the payload
+    sha256 = models.CharField(max_length=64, unique=True)
+    #: Size of the payload in bytes
+    size = models.BigIntegerField()
+    #: Number of ``Attachment`` objects referencing the payload
+    ref_count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def get_name(sha256):
+        """Return the name of the payload with the given digest in the storage"""
+        return 'blobs/{}/{}/{}'.format(sha256[:2], sha256[2:4], sha256)
+
+    @classmethod
+    def acquire(cls, content, sha256=None, size=None):
+        """Add a reference to the blob for the file-like ``content``, storing it if new
+
+        Return the name of the payload in the storage.
+        """
+        if sha256 is None:
+            sha256, size = hash_file(content)
+        name = cls.get_name(sha256)
+        with transaction.atomic():
+            blob, created = cls.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={'size': size, 'ref_count': 1})
+            if not created:
+                cls.objects.filter(pk=blob.pk).update(ref_count=models.F('ref_count') + 1)
+            if created or not attachment_storage.exists(name):
+                if attachment_storage.exists(name):  # left over from failed transaction
+                    attachment_storage.delete(name)
+                stored_name = attachment_storage.save(name, content)
+                assert stored_name == name, 'Unexpected name in storage: {}'.format(stored_name)
+        return name
+
+    @classmethod
+    def release(cls, sha256):
+        """Remove a reference to the blob, deleting the payload after the last one is gone"""
+        with transaction.atomic():
+            cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') - 1)
+            num_deleted, _ = cls.objects.filter(sha256=sha256, ref_count=0).delete()
+
+        def delete_payload():
+            # Hold the row of the digest while deleting, with a placeholder if it is gone.  A
+            # concurrent upload then either waits for the deletion or keeps the blob alive.
+            with transaction.atomic():
+                blob, created = cls.objects.select_for_update().get_or_create(
+                    sha256=sha256, defaults={'size': 0, 'ref_count': 0})
+                if created:
+                    attachment_storage.delete(cls.get_name(sha256))
+                    blob.delete()
+
+        if num_deleted:
+            transaction.on_commit(delete_payload)
+
+    def __str__(self):
+        return 'AttachmentBlob({}, {}, {})'.format(self.sha256, self.size, self.ref_count)
+
+
 class Attachment(UuidStampedMixin, TimeStampedModel):
     message = models.ForeignKey(Message, related_name='attachments', on_delete=models.CASCADE)
+    #: The payload, stored in the storage backend configured for attachments
     payload = models.FileField(
-        upload_to='threads.AttachmentFile/bytes/filename/mimetype')
+        storage=attachment_storage, upload_to='attachments/%Y/%m/%d', max_length=255)
+    #: Original file name
+    filename = models.CharField(max_length=255, blank=True, default='')
+    #: MIME type of the payload
+    mimetype = models.CharField(max_length=255, blank=True, default='')
+    #: Size of the payload in bytes, ``None`` for legacy payloads not moved from the database yet
+    size = models.BigIntegerField(null=True, blank=True)
+    #: SHA-256 hex digest of the payload, refers to the ``AttachmentBlob``, ``None`` for legacy
+    #: payloads not moved from the database yet
+    sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+
+    def get_absolute_url(self):
+        return reverse('threads:attachment_download', kwargs={'uuid': self.uuid})
 
     def save(self, *args, **kwargs):
-        delete_file_if_needed(self, 'payload')
-        super().save(*args, **kwargs)
-
-    def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        delete_file(self, 'payload')
+        old_payload = None
+        if self.payload and not self.payload._committed:  # new upload
+            self.filename = self.filename or os.path.basename(self.payload.name)
+            self.mimetype = (
+                self.mimetype or getattr(self.payload.file, 'content_type', None) or
+                mimetypes.guess_type(self.filename)[0] or 'application/octet-stream')
+            self.sha256, self.size = hash_file(self.payload.file)
+            if self.pk:
+                old_payload = Attachment.objects.filter(pk=self.pk).values_list(
+                    'payload', 'sha256').first()
+            with transaction.atomic():
+                self.payload.name = AttachmentBlob.acquire(
+                    self.payload.file, self.sha256, self.size)
+                self.payload._committed = True
+                super().save(*args, **kwargs)
+                if old_payload:
+                    release_payload(*old_payload)
+        else:
+            super().save(*args, **kwargs)
+
+
+def release_payload(name, sha256):
+    """Release the payload of a deleted or replaced ``Attachment``
+
+    Payloads shared through an ``AttachmentBlob`` are only deleted with the last reference.
+    """
+    if sha256:
+        AttachmentBlob.release(sha256)
+    elif name:
+        attachment_storage.delete(name)
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""Signal handlers for the threads app"""
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Attachment, release_payload
+
+
+@receiver(post_delete, sender=Attachment)
+def release_attachment_payload(sender, instance, **kwargs):
+    """Release the payload of deleted attachments, also when deleted along with their message"""
+    release_payload(instance.payload.name, instance.sha256)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Storage of attachment payloads outside of the database
+
+The payloads are stored in a pluggable Django storage backend configured with
+``THREADS_ATTACHMENT_STORAGE`` (dotted path) and ``THREADS_ATTACHMENT_STORAGE_OPTIONS``
+(keyword arguments), e.g., a ``FileSystemStorage`` on a local directory or an S3-compatible
+object store.  Payloads uploaded before are stored in the ``AttachmentFile`` table by
+``db_file_storage``.  They are read from there until moved by the ``move_attachments``
+management command.  Identical payloads are stored only once, see ``models.AttachmentBlob``.
+"""
+
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from db_file_storage.storage import DatabaseFileStorage
+
+
+#: Prefix of the names of payloads stored in the database by ``db_file_storage``
+LEGACY_PREFIX = 'threads.AttachmentFile/'
+
+#: The ``upload_to`` value used with ``db_file_storage``
+LEGACY_UPLOAD_TO = 'threads.AttachmentFile/bytes/filename/mimetype'
+
+
+def is_legacy_name(name):
+    """Return whether the payload ``name`` refers to the ``AttachmentFile`` table"""
+    return (name or '').startswith(LEGACY_PREFIX)
+
+
+@deconstructible
+class AttachmentStorage(Storage):
+    """Storage that writes to the configured backend and reads legacy payloads from the database
+    """
+
+    @cached_property
+    def backend(self):
+        """The configured storage backend"""
+        storage_class = import_string(settings.THREADS_ATTACHMENT_STORAGE)
+        return storage_class(**settings.THREADS_ATTACHMENT_STORAGE_OPTIONS)
+
+    @cached_property
+    def legacy(self):
+        """The ``db_file_storage`` storage for payloads not moved yet"""
+        return DatabaseFileStorage()
+
+    def _get_storage(self, name):
+        return self.legacy if is_legacy_name(name) else self.backend
+
+    def _open(self, name, mode='rb'):
+        return self._get_storage(name).open(name, mode)
+
+    def _save(self, name, content):
+        return self.backend.save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def delete(self, name):
+        self._get_storage(name).delete(name)
+
+    def exists(self, name):
+        return self._get_storage(name).exists(name)
+
+    def size(self, name):
+        return self._get_storage(name).size(name)
+
+    def url(self, name):
+        return self._get_storage(name).url(name)
+
+    def path(self, name):
+        """Return local file system path, raises ``NotImplementedError`` for remote storages"""
+        return self._get_storage(name).path(name)
+
+
+#: The storage instance for attachment payloads
+attachment_storage = AttachmentStorage()
@@ -8,4 +8,6 @@ urlpatterns = [
         views.MessageCreateView.as_view(), name='add'),
     url(r'^delete/(?P<attachment_uuid>\S+)/$',
         views.MessageDeleteView.as_view(), name='delete'),
+    url(r'^attachment/(?P<uuid>[0-9a-f-]+)/download/$',
+        views.AttachmentDownloadView.as_view(), name='attachment_download'),
 ]
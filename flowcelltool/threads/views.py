@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import FileResponse, HttpResponse
+from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.generic.base import View
 from django.shortcuts import redirect, get_object_or_404
 
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field
+from rules.contrib.views import PermissionRequiredMixin
 
-from .models import Message
+from .models import Attachment, Message
+from .storage import attachment_storage, is_legacy_name
 from . import forms
 
 
@@ -101,3 +108,37 @@ class MessageDeleteView(UuidViewMixin, DeleteView):
     def get_success_url(self):
         """Return absolute URL of the related object"""
         return self.object.thread_object.get_absolute_url()
+
+
+class AttachmentDownloadView(
+        LoginRequiredMixin, PermissionRequiredMixin, UuidViewMixin, SingleObjectMixin, View):
+    """Download of attachment payload
+
+    The payload is streamed from the storage in chunks.  For payloads on the local file
+    system, sending can be delegated to the web server with
+    ``settings.THREADS_ATTACHMENT_SENDFILE_HEADER``.
+    """
+
+    permission_required = 'threads.Attachment:retrieve'
+
+    #: The Model type to handle
+    model = Attachment
+
+    def get(self, request, *args, **kwargs):
+        attachment = self.get_object()
+        name = attachment.payload.name
+        header = settings.THREADS_ATTACHMENT_SENDFILE_HEADER
+        if header and not is_legacy_name(name):
+            response = HttpResponse(content_type=attachment.mimetype)
+            if header == 'X-Accel-Redirect':
+                response[header] = settings.THREADS_ATTACHMENT_SENDFILE_PREFIX + name
+            else:
+                response[header] = attachment_storage.path(name)
+        else:
+            response = FileResponse(
+                attachment_storage.open(name), content_type=attachment.mimetype or None)
+            if attachment.size is not None:
+                response['Content-Length'] = attachment.size
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            attachment.filename.replace('"', ''))
+        return response